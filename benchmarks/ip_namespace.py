@@ -0,0 +1,92 @@
+"""Compare the `ndpi` IP expressions against a Python loop with `ipaddress`.
+
+Run with `python benchmarks/ip_namespace.py [rows]`.
+"""
+
+import ipaddress
+import random
+import sys
+import time
+
+import polars as pl
+
+import ndpi.data.polars  # noqa: F401
+
+
+def _addresses(rows: int) -> pl.LazyFrame:
+    rng = random.Random(0)
+    v4 = [str(ipaddress.IPv4Address(rng.randrange(2**32))) for _ in range(rows // 2)]
+    v6 = [str(ipaddress.IPv6Address(rng.randrange(2**128))) for _ in range(rows // 2)]
+    return pl.LazyFrame({"addr": v4 + v6})
+
+
+def _python(function, dtype) -> pl.Expr:
+    def apply(address: str):
+        try:
+            return function(ipaddress.ip_address(address))
+        except ValueError:
+            return None
+
+    # The Series is built with `dtype`, `map_elements` infers struct fields from
+    # the values and fails on halves above the Int64 range
+    return pl.col("addr").map_batches(
+        lambda addresses: pl.Series([apply(a) for a in addresses], dtype=dtype),
+        return_dtype=dtype,
+    )
+
+
+CASES = {
+    "ip_to_int": (
+        pl.col("addr").ndpi.ip_to_int(),
+        _python(lambda ip: int(ip) if ip.version == 4 else None, pl.UInt32),
+    ),
+    "ip6_to_int": (
+        pl.col("addr").ndpi.ip6_to_int(),
+        _python(
+            lambda ip: {"hi": int(ip) >> 64, "lo": int(ip) & ((1 << 64) - 1)}
+            if ip.version == 6
+            else None,
+            pl.Struct({"hi": pl.UInt64, "lo": pl.UInt64}),
+        ),
+    ),
+    "in_cidr": (
+        pl.col("addr").ndpi.in_cidr(["10.0.0.0/8", "2001:db8::/32"]),
+        _python(
+            lambda ip: ip in ipaddress.ip_network("10.0.0.0/8")
+            or ip in ipaddress.ip_network("2001:db8::/32"),
+            pl.Boolean,
+        ),
+    ),
+    "prefix": (
+        pl.col("addr").ndpi.prefix(v4=24, v6=48),
+        _python(
+            lambda ip: str(
+                ipaddress.ip_network(f"{ip}/{24 if ip.version == 4 else 48}", strict=False)
+            ),
+            pl.String,
+        ),
+    ),
+    "is_private": (
+        pl.col("addr").ndpi.is_private(),
+        _python(lambda ip: ip.is_private, pl.Boolean),
+    ),
+}
+
+
+def _time(df: pl.LazyFrame, expr: pl.Expr) -> float:
+    start = time.perf_counter()
+    df.select(expr).collect()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = _addresses(rows).collect().lazy()
+    print(f"{rows} addresses, {pl.thread_pool_size()} threads")
+    print(f"{'case':<12} {'ndpi [s]':>10} {'ipaddress [s]':>14} {'speedup':>8}")
+    for name, (native, python) in CASES.items():
+        native_time, python_time = _time(df, native), _time(df, python)
+        print(
+            f"{name:<12} {native_time:>10.3f} {python_time:>14.3f} "
+            f"{python_time / native_time:>7.1f}x"
+        )
@@ -0,0 +1,77 @@
+"""Compare the `ndpi` list search expressions against the previous chained `list.eval`.
+
+Run with `python benchmarks/list_namespace.py [rows]`, e.g. 100_000_000 rows to
+match multi-valued tshark fields of large captures.
+"""
+
+import sys
+import time
+
+import polars as pl
+
+import ndpi.data.polars  # noqa: F401
+
+VALUES = [3, 17]
+
+
+def _lists(rows: int) -> pl.LazyFrame:
+    # 1 - 4 elements per row like repeated `ip.src` or TLS extension fields
+    return pl.LazyFrame().select(
+        values=pl.int_ranges(0, pl.int_range(rows) % 4 + 1).list.eval(
+            (pl.element() * 7 + pl.int_range(pl.len())) % 32
+        ),
+        other=pl.int_ranges(0, pl.int_range(rows) % 3 + 1),
+    )
+
+
+def _chained_index_of(expr: pl.Expr, values) -> pl.Expr:
+    """`list_index_of` before it was rewritten as a single pass."""
+    position = pl.int_range(start=1, end=pl.len() + 1)
+    return (
+        expr.list.eval(position * pl.element().is_in(values))
+        .list.eval(pl.element().filter(pl.element() > 0))
+        .list.eval(pl.element() - 1)
+    )
+
+
+CASES = {
+    "list_index_of": (
+        pl.col("values").ndpi.list_index_of(VALUES),
+        _chained_index_of(pl.col("values"), VALUES),
+    ),
+    "list_first_index_of": (
+        pl.col("values").ndpi.list_first_index_of(VALUES),
+        _chained_index_of(pl.col("values"), VALUES).list.first(),
+    ),
+    "list_contains_any": (
+        pl.col("values").ndpi.list_contains_any(VALUES),
+        _chained_index_of(pl.col("values"), VALUES).list.len() > 0,
+    ),
+    "list_intersect_positions": (
+        pl.col("values").ndpi.list_intersect_positions("other"),
+        None,
+    ),
+}
+
+
+def _time(df: pl.LazyFrame, expr: pl.Expr) -> float:
+    start = time.perf_counter()
+    df.select(expr).collect()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = _lists(rows).collect().lazy()
+    print(f"{rows} lists, {pl.thread_pool_size()} threads")
+    print(f"{'case':<26} {'ndpi [s]':>10} {'chained [s]':>12} {'speedup':>8}")
+    for name, (native, chained) in CASES.items():
+        native_time = _time(df, native)
+        if chained is None:
+            print(f"{name:<26} {native_time:>10.3f} {'-':>12} {'-':>8}")
+            continue
+        chained_time = _time(df, chained)
+        print(
+            f"{name:<26} {native_time:>10.3f} {chained_time:>12.3f} "
+            f"{chained_time / native_time:>7.1f}x"
+        )
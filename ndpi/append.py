@@ -0,0 +1,200 @@
+"""Incremental updates of datasets, see `ndpi.dataset`.
+
+`append` writes new rows as an additional part and adds it to the manifest,
+so an update costs I/O proportional to the new data. Parts are immutable:
+every part gets a unique name and is never rewritten. `compact` merges runs of
+small parts into larger ones, the merged parts are listed as retired in the
+manifest and only deleted by the next compaction, so that readers that listed
+them before the manifest changed can still scan them.
+
+Manifest updates are serialized by an exclusive lock on `LOCK_NAME` and the
+manifest itself is replaced atomically, readers never see a partial update.
+Compactions are serialized by `COMPACT_LOCK_NAME`, which is held while the
+merged parts are written, so appends are not blocked by a running compaction.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import threading
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+import polars as pl
+from loguru import logger
+
+from .convenience import sink_parquet
+from .dataset import Manifest, Part, is_dataset
+from .row_groups import build_stats, stats_path
+
+LOCK_NAME = "_manifest.lock"
+COMPACT_LOCK_NAME = "_compact.lock"
+# Parts smaller than this are merged by `compact`
+MIN_PART_SIZE = 64 * 1024 * 1024
+# Size of the parts created by `compact`
+TARGET_PART_SIZE = 512 * 1024 * 1024
+
+
+@contextmanager
+def lock(directory: Union[str, Path], name: str = LOCK_NAME) -> Iterator[None]:
+    """Hold an exclusive lock of a dataset directory.
+
+    Args:
+        directory: dataset directory, created if missing
+        name: lock file, `LOCK_NAME` for manifest updates or `COMPACT_LOCK_NAME`
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / name, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _read(directory: Path) -> Manifest:
+    return Manifest.read(directory) if is_dataset(directory) else Manifest()
+
+
+def _commit(directory: Path, manifest: Manifest) -> None:
+    manifest.write(directory)
+    # Keep an existing row group statistics manifest up to date, only new footers are read
+    if stats_path(directory).is_file():
+        build_stats(directory)
+
+
+def append(
+    directory: Union[str, Path],
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    source: str = "",
+    compact_in_background: bool = False,
+    **kwargs,
+) -> Part:
+    """Add rows to a dataset as a new part.
+
+    The part is written before the lock is taken, concurrent appends only wait
+    for each other's manifest update. A missing dataset is created.
+
+    Args:
+        directory: dataset directory
+        df: rows to append
+        source: input the rows were created from, e.g. the capture file
+        compact_in_background: start `compact` in a background thread afterwards
+        **kwargs: kwargs for `ndpi.convenience.sink_parquet`, e.g. `profile`
+
+    Returns:
+        The new part
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"part-{uuid.uuid4().hex}.pq.zst"
+    sink_parquet(df.lazy(), directory / name, **kwargs)
+    rows = pl.scan_parquet(directory / name).select(pl.len()).collect().item()
+    part = Part(path=name, rows=rows, source=source)
+    with lock(directory):
+        manifest = _read(directory)
+        manifest.parts.append(part)
+        _commit(directory, manifest)
+    if compact_in_background:
+        compact_background(directory)
+    return part
+
+
+def compact(
+    directory: Union[str, Path],
+    min_part_size: int = MIN_PART_SIZE,
+    target_size: int = TARGET_PART_SIZE,
+    **kwargs,
+) -> Manifest:
+    """Merge runs of consecutive small parts of a dataset.
+
+    Parts smaller than `min_part_size` bytes are merged with their small
+    neighbours into parts of up to `target_size` bytes, the row order of the
+    dataset does not change. Appends may continue while the merged parts are
+    written, concurrent compactions wait for each other. Parts retired by the
+    previous compaction are deleted.
+
+    Args:
+        directory: dataset directory
+        min_part_size: parts with fewer bytes are merged
+        target_size: maximum bytes of the parts that are merged into one
+        **kwargs: kwargs for `ndpi.convenience.sink_parquet`, e.g. `profile`
+
+    Returns:
+        The updated manifest
+    """
+    directory = Path(directory)
+    with lock(directory, COMPACT_LOCK_NAME):
+        return _compact(directory, min_part_size, target_size, **kwargs)
+
+
+def _compact(directory: Path, min_part_size: int, target_size: int, **kwargs) -> Manifest:
+    with lock(directory):
+        manifest = _read(directory)
+    runs: list[list[Part]] = []
+    run: list[Part] = []
+    size = 0
+    for part in manifest.parts:
+        part_size = os.path.getsize(directory / part.path)
+        if part_size >= min_part_size or size + part_size > target_size:
+            runs.append(run)
+            run, size = [], 0
+        if part_size < min_part_size:
+            run.append(part)
+            size += part_size
+    runs = [run for run in runs + [run] if len(run) > 1]
+
+    merged = []
+    for run in runs:
+        name = f"part-{uuid.uuid4().hex}.pq.zst"
+        lf = pl.concat(
+            [pl.scan_parquet(directory / part.path) for part in run], how="vertical_relaxed"
+        )
+        sink_parquet(lf, directory / name, **kwargs)
+        sources = dict.fromkeys(part.source for part in run if part.source)
+        merged.append((run, Part(name, sum(part.rows for part in run), ";".join(sources))))
+
+    with lock(directory):
+        manifest = _read(directory)
+        for path in manifest.retired:
+            (directory / path).unlink(missing_ok=True)
+        manifest.retired = []
+        for run, part in merged:
+            start = _find_run(manifest.parts, run)
+            if start is None:
+                # The manifest was rewritten by something other than `append`
+                logger.warning(f"Parts of {part.path} changed during compaction, discarding it")
+                (directory / part.path).unlink(missing_ok=True)
+                continue
+            manifest.parts[start : start + len(run)] = [part]
+            manifest.retired += [old.path for old in run]
+        _commit(directory, manifest)
+    return manifest
+
+
+def _find_run(parts: list[Part], run: list[Part]) -> Optional[int]:
+    """Index of `run` as a contiguous slice of `parts`, None if it is not."""
+    if run[0] not in parts:
+        return None
+    start = parts.index(run[0])
+    return start if parts[start : start + len(run)] == run else None
+
+
+def compact_background(directory: Union[str, Path], **kwargs) -> threading.Thread:
+    """Run `compact` in a background thread.
+
+    Args:
+        directory: dataset directory
+        **kwargs: kwargs for `compact`
+
+    Returns:
+        The started thread, join it to wait for the compaction
+    """
+    thread = threading.Thread(target=compact, args=(directory,), kwargs=kwargs, name="compact")
+    thread.start()
+    return thread
@@ -0,0 +1,402 @@
+"""Stream `tshark -T fields` output into parquet files.
+
+Kept separate from `ndpi.cli.tshark` so that polars is only imported when a
+capture is actually ingested, not on every CLI invocation.
+"""
+
+import glob
+import io
+import itertools
+import multiprocessing
+import os
+import subprocess
+import threading
+from collections.abc import Collection, Iterator, Mapping
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import IO, BinaryIO, Optional, Union
+
+import polars as pl
+from loguru import logger
+from polars.io.plugins import register_io_source
+
+from ndpi.cli.pcap import Shard, shard_capture
+from ndpi.cli.schema import field_exprs, field_schema, lookup_types
+from ndpi.cli.tshark import build_args
+from ndpi.convenience import sink_parquet
+from ndpi.dataset import Manifest, Part
+from ndpi.row_groups import build_stats
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def read_batches(
+    stream: IO[bytes],
+    columns: list[str],
+    separator: str = "|",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    schema: Optional[Mapping[str, pl.DataType]] = None,
+) -> Iterator[pl.DataFrame]:
+    """Parse `tshark -T fields` output in chunks of at most `chunk_size` bytes.
+
+    Each chunk ends at a line break, the incomplete last line is carried over
+    into the next chunk.
+
+    Args:
+        stream: binary stream with one packet per line
+        columns: names of the fields, in the order they were passed to tshark
+        separator: field separator passed to tshark via `-E separator=...`
+        chunk_size: number of bytes read per batch
+        schema: dtypes of the columns, inferred from the first chunk if None. Later
+            values that do not fit the inferred dtypes, e.g. `80,443` in an integer
+            column, are stored as null and counted in a warning.
+
+    Returns:
+        Iterator of DataFrames that all share the same schema
+    """
+    inferred: Optional[pl.Schema] = None
+    remainder = b""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        data = remainder + data
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            remainder = data
+            continue
+        remainder = data[end:]
+        batch = _parse(data[:end], columns, separator, schema, inferred)
+        if schema is None and inferred is None:
+            inferred = batch.schema
+        yield batch
+    if remainder.strip():
+        yield _parse(remainder, columns, separator, schema, inferred)
+
+
+def _parse(
+    data: bytes,
+    columns: list[str],
+    separator: str,
+    schema: Optional[Mapping[str, pl.DataType]],
+    inferred: Optional[pl.Schema] = None,
+) -> pl.DataFrame:
+    if inferred is not None:
+        # Parsed as text, a chunk may not fit the dtypes inferred from the first one
+        text = _parse(data, columns, separator, {name: pl.String() for name in columns})
+        batch = text.with_columns(
+            pl.col(name).cast(dtype, strict=False) for name, dtype in inferred.items()
+        )
+        lost = {
+            name: count
+            for name in columns
+            if (count := batch[name].null_count() - text[name].null_count())
+        }
+        if lost:
+            logger.warning(
+                f"Values that do not fit the dtypes inferred from the first chunk are "
+                f"stored as null: {lost}"
+            )
+        return batch
+    return pl.read_csv(
+        io.BytesIO(data),
+        has_header=False,
+        separator=separator,
+        quote_char=None,
+        new_columns=None if schema else columns,
+        schema=schema,
+        infer_schema_length=None,
+    )
+
+
+def scan_batches(
+    batches: Iterator[pl.DataFrame],
+    columns: list[str],
+    schema: Optional[Mapping[str, pl.DataType]] = None,
+) -> pl.LazyFrame:
+    """Wrap a one-shot iterator of batches in a LazyFrame for streaming sinks.
+
+    The schema is taken from the first batch, so the first batch is read eagerly.
+
+    Args:
+        batches: DataFrames that share the same schema, e.g. from `read_batches`
+        columns: column names used for the schema when there are no batches
+        schema: dtypes used when there are no batches, default: all `pl.String`
+
+    Returns:
+        LazyFrame that can be collected or sunk exactly once
+    """
+    first = next(batches, None)
+    if first is None:
+        first = pl.DataFrame(schema=schema or {column: pl.String() for column in columns})
+
+    def source(
+        with_columns: Optional[list[str]],
+        predicate: Optional[pl.Expr],
+        n_rows: Optional[int],
+        batch_size: Optional[int],
+    ) -> Iterator[pl.DataFrame]:
+        for batch in itertools.chain([first], batches):
+            if with_columns is not None:
+                batch = batch.select(with_columns)
+            if predicate is not None:
+                batch = batch.filter(predicate)
+            if n_rows is not None:
+                batch = batch.head(n_rows)
+                n_rows -= batch.height
+            yield batch
+            if n_rows == 0:
+                break
+
+    return register_io_source(source, schema=first.schema)
+
+
+def convert_batches(
+    batches: Iterator[pl.DataFrame],
+    types: dict[str, str],
+    list_fields: Collection[str] = (),
+    categorical_fields: Collection[str] = (),
+) -> Iterator[pl.DataFrame]:
+    """Convert text batches into the dtypes of their tshark datatypes, see `ndpi.cli.schema`.
+
+    Args:
+        batches: batches read with all columns as `pl.String`
+        types: field name -> tshark datatype, e.g. `FT_UINT16`
+        list_fields: fields that keep all occurrences as list
+        categorical_fields: string fields stored as Categorical
+
+    Values that tshark prints in an unexpected format, e.g. an enum label in
+    an integer field, become null. Their number per column is logged as a warning.
+
+    Returns:
+        Iterator of converted DataFrames
+    """
+    exprs = field_exprs(types, list_fields, categorical_fields)
+    for batch in batches:
+        converted = batch.select(exprs)
+        lost = _lost_values(batch, converted)
+        if lost:
+            logger.warning(f"Values that do not fit the field types are stored as null: {lost}")
+        yield converted
+
+
+def _lost_values(text: pl.DataFrame, converted: pl.DataFrame) -> dict[str, int]:
+    """Number of non-empty values per column that were converted to null."""
+    counts = converted.select(
+        (
+            pl.col(name).list.eval(pl.element().is_null()).list.sum().sum()
+            if isinstance(dtype, pl.List)
+            else (pl.col(name).is_null() & text.get_column(name).ne("").fill_null(False)).sum()
+        ).alias(name)
+        for name, dtype in converted.schema.items()
+    )
+    return {name: count for name, count in counts.row(0, named=True).items() if count}
+
+
+def ingest_capture(
+    capture: Union[str, Path, Shard],
+    field_names: list[str],
+    output: Path,
+    separator: str = "|",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    include_disable_options: bool = True,
+    types: Optional[dict[str, str]] = None,
+    list_fields: Collection[str] = (),
+    categorical_fields: Collection[str] = (),
+) -> Path:
+    """Run tshark on a capture and sink the extracted fields into a zstd parquet file.
+
+    tshark writes to a pipe that is read in chunks of `chunk_size` bytes, so
+    memory does not depend on the size of the capture and no intermediate CSV
+    file is written.
+
+    With `types`, every column is converted according to the tshark datatype of
+    its field while parsing (e.g. `FT_UINT16` -> UInt16, `FT_IPv4` -> UInt32,
+    `FT_ABSOLUTE_TIME` -> Datetime), otherwise dtypes are inferred from the
+    first chunk.
+
+    Args:
+        capture: pcap/pcapng file, "-" to read the capture from stdin, or a shard of a
+            capture that is streamed into tshark's stdin, its `frame.number` counts
+            from the start of the capture
+        field_names: tshark fields to extract, one column each
+        output: destination parquet file
+        separator: field separator used between tshark and the parser
+        chunk_size: number of bytes parsed per batch
+        include_disable_options: pass the recommended `-o` disable options
+        types: field name -> tshark datatype, e.g. from `query_fields`
+        list_fields: fields that keep all occurrences instead of only the first one
+        categorical_fields: string fields stored as Categorical
+
+    Returns:
+        Path of the written parquet file
+    """
+    shard = capture if isinstance(capture, Shard) else None
+    args = build_args(
+        field_names,
+        capture="-" if shard else str(capture),
+        include_disable_options=include_disable_options,
+        separator=separator,
+    )
+    # Formatted absolute times are printed in the local time zone of tshark
+    process = subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE if shard else None,
+        stdout=subprocess.PIPE,
+        env={**os.environ, "TZ": "UTC"},
+    )
+    stdout = process.stdout
+    assert stdout is not None
+    if shard:
+        threading.Thread(target=_feed, args=(shard, process.stdin), daemon=True).start()
+    try:
+        if types is None:
+            schema = None
+            batches = read_batches(stdout, field_names, separator, chunk_size)
+        else:
+            types = lookup_types(field_names, types)
+            schema = field_schema(types, list_fields, categorical_fields)
+            text = {name: pl.String() for name in field_names}
+            batches = read_batches(stdout, field_names, separator, chunk_size, text)
+            batches = convert_batches(batches, types, list_fields, categorical_fields)
+        lf = scan_batches(_check_exit(batches, process), field_names, schema)
+        if shard and shard.frame_offset and "frame.number" in field_names:
+            # tshark counts the frames of a shard from 1
+            lf = lf.with_columns(pl.col("frame.number") + shard.frame_offset)
+        # The file is only moved to `output` if tshark exited successfully
+        sink_parquet(lf, output, compression="zstd")
+    except pl.exceptions.ComputeError as error:
+        if process.poll():
+            raise RuntimeError(f"tshark exited with status {process.returncode}") from error
+        raise
+    finally:
+        if process.poll() is None:
+            process.kill()
+        stdout.close()
+        process.wait()
+    return output
+
+
+def _feed(shard: Shard, stdin: BinaryIO) -> None:
+    try:
+        shard.feed(stdin)
+    except BrokenPipeError:
+        # tshark exited early, the exit status is reported by `ingest_capture`
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def _check_exit(
+    batches: Iterator[pl.DataFrame], process: subprocess.Popen
+) -> Iterator[pl.DataFrame]:
+    yield from batches
+    if process.wait() != 0:
+        raise RuntimeError(f"tshark exited with status {process.returncode}")
+
+
+def expand_captures(patterns: list[Union[str, Path]]) -> list[Path]:
+    """Resolve capture files, directories and glob patterns into a sorted list of files.
+
+    Directories contribute all non-hidden files they contain, since rotated
+    captures often have no common extension (e.g. `tcpdump -C` output).
+
+    Args:
+        patterns: files, directories or glob patterns
+
+    Returns:
+        Sorted list of unique files
+    """
+    files = set()
+    for pattern in map(str, patterns):
+        if os.path.isdir(pattern):
+            files.update(
+                path
+                for path in Path(pattern).iterdir()
+                if path.is_file() and not path.name.startswith(".")
+            )
+        elif glob.has_magic(pattern):
+            files.update(Path(path) for path in glob.glob(pattern) if os.path.isfile(path))
+        else:
+            files.add(Path(pattern))
+    return sorted(files)
+
+
+def ingest_captures(
+    captures: list[Path],
+    field_names: list[str],
+    directory: Path,
+    workers: Optional[int] = None,
+    shard_size: Optional[int] = None,
+    **kwargs,
+) -> Manifest:
+    """Ingest several captures in parallel into a dataset directory.
+
+    Each capture is processed by its own tshark and parser in a process pool
+    and written as one part, the parts are listed in capture order in the
+    manifest of `directory`, see `ndpi.dataset`. The row group statistics
+    manifest of the dataset is rebuilt afterwards, see `ndpi.row_groups`.
+
+    With `shard_size`, uncompressed pcap/pcapng captures are additionally split
+    into shards of about `shard_size` bytes that are dissected in parallel and
+    written as consecutive parts. `frame.number` is offset to count from the
+    start of the capture, but state that tshark keeps across packets (TCP
+    reassembly and analysis, stream indices, relative times) restarts in each
+    shard.
+
+    Args:
+        captures: capture files, e.g. from `expand_captures`
+        field_names: tshark fields to extract, one column each
+        directory: dataset directory, created if missing
+        workers: number of concurrent tshark processes, default: number of CPUs
+        shard_size: split captures into shards of this many bytes, None to disable
+        **kwargs: kwargs for `ingest_capture`
+
+    Returns:
+        Manifest of the written dataset
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    inputs: list[tuple[Path, Union[Path, Shard]]] = []
+    for capture in captures:
+        shards = shard_capture(capture, shard_size) if shard_size else None
+        inputs += [(capture, shard) for shard in shards or [capture]]
+    width = max(5, len(str(len(inputs))))
+    names = [f"part-{index:0{width}d}.pq.zst" for index in range(len(inputs))]
+
+    # spawn: forking a process that already runs polars threads can deadlock
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context)
+    try:
+        futures = [
+            pool.submit(ingest_capture, source, field_names, directory / name, **kwargs)
+            for (_, source), name in zip(inputs, names)
+        ]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            error = future.exception() if future in done else None
+            if error is not None:
+                raise error
+    finally:
+        # A failure is raised right away instead of after the running workers finished
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    manifest = Manifest()
+    for (capture, source), name in zip(inputs, names):
+        if isinstance(source, Shard):
+            label = f"{capture}:{source.start}-{source.end}"
+        else:
+            label = str(capture)
+        manifest.parts.append(Part(path=name, rows=_count_rows(directory / name), source=label))
+    manifest.write(directory)
+    # Parts of a previous, larger ingest into the same directory
+    for stale in set(directory.glob("part-*.pq.zst")) - set(manifest.files(directory)):
+        stale.unlink()
+    build_stats(directory)
+    return manifest
+
+
+def _count_rows(path: Path) -> int:
+    return pl.scan_parquet(path).select(pl.len()).collect().item()
@@ -0,0 +1,134 @@
+"""Split pcap/pcapng captures into packet-aligned byte ranges.
+
+Only record/block headers are read to find the split points, the packets are
+later streamed from the file into tshark with `os.sendfile`, so sharding a
+capture does not copy its payload through Python.
+"""
+
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from itertools import pairwise
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+# magic -> byte order
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": "<",
+    b"\xa1\xb2\xc3\xd4": ">",
+    b"\x4d\x3c\xb2\xa1": "<",
+    b"\xa1\xb2\x3c\x4d": ">",
+}
+# The section header block type reads the same in both byte orders
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_PACKET_BLOCKS = (2, 3, 6)
+
+
+@dataclass(frozen=True)
+class Shard:
+    path: str
+    # global header (pcap) or section header and interface blocks (pcapng)
+    header: bytes
+    start: int
+    end: int
+    # Packets of the capture before the shard, tshark counts frames from 1 in each shard
+    frame_offset: int = 0
+
+    def feed(self, stream: BinaryIO) -> None:
+        """Write the shard as a standalone capture into a pipe or file.
+
+        Args:
+            stream: binary stream, e.g. the stdin of tshark
+        """
+        stream.write(self.header)
+        stream.flush()
+        with open(self.path, "rb") as capture:
+            offset = self.start
+            while offset < self.end:
+                sent = os.sendfile(stream.fileno(), capture.fileno(), offset, self.end - offset)
+                if sent == 0:
+                    break
+                offset += sent
+
+
+def shard_capture(path: Union[str, Path], shard_size: int) -> Optional[list[Shard]]:
+    """Split a classic pcap or pcapng file into shards of roughly `shard_size` bytes.
+
+    Split points are found by walking the record headers from the start of the
+    file, so payloads that look like records (e.g. captured pcap transfers) can
+    not be mistaken for a boundary. A shard ends at the first record boundary
+    at least `shard_size` bytes after its start.
+
+    pcapng files must declare their interfaces before the first packet and
+    consist of a single section, which is what tshark, dumpcap and tcpdump write.
+    Nothing is split after a second section header or a malformed block.
+
+    Args:
+        path: capture file
+        shard_size: desired number of bytes per shard
+
+    Returns:
+        Shards in capture order, None if the file is no uncompressed pcap/pcapng
+    """
+    with open(path, "rb") as capture:
+        head = capture.read(24)
+        layout = _pcap_layout(head) or _pcapng_layout(head)
+        if layout is None:
+            return None
+        size = capture.seek(0, os.SEEK_END)
+        with mmap.mmap(capture.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_size, boundaries = layout(data, size, shard_size)
+            header = data[:header_size]
+    boundaries.append((size, 0))
+    return [
+        Shard(str(path), header, start, end, frames)
+        for (start, frames), (end, _) in pairwise(boundaries)
+    ]
+
+
+def _pcap_layout(head: bytes):
+    if len(head) < 24 or head[:4] not in PCAP_MAGIC:
+        return None
+    record = struct.Struct(f"{PCAP_MAGIC[head[:4]]}I")
+
+    def walk(data: mmap.mmap, size: int, shard_size: int) -> tuple[int, list[tuple[int, int]]]:
+        boundaries = [(24, 0)]
+        position, packets = 24, 0
+        while position + 16 <= size:
+            if position >= boundaries[-1][0] + shard_size:
+                boundaries.append((position, packets))
+            position += 16 + record.unpack_from(data, position + 8)[0]
+            packets += 1
+        return 24, boundaries
+
+    return walk
+
+
+def _pcapng_layout(head: bytes):
+    if len(head) < 12 or struct.unpack("<I", head[:4])[0] != PCAPNG_SECTION_HEADER:
+        return None
+    order = "<" if head[8:12] == b"\x4d\x3c\x2b\x1a" else ">"
+    block = struct.Struct(f"{order}II")
+
+    def walk(data: mmap.mmap, size: int, shard_size: int) -> tuple[int, list[tuple[int, int]]]:
+        # Everything before the first packet: section header, interfaces, name resolution
+        first, boundaries = None, []
+        position, packets = 0, 0
+        while position + 12 <= size:
+            kind, length = block.unpack_from(data, position)
+            if length < 12 or length % 4 or (kind == PCAPNG_SECTION_HEADER and position):
+                break
+            if kind in PCAPNG_PACKET_BLOCKS:
+                if first is None:
+                    first = position
+                    boundaries.append((position, packets))
+                elif position >= boundaries[-1][0] + shard_size:
+                    boundaries.append((position, packets))
+                packets += 1
+            position += length
+        if first is None:
+            return size, [(size, 0)]
+        return first, boundaries
+
+    return walk
@@ -0,0 +1,209 @@
+"""Typed columns for tshark fields, derived from their FT_* datatypes.
+
+tshark prints every field as text. The expressions here turn the text
+columns into compact polars dtypes while a capture is ingested, so packet
+tables are filtered on integers instead of strings.
+"""
+
+from collections.abc import Collection
+from typing import Optional
+
+import polars as pl
+
+from ndpi.data.polars import Ndpi
+
+# tshark datatype -> polars dtype, types that are missing stay strings.
+# FT_CHAR is printed as a character, not as its code, so it stays a string.
+FT_DTYPES: dict[str, pl.DataType] = {
+    "FT_BOOLEAN": pl.Boolean(),
+    "FT_UINT8": pl.UInt8(),
+    "FT_UINT16": pl.UInt16(),
+    "FT_UINT24": pl.UInt32(),
+    "FT_UINT32": pl.UInt32(),
+    "FT_UINT40": pl.UInt64(),
+    "FT_UINT48": pl.UInt64(),
+    "FT_UINT56": pl.UInt64(),
+    "FT_UINT64": pl.UInt64(),
+    "FT_INT8": pl.Int8(),
+    "FT_INT16": pl.Int16(),
+    "FT_INT24": pl.Int32(),
+    "FT_INT32": pl.Int32(),
+    "FT_INT40": pl.Int64(),
+    "FT_INT48": pl.Int64(),
+    "FT_INT56": pl.Int64(),
+    "FT_INT64": pl.Int64(),
+    "FT_FRAMENUM": pl.UInt32(),
+    "FT_FLOAT": pl.Float32(),
+    "FT_DOUBLE": pl.Float64(),
+    "FT_ABSOLUTE_TIME": pl.Datetime("ns", "UTC"),
+    "FT_RELATIVE_TIME": pl.Duration("ns"),
+    "FT_IPv4": pl.UInt32(),
+    "FT_PROTOCOL": pl.Categorical(),
+}
+
+# One occurrence of a field, formatted absolute times contain a comma themselves
+OCCURRENCE = r"(?:[A-Z][a-z]{2} +\d+, )?[^,]*"
+
+# Formats of FT_ABSOLUTE_TIME values that are not printed as epoch seconds
+ABSOLUTE_TIME_FORMATS = ["%b %e, %Y %H:%M:%S%.f", "%Y-%m-%dT%H:%M:%S%.f", "%Y-%m-%d %H:%M:%S%.f"]
+
+
+def field_dtype(
+    datatype: str, as_list: bool = False, categorical: bool = False
+) -> pl.DataType:
+    """Polars dtype of a tshark field after `field_expr`.
+
+    Args:
+        datatype: tshark datatype, e.g. `FT_UINT16`
+        as_list: keep all occurrences of the field
+        categorical: store string fields as Categorical
+
+    Returns:
+        polars dtype
+    """
+    dtype = FT_DTYPES.get(datatype, pl.Categorical() if categorical else pl.String())
+    return pl.List(dtype) if as_list else dtype
+
+
+def field_expr(
+    name: str, datatype: str, as_list: bool = False, categorical: bool = False
+) -> pl.Expr:
+    """Convert the text column of a tshark field into its compact dtype.
+
+    Fields that occur several times in a packet (e.g. `ip.src` with tunnels)
+    are printed comma separated, only the first occurrence is kept unless
+    `as_list` is set. String fields are never split since they may contain commas.
+    Values in an unexpected format become null, `convert_batches` counts them.
+
+    Args:
+        name: column with the text output of the field
+        datatype: tshark datatype, e.g. `FT_UINT16`
+        as_list: keep all occurrences as list
+        categorical: store string fields as Categorical
+
+    Returns:
+        Expression with the dtype from `field_dtype`
+    """
+    column = pl.col(name)
+    dtype = field_dtype(datatype, categorical=categorical)
+    if datatype not in FT_DTYPES:
+        values = column.str.split(",") if as_list else column
+        return values.cast(pl.List(dtype) if as_list else dtype)
+    if as_list:
+        occurrences = column.str.extract_all(OCCURRENCE).list.filter(pl.element() != "")
+        return occurrences.list.eval(_convert(pl.element(), datatype, dtype))
+    if dtype != pl.Categorical():
+        column = column.str.extract(f"^({OCCURRENCE})")
+    return _convert(column, datatype, dtype).alias(name)
+
+
+def _convert(value: pl.Expr, datatype: str, dtype: pl.DataType) -> pl.Expr:
+    value = pl.when(value != "").then(value)
+    if dtype == pl.Boolean():
+        return pl.when(value.is_in(["1", "True", "TRUE"])).then(True).when(
+            value.is_in(["0", "False", "FALSE"])
+        ).then(False)
+    if dtype.is_integer() and datatype != "FT_IPv4":
+        # Fields displayed in hex are printed with a 0x prefix
+        wide = pl.Int64 if dtype.is_signed_integer() else pl.UInt64
+        return (
+            pl.when(value.str.starts_with("0x"))
+            .then(value.str.slice(2).str.to_integer(base=16, dtype=wide, strict=False))
+            .otherwise(value.str.to_integer(dtype=wide, strict=False))
+            .cast(dtype, strict=False)
+        )
+    if dtype.is_float():
+        return value.cast(dtype, strict=False)
+    if datatype == "FT_IPv4":
+        return Ndpi(value).ip_to_int()
+    if datatype == "FT_ABSOLUTE_TIME":
+        # tshark runs with TZ=UTC, so formatted times are UTC as well
+        value = value.str.replace(r"( [A-Z]{3,5}|Z)$", "")
+        formatted = pl.coalesce(
+            [
+                value.str.strptime(pl.Datetime("ns"), format, strict=False)
+                for format in ABSOLUTE_TIME_FORMATS
+            ]
+        )
+        return (
+            pl.when(value.str.contains(r"^\d+(\.\d+)?$"))
+            .then(_nanoseconds(value).cast(pl.Datetime("ns")))
+            .otherwise(formatted)
+            .dt.replace_time_zone("UTC")
+        )
+    if datatype == "FT_RELATIVE_TIME":
+        return _nanoseconds(value).cast(pl.Duration("ns"))
+    return value.cast(dtype)
+
+
+def _nanoseconds(value: pl.Expr) -> pl.Expr:
+    """Exact nanoseconds of decimal seconds like `-1.000000001`, without float rounding."""
+    sign = pl.when(value.str.starts_with("-")).then(-1).otherwise(1)
+    seconds = value.str.extract(r"^-?(\d+)").str.to_integer(strict=False)
+    fraction = value.str.extract(r"\.(\d{1,9})").str.pad_end(9, "0").str.to_integer(strict=False)
+    return sign * (seconds * 1_000_000_000 + fraction.fill_null(0))
+
+
+def field_exprs(
+    types: dict[str, str],
+    list_fields: Collection[str] = (),
+    categorical_fields: Collection[str] = (),
+) -> list[pl.Expr]:
+    """`field_expr` for every field of a capture.
+
+    Args:
+        types: field name -> tshark datatype
+        list_fields: fields that keep all occurrences
+        categorical_fields: string fields stored as Categorical
+
+    Returns:
+        One expression per field
+    """
+    return [
+        field_expr(
+            name,
+            datatype,
+            as_list=name in list_fields,
+            categorical=name in categorical_fields,
+        )
+        for name, datatype in types.items()
+    ]
+
+
+def field_schema(
+    types: dict[str, str],
+    list_fields: Collection[str] = (),
+    categorical_fields: Collection[str] = (),
+) -> dict[str, pl.DataType]:
+    """Schema of the columns produced by `field_exprs`.
+
+    Args:
+        types: field name -> tshark datatype
+        list_fields: fields that keep all occurrences
+        categorical_fields: string fields stored as Categorical
+
+    Returns:
+        column name -> polars dtype
+    """
+    return {
+        name: field_dtype(
+            datatype,
+            as_list=name in list_fields,
+            categorical=name in categorical_fields,
+        )
+        for name, datatype in types.items()
+    }
+
+
+def lookup_types(names: list[str], datatypes: Optional[dict[str, str]] = None) -> dict[str, str]:
+    """Datatypes of `names`, fields tshark does not know are kept as strings.
+
+    Args:
+        names: field names in output order
+        datatypes: field name -> datatype, e.g. from `query_fields`
+
+    Returns:
+        field name -> datatype for all `names`
+    """
+    datatypes = datatypes or {}
+    return {name: datatypes.get(name, "FT_STRING") for name in names}
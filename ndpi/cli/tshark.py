@@ -1,9 +1,14 @@
+import hashlib
+import json
 import os
 import shlex
 import shutil
 import subprocess
 import sys
-from dataclasses import dataclass
+from dataclasses import astuple, dataclass
+from dataclasses import fields as dataclass_fields
+from pathlib import Path
+from typing import Any, Optional
 
 import click
 
@@ -48,13 +53,40 @@ def _require(binary: str) -> str:
     return path
 
 
-def query_fields() -> list[TsharkField]:
+def cache_dir() -> Path:
+    """Directory for cached tshark metadata, `$XDG_CACHE_HOME/ndpi` or `~/.cache/ndpi`."""
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "ndpi"
+
+
+def query_fields(refresh: bool = False) -> list[TsharkField]:
     """Ask the locally installed tshark for its field list.
 
-    Queried live (not cached) so the field list always matches whatever
-    tshark version the user actually has installed.
+    Running `tshark -G fields` takes several seconds, so the parsed list is
+    cached as Arrow IPC file in `cache_dir()`. The cache is keyed by the resolved
+    tshark binary and its modification time and size, so it is rebuilt
+    automatically when tshark is upgraded and tshark is not started at all while
+    the cache is valid.
+
+    Args:
+        refresh: ignore and rebuild the cache
+
+    Returns:
+        All protocols and fields known to tshark
     """
     tshark_bin = _require("tshark")
+    binary = Path(tshark_bin).resolve()
+    stat = binary.stat()
+    key = json.dumps([str(binary), stat.st_mtime_ns, stat.st_size])
+    prefix = f"tshark-fields-{hashlib.sha256(str(binary).encode()).hexdigest()[:16]}"
+    cache = cache_dir() / f"{prefix}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.arrow"
+
+    if not refresh and cache.is_file():
+        try:
+            return _read_field_cache(cache)
+        except (OSError, ValueError) as error:
+            # e.g. truncated or written by an incompatible version: rebuild it
+            click.echo(f"Warning: ignoring tshark field cache {cache}: {error}", err=True)
+
     result = subprocess.run(
         [tshark_bin, "-G", "fields"], capture_output=True, text=True, check=True
     )
@@ -72,9 +104,48 @@ def query_fields() -> list[TsharkField]:
                 protocol=columns[4] if len(columns) > 4 else "",
             )
         )
+
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        # Caches of previous versions of the same binary
+        for stale in cache.parent.glob(f"{prefix}-*.arrow"):
+            stale.unlink()
+        _write_field_cache(fields, cache)
+    except OSError as error:
+        # A read-only home directory must not break field selection
+        click.echo(f"Warning: could not cache tshark fields in {cache}: {error}", err=True)
     return fields
 
 
+def _write_field_cache(fields: list[TsharkField], path: Path) -> None:
+    # Imported here so that polars is only loaded when the cache is used
+    import polars as pl
+
+    temp_path = f"{path}.temp"
+    pl.DataFrame(
+        [astuple(field) for field in fields],
+        schema=[field.name for field in dataclass_fields(TsharkField)],
+        orient="row",
+    ).write_ipc(temp_path, compression="zstd")
+    os.replace(temp_path, path)
+
+
+def _read_field_cache(path: Path) -> list[TsharkField]:
+    """Read a cache written by `_write_field_cache`.
+
+    Raises:
+        OSError: the cache cannot be read
+        ValueError: the cache is corrupt or has a different layout
+    """
+    import polars as pl
+
+    try:
+        df = pl.read_ipc(path, memory_map=False)
+        return list(map(TsharkField, *(column.to_list() for column in df.get_columns())))
+    except (pl.exceptions.PolarsError, TypeError) as error:
+        raise ValueError(f"invalid field cache: {error}") from error
+
+
 def select_fields(fields: list[TsharkField]) -> list[str]:
     fzf_bin = _require("fzf")
     listing = "\n".join(field.display() for field in fields)
@@ -131,6 +202,29 @@ def build_command(
     return "\n".join(lines)
 
 
+def build_args(
+    field_names: list[str],
+    capture: str = "-",
+    include_disable_options: bool = True,
+    output_format: str = "fields",
+    separator: str = "|",
+) -> list[str]:
+    """Argument list for running tshark directly, the counterpart of `build_command`.
+
+    Unlike `build_command`, the capture is not written back to stdout (`-w -`),
+    so stdout only carries the extracted fields.
+    """
+    args = [_require("tshark"), "-nr", capture, "-T", output_format]
+    if output_format == "fields":
+        args += ["-E", f"separator={separator}"]
+    if include_disable_options:
+        for option, value in DEFAULT_DISABLED_OPTIONS:
+            args += ["-o", f"{option}:{value}"]
+    for name in field_names:
+        args += ["-e", name]
+    return args
+
+
 def _command_building_options(f):
     """Options controlling how `extract` renders the tshark command."""
     f = click.option(
@@ -161,8 +255,19 @@ def _command_building_options(f):
 
 
 @click.group()
-def tshark():
-    """Build tshark field-extraction commands."""
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Rebuild the cached field list, see `query_fields`.",
+)
+@click.pass_context
+def tshark(ctx: click.Context, refresh: bool):
+    """Build tshark field-extraction commands and ingest captures."""
+    ctx.obj = {"refresh": refresh}
+
+
+def _fields() -> list[TsharkField]:
+    return query_fields(refresh=click.get_current_context().obj["refresh"])
 
 
 @tshark.command(name="fields", short_help="Print all fields tshark knows about.")
@@ -172,8 +277,7 @@ def list_fields():
     One field per line, formatted as `name (description, datatype, protocol)`
     with any missing parts omitted, e.g. `ip.src (Source Address, FT_IPv4, ip)`.
     """
-    for field in query_fields():
-        click.echo(field.display())
+    click.echo("\n".join(field.display() for field in _fields()))
 
 
 @tshark.command(
@@ -182,7 +286,7 @@ def list_fields():
     help=f"Interactively select fields via fzf.\n\n{FZF_HELP_REMARK} Selected field names are printed one per line.",
 )
 def select():
-    for name in select_fields(query_fields()):
+    for name in select_fields(_fields()):
         click.echo(name)
 
 
@@ -211,7 +315,7 @@ def extract(
     elif not sys.stdin.isatty():
         names = [line.strip() for line in sys.stdin if line.strip()]
     else:
-        names = select_fields(query_fields())
+        names = select_fields(_fields())
 
     if not names:
         raise click.ClickException("No fields selected.")
@@ -224,3 +328,152 @@ def extract(
             separator=separator,
         )
     )
+
+
+@tshark.command(
+    name="ingest",
+    short_help="Convert captures into parquet files.",
+    help=(
+        "Run tshark on CAPTURES and stream the selected fields into parquet, "
+        "readable with `load_data(name)`.\n\n"
+        "A single capture file is written to `{output-dir}/{name}.pq.zst`, use '-' "
+        "to read it from stdin. Several files, directories or (quoted) glob patterns "
+        "are ingested in parallel into the dataset directory `{output-dir}/{name}/` "
+        "with one part per capture and a `_manifest.json`. With --shard-size, "
+        "captures (also a single one) are split into shards that are dissected "
+        "in parallel and written as consecutive parts of the dataset.\n\n"
+        "Columns get compact types derived from the tshark datatype of each field, "
+        "e.g. FT_UINT16 -> UInt16, FT_IPv4 -> UInt32, FT_ABSOLUTE_TIME -> Datetime. "
+        "Fields that occur several times per packet keep their first occurrence "
+        "unless they are passed as --list-field.\n\n"
+        "Fields are taken from -e options or, if none are given, the interactive "
+        f"fzf picker ({FZF_HELP_REMARK})"
+    ),
+)
+@click.argument("captures", nargs=-1, required=True)
+@click.option("--field", "-e", "field_names", multiple=True, help="Field to extract.")
+@click.option(
+    "--name",
+    help=(
+        "Output name. Default: file name of a single capture without extensions "
+        "or the name of a single directory."
+    ),
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Output directory. Default: settings.processed_data_dir.",
+)
+@click.option(
+    "--workers",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Number of captures processed concurrently. Default: number of CPUs.",
+)
+@click.option(
+    "--shard-size",
+    type=click.IntRange(min=1),
+    help=(
+        "Split uncompressed pcap/pcapng captures into shards of this many MiB. "
+        "Per-flow state like TCP reassembly restarts in every shard."
+    ),
+)
+@click.option(
+    "--chunk-size",
+    default=64,
+    show_default=True,
+    help="MiB of tshark output parsed per batch, bounds the memory usage per worker.",
+)
+@click.option(
+    "--separator",
+    default="|",
+    show_default=True,
+    help="Field separator between tshark and the parser, must not occur in values.",
+)
+@click.option(
+    "--no-disable-options",
+    is_flag=True,
+    help="Skip the recommended -o disable options.",
+)
+@click.option(
+    "--list-field",
+    "list_fields",
+    multiple=True,
+    help="Keep all occurrences of a field as list instead of only the first one.",
+)
+@click.option(
+    "--categorical",
+    "categorical_fields",
+    multiple=True,
+    help="Store a string field as Categorical, for low-cardinality fields.",
+)
+@click.option(
+    "--no-types",
+    is_flag=True,
+    help="Infer column types from the output instead of using the tshark datatypes.",
+)
+def ingest(
+    captures: tuple[str, ...],
+    field_names: tuple[str, ...],
+    name: Optional[str],
+    output_dir: Optional[Path],
+    workers: Optional[int],
+    shard_size: Optional[int],
+    chunk_size: int,
+    separator: str,
+    no_disable_options: bool,
+    list_fields: tuple[str, ...],
+    categorical_fields: tuple[str, ...],
+    no_types: bool,
+):
+    # Imported here so that polars is not loaded for the other commands
+    from ndpi.cli.ingest import expand_captures, ingest_capture, ingest_captures
+    from ndpi.settings import settings
+
+    if shard_size and "-" in captures:
+        raise click.UsageError("--shard-size requires capture files.")
+    single = (
+        not shard_size
+        and len(captures) == 1
+        and (captures[0] == "-" or os.path.isfile(captures[0]))
+    )
+    if name is None:
+        if len(captures) == 1 and os.path.isfile(captures[0]):
+            name = Path(captures[0]).name.split(".")[0]
+        elif len(captures) == 1 and os.path.isdir(captures[0]):
+            name = Path(captures[0]).resolve().name
+        else:
+            raise click.UsageError("--name is required for stdin, globs and several captures.")
+    files = [] if single else expand_captures(list(captures))
+    if not single and not files:
+        raise click.ClickException("No capture files found.")
+    names = list(field_names) or select_fields(_fields())
+    if not names:
+        raise click.ClickException("No fields selected.")
+
+    output_dir = output_dir or settings.processed_data_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+    options: dict[str, Any] = dict(
+        separator=separator,
+        chunk_size=chunk_size * 1024 * 1024,
+        include_disable_options=not no_disable_options,
+        types=None if no_types else {field.name: field.datatype for field in _fields()},
+        list_fields=list_fields,
+        categorical_fields=categorical_fields,
+    )
+    try:
+        if single:
+            output = ingest_capture(captures[0], names, output_dir / f"{name}.pq.zst", **options)
+        else:
+            output = output_dir / name
+            ingest_captures(
+                files,
+                names,
+                output,
+                workers=workers,
+                shard_size=shard_size and shard_size * 1024 * 1024,
+                **options,
+            )
+    except RuntimeError as error:
+        raise click.ClickException(str(error)) from error
+    click.echo(output)
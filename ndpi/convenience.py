@@ -1,4 +1,7 @@
-from typing import Union
+from typing import Any, Union
+from .dataset import is_dataset, is_partitioned, scan_dataset, scan_partitioned
+from .row_groups import build_stats, prune, range_filter, scan_pruned
+from .writer import WriterProfile, writer_profile
 from .settings import settings
 from pathlib import Path
 import polars as pl
@@ -11,15 +14,31 @@ def load_data(
     skip_missing: bool = False,
     default_ext: str = ".pq.zst",
     directory: Path | None = None,
+    partition_filter: pl.Expr | None = None,
+    ranges: dict[str, tuple[Any, Any]] | None = None,
     **kwargs,
 ) -> pl.LazyFrame:
     """Read one or more files from directory in concise notation.
 
+    A name may also refer to a dataset directory `directory / name` with a
+    `_manifest.json`, e.g. from `ndpi tshark ingest` with several captures, in
+    which case all parts listed in the manifest are read in order, or to a hive
+    partitioned directory (`name/date=2024-01-01/...`), whose partition keys
+    become columns.
+
+    `ranges` restricts columns to inclusive `(low, high)` bounds (None for an
+    open bound), e.g. a time window or an address range. Where a statistics
+    manifest exists (see `ndpi.row_groups.build_stats`), files and row groups
+    whose min/max cannot match are dropped before polars opens them.
+
     Args:
         name: input file or files
         skip_missing: if True skip missing files otherwise throws an error
         default_ext: expected extension after each input filename
         directory: directory to search for files to read, default: settings.processed_data_dir
+        partition_filter: predicate on the partition columns of partitioned directories,
+            evaluated on the directory names so that only matching files are opened
+        ranges: column -> (low, high), only rows within all ranges are returned
         **kwargs: kwargs for pl.scan_parquet
 
     Returns:
@@ -27,31 +46,76 @@ def load_data(
     """
     directory = directory or settings.processed_data_dir
 
-    files = name
-    if not isinstance(files, list):
-        files = [name]
-
-    files = [directory / f"{file}{default_ext}" for file in files]
-
-    existing = [file for file in files if os.path.isfile(file)]
+    names = name if isinstance(name, list) else [name]
+    files = [
+        directory / file
+        if is_dataset(directory / file) or is_partitioned(directory / file)
+        else directory / f"{file}{default_ext}"
+        for file in names
+    ]
+
+    existing = [
+        file for file in files if os.path.isfile(file) or is_dataset(file) or is_partitioned(file)
+    ]
     if not skip_missing:
         assert len(existing) == len(
             files
         ), f"Input files missing: {set([str(file) for file in files]) - set(existing)}"
 
-    return pl.concat([pl.scan_parquet(file, **kwargs) for file in existing])
+    return pl.concat([_scan(file, partition_filter, ranges, **kwargs) for file in existing])
 
 
-def sink_parquet(df: pl.LazyFrame, path: Union[str, Path], **kwargs):
+def _scan(
+    path: Path,
+    partition_filter: pl.Expr | None,
+    ranges: dict[str, tuple[Any, Any]] | None,
+    **kwargs,
+) -> pl.LazyFrame:
+    pruned = prune(path, ranges) if ranges else None
+    if is_partitioned(path) and not is_dataset(path):
+        files = None if pruned is None else [str(file) for file in pruned]
+        lf = scan_partitioned(path, partition_filter, files=files, **kwargs)
+    elif pruned is None:
+        lf = scan_dataset(path, **kwargs) if is_dataset(path) else pl.scan_parquet(path, **kwargs)
+    elif pruned:
+        lf = pl.concat(scan_pruned(pruned, **kwargs), how="vertical_relaxed")
+    else:
+        # Nothing matches, the full scan only provides the schema of the empty result
+        lf = _scan(path, partition_filter, None, **kwargs).clear()
+    return lf if not ranges else lf.filter(range_filter(ranges))
+
+
+def sink_parquet(
+    df: pl.LazyFrame,
+    path: Union[str, Path],
+    stats: Union[bool, list[str]] = False,
+    profile: Union[str, WriterProfile, None] = None,
+    **kwargs,
+):
     """A wrapper for `pl.sink_parquet` that writes to `f"{path}.temp"` and then moves the file to `path`. This allows working with the existing dataset until the file is replaced
 
     Args:
         path: str or Path to the destination file
+        stats: also write the row group statistics manifest of the file, for all
+            supported columns or the listed ones, see `ndpi.row_groups`
+        profile: writer profile or name of one in `ndpi.writer.WRITER_PROFILES` that sorts
+            the rows and sets the compression and row group layout, explicit kwargs take
+            precedence
         **kwargs: kwargs for sink_parquet
     """
+    if profile is not None:
+        profile = writer_profile(profile)
+        df = profile.prepare(df)
+        kwargs = {**profile.options(kwargs.pop("metadata", None)), **kwargs}
+        stats = stats or profile.stats
+        if profile.sort_by:
+            # The streaming engine sorts out-of-core
+            kwargs.setdefault("engine", "streaming")
     temp_path = f"{path}.temp"
     df.sink_parquet(path=temp_path, **kwargs)
     shutil.move(temp_path, path)
+    if stats:
+        build_stats(path, None if stats is True else stats, rebuild=True)
 
 
 def sink_parquet_scan_parquet(
@@ -72,13 +136,31 @@ def sink_parquet_scan_parquet(
     return pl.scan_parquet(path, **scan_args)
 
 
-def write_parquet(df: pl.DataFrame, path: Union[str, Path], **kwargs):
+def write_parquet(
+    df: pl.DataFrame,
+    path: Union[str, Path],
+    stats: Union[bool, list[str]] = False,
+    profile: Union[str, WriterProfile, None] = None,
+    **kwargs,
+):
     """A wrapper for `pl.write_parquet` that writes to `f"{path}.temp"` and then moves the file to `path`. This allows working with the existing dataset until the file is replaced
 
     Args:
         path: str or Path to the destination file
+        stats: also write the row group statistics manifest of the file, for all
+            supported columns or the listed ones, see `ndpi.row_groups`
+        profile: writer profile or name of one in `ndpi.writer.WRITER_PROFILES` that sorts
+            the rows and sets the compression and row group layout, explicit kwargs take
+            precedence
         **kwargs: kwargs for sink_parquet
     """
+    if profile is not None:
+        profile = writer_profile(profile)
+        df = profile.prepare(df)
+        kwargs = {**profile.options(kwargs.pop("metadata", None)), **kwargs}
+        stats = stats or profile.stats
     temp_path = f"{path}.temp"
     df.write_parquet(file=temp_path, **kwargs)
     shutil.move(temp_path, path)
+    if stats:
+        build_stats(path, None if stats is True else stats, rebuild=True)
@@ -1,9 +1,25 @@
-from functools import partial
+from collections.abc import Collection, Iterator
+import copy
+from datetime import timedelta
+from functools import partial, wraps
+from pathlib import Path
+import os
 import polars as pl
-from typing import Any, Callable, Tuple, Union
+from loguru import logger
+from typing import Any, Callable, Optional, Tuple, Union
 from tqdm.auto import tqdm
+import threading
 import time
 
+from ..convenience import sink_parquet, write_parquet
+from ..fingerprint import digest, plan_fingerprint
+from .idset import IdSet
+from ..settings import settings
+
+
+# Node timings of `LazyFrame.profile`
+NODE_SCHEMA = {"node": pl.String, "start": pl.UInt64, "end": pl.UInt64}
+
 
 def extract_function_name(filter: Callable):
     name = getattr(filter, "__name__", "Unknown")
@@ -29,13 +45,12 @@ def filter(
     # Cast to lazy
     df = df.lazy()
 
-    len_in = df.select(pl.len())
     ids = df.select(id_col)
+    # Counted from `ids`, polars 1.33 panics in `collect_all` when a parquet scan is
+    # both counted directly and anti joined
+    len_in = ids.select(pl.len())
 
-    if isinstance(fltr, pl.Expr):
-        df_out = df.filter(fltr)
-    else:
-        df_out = fltr(df)
+    df_out = _apply_filter(df, fltr)
 
     len_out = df_out.select(pl.len())
     filtered = ids.join(df_out, on=id_col, how="anti").select(id_col)
@@ -45,46 +60,555 @@ def filter(
     return df_out, stat
 
 
+def filter_pass(
+    df, fltrs: list[pl.Expr], id_col="id", offset: int = 0
+) -> Tuple[pl.LazyFrame, list[pl.LazyFrame]]:
+    """Apply several expression filters in one scan with the statistics of `filter` for each.
+
+    Instead of one anti join per step, every row is labelled with the index
+    of the first filter it fails (`dropped_at`) and the row counts and dropped
+    ids of all steps are derived from a single aggregation over that label.
+    The statistics share this aggregation through `LazyFrame.cache`, so
+    collecting them together (e.g. with `assemble_meta_frame`) scans `df` once.
+
+    The filters are evaluated on the unfiltered `df`, which only equals
+    filtering one after another for row-wise expressions. Expressions that
+    aggregate or use windows over the remaining rows (`.mean()`, `.over()`,
+    `.is_first_distinct()`, ...) have to be passed as callables instead.
+
+    Args:
+        df: input dataframe
+        fltrs: row-wise polars expressions, applied with cumulative AND
+        id_col: column with unique value
+        offset: index of the first filter, used for the `dropped_at` labels
+
+    Returns:
+        Tuple with filtered lazy dataframe and metadata, three frames per filter
+    """
+    df = df.lazy()
+
+    dropped_at = pl.coalesce(
+        pl.when(~fltr.fill_null(False)).then(index)
+        for index, fltr in enumerate(fltrs, start=offset)
+    )
+    summary = (
+        df.select(id_col, dropped_at.alias("dropped_at"))
+        .group_by("dropped_at")
+        .agg(
+            pl.len().alias("len"),
+            pl.col(id_col).filter(pl.col("dropped_at").is_not_null()),
+        )
+        .cache()
+    )
+    remaining = pl.col("dropped_at").is_null()
+
+    stats = []
+    for index in range(offset, offset + len(fltrs)):
+        len_in = summary.select(
+            pl.col("len").filter(remaining | (pl.col("dropped_at") >= index)).sum()
+        )
+        len_out = summary.select(
+            pl.col("len").filter(remaining | (pl.col("dropped_at") > index)).sum()
+        )
+        filtered = summary.filter(pl.col("dropped_at") == index).select(
+            pl.col(id_col).explode()
+        )
+        stats += [len_in, len_out, filtered]
+
+    for fltr in fltrs:
+        df = df.filter(fltr)
+    return df, stats
+
+
 def assemble_meta_frame(
-    meta_information: list[pl.LazyFrame], name: Union[str, None] = None
+    meta_information: list[pl.LazyFrame],
+    name: Union[str, None] = None,
+    compact_ids: bool = False,
 ) -> pl.DataFrame:
+    """Collect the metadata of filter steps into one row per step.
+
+    Args:
+        meta_information: metadata from `filter` or `apply_filters`, three frames per step
+        name: label stored in the `name` column
+        compact_ids: store the removed ids of each step as `IdSet` (Object column)
+            instead of a list, the ids are aggregated into bitmap words while
+            collecting and never materialized. Requires integer ids.
+
+    Returns:
+        DataFrame with the columns `before`, `after`, `ids` and `name`
+    """
+    id_frames = meta_information[2::3]
+    if compact_ids:
+        meta_information = list(meta_information)
+        meta_information[2::3] = [IdSet.aggregate(frame) for frame in id_frames]
     evaluated = pl.collect_all(meta_information)
 
+    if compact_ids:
+        schemas = [frame.collect_schema() for frame in id_frames]
+        ids = pl.Series(
+            [
+                IdSet.from_words(words, *next(iter(schema.items())))
+                for words, schema in zip(evaluated[2::3], schemas)
+            ],
+            dtype=pl.Object,
+        )
+    else:
+        ids = [x.get_columns()[0] for x in evaluated[2::3]]
     return pl.DataFrame(
         {
             "before": [x.item() for x in evaluated[0::3]],
             "after": [x.item() for x in evaluated[1::3]],
-            "ids": [x.get_columns()[0] for x in evaluated[2::3]],
+            "ids": ids,
             "name": name,
         }
     )
 
 
 def apply_filters(
-    df: Union[pl.DataFrame, pl.LazyFrame], filters: list
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    filters: list,
+    single_pass: bool = False,
+    id_col="id",
+    checkpoint: Union[bool, int, str, Collection[Union[int, str]]] = False,
+    checkpoint_dir: Optional[Path] = None,
+    optimize: bool = False,
+    sample_size: int = 100_000,
 ) -> Tuple[pl.LazyFrame, list[pl.LazyFrame], list[str]]:
     """Apply a set of filters in order to `df`.
 
+    By default every step builds its own statistics, each of which re-executes
+    all previous steps. With `single_pass`, consecutive expression filters are
+    evaluated together by `filter_pass`, so a chain of k expressions costs one
+    scan instead of k anti joins. Callables still run one by one and split the
+    chain into segments that are scanned separately.
+
+    With `checkpoint`, the output and the statistics of the selected steps are
+    materialized in `checkpoint_dir`. A checkpoint is keyed by the fingerprint
+    of the lazy plan up to its step, including the files it scans (see
+    `ndpi.fingerprint.plan_fingerprint`), and a re-run resumes from the deepest
+    checkpoint whose key still matches, so only the steps after it are executed.
+    Materializing a step collects its output and statistics right away.
+
+    With `optimize`, the steps between two barriers are reordered cheapest and
+    most selective first, see `optimize_order`. Only steps marked with
+    `commutative` move, all other expressions and callables are barriers. The
+    output is the same, the statistics and names are still returned in the
+    declared order, but `before`, `after` and the removed ids of a step refer to
+    the position it was executed at.
+
     Args:
         df: to apply filters on
         filters: list of filters with (filter_function, optional_filter_name)
+        single_pass: fuse consecutive row-wise expression filters, see `filter_pass`
+        id_col: column with unique value
+        checkpoint: True for every step, or the index or name of a step, or a collection of them
+        checkpoint_dir: directory for checkpoints, default: `settings.interim_data_dir / "filter_checkpoints"`
+        optimize: reorder commutative steps by their cost and selectivity on a sample
+        sample_size: number of rows from the start of `df` used by `optimize`
 
     Returns:
-
+        Filtered lazy dataframe, metadata for `assemble_meta_frame` and the step names
     """
     df = df.lazy()
 
+    filters, names = _named_filters(filters)
+    if checkpoint is True:
+        selected = set(range(len(filters)))
+    elif checkpoint is False:
+        selected = set()
+    else:
+        # A bare name is one step, not a collection of characters
+        steps = {checkpoint} if isinstance(checkpoint, (str, int)) else set(checkpoint)
+        selected = {
+            index for index, name in enumerate(names) if index in steps or name in steps
+        }
+
+    order = list(range(len(filters)))
+    if optimize:
+        order = optimize_order(df, filters, sample_size=sample_size)
+        logger.info(f"Filter order: {[names[index] for index in order]}")
+    df, executed = _apply(
+        df,
+        [filters[index] for index in order],
+        [names[index] for index in order],
+        single_pass,
+        id_col,
+        {position for position, index in enumerate(order) if index in selected},
+        checkpoint_dir,
+    )
+
+    stats = list(executed)
+    for position, index in enumerate(order):
+        stats[3 * index : 3 * index + 3] = executed[3 * position : 3 * position + 3]
+    return df, stats, names
+
+
+def _apply(
+    df: pl.LazyFrame,
+    filters: list[tuple],
+    names: list[str],
+    single_pass: bool,
+    id_col: str,
+    selected: Collection[int],
+    checkpoint_dir: Optional[Path],
+) -> Tuple[pl.LazyFrame, list[pl.LazyFrame]]:
     stats = []
-    names = []
+    if not selected:
+        for _, df, stat in _steps(df, filters, names, 0, single_pass, id_col, selected):
+            stats.extend(stat)
+        return df, stats
+
+    checkpoint_dir = checkpoint_dir or settings.interim_data_dir / "filter_checkpoints"
+    # Keys are derived from the plans on top of `df`, independent of earlier checkpoints
+    keys = {}
+    plans = _steps(df, filters, names, 0, single_pass, id_col, selected, progress=False)
+    for index, out, _ in plans:
+        if index in selected:
+            keys[index] = _checkpoint_key(out, id_col)
+            if keys[index] is None:
+                logger.warning(f"Filter step {names[index]!r} has no plan fingerprint, not checkpointed")
+
+    start = 0
+    for index in sorted(keys, reverse=True):
+        if keys[index] and _checkpoint_exists(checkpoint_dir, keys[index]):
+            df, stats = _load_checkpoint(checkpoint_dir, keys[index], index, id_col)
+            start = index + 1
+            break
+
+    while start < len(filters):
+        for index, df, stat in _steps(df, filters, names, start, single_pass, id_col, selected):
+            stats.extend(stat)
+            if keys.get(index):
+                if not _checkpoint_exists(checkpoint_dir, keys[index]):
+                    _write_checkpoint(checkpoint_dir, keys[index], df, stats)
+                df, stats = _load_checkpoint(checkpoint_dir, keys[index], index, id_col)
+                start = index + 1
+                break
+        else:
+            break
+    return df, stats
+
+
+def commutative(fltr: Union[pl.Expr, Callable]) -> Union[pl.Expr, Callable]:
+    """Mark a filter as independent of the other filters.
+
+    `apply_filters(optimize=True)` only moves marked filters, all others are
+    barriers that keep their position. A filter is commutative if it only
+    removes rows based on the row itself or on data that does not depend on
+    the other filters, e.g. `pl.col("x") > 2` or an anti join against a scanner
+    list, but not `pl.col("k").is_first_distinct()` or an expression with
+    `.over()`.
+
+    Args:
+        fltr: polars expression or filter function that operates on a
+            dataframe, also a bound method, builtin or `functools.partial`
+
+    Returns:
+        Marked copy of the expression or wrapper of the function with the same name
+    """
+    if isinstance(fltr, pl.Expr):
+        marked = copy.copy(fltr)
+        setattr(marked, "_ndpi_commutative", True)
+        return marked
+
+    # Bound methods and builtins do not accept new attributes
+    @wraps(fltr)
+    def wrapper(df):
+        return fltr(df)
+
+    wrapper.__name__ = extract_function_name(fltr)
+    setattr(wrapper, "_ndpi_commutative", True)
+    return wrapper
+
+
+def _is_commutative(fltr: Union[pl.Expr, Callable]) -> bool:
+    return getattr(fltr, "_ndpi_commutative", False)
+
+
+def _apply_filter(df: pl.LazyFrame, fltr: Union[pl.Expr, Callable]) -> pl.LazyFrame:
+    return df.filter(fltr) if isinstance(fltr, pl.Expr) else fltr(df)
+
+
+def optimize_order(
+    df: Union[pl.DataFrame, pl.LazyFrame], filters: list, sample_size: int = 100_000
+) -> list[int]:
+    """Order of the filters that minimizes the estimated work.
+
+    Each filter is timed on a sample of the first `sample_size` rows of `df`,
+    after the filters before it have been applied. Between two barriers (see
+    `commutative`), filters are sorted by `cost / (1 - selectivity)`, which
+    minimizes the expected cost of independent filters. Filters that remove
+    nothing on the sample keep their relative order at the end.
+
+    Args:
+        df: input dataframe
+        filters: list of filters with (filter_function, optional_filter_name)
+        sample_size: number of rows used for the estimates
+
+    Returns:
+        Indices into `filters` in execution order
+    """
+    filters, _ = _named_filters(filters)
+    sample = df.lazy().head(sample_size).collect()
+
+    order = []
+    group = []
+    for index, (fltr, _) in enumerate(filters + [(None, None)]):
+        if fltr is not None and _is_commutative(fltr):
+            group.append(index)
+            continue
+        ranks = {}
+        for member in group:
+            cost, out = _measure(sample, filters[member][0])
+            selectivity = out.height / sample.height if sample.height else 1.0
+            ranks[member] = cost / (1 - selectivity) if selectivity < 1 else float("inf")
+        order += sorted(group, key=lambda member: ranks[member])
+        # The sample passes through all filters so later estimates see filtered data
+        for member in group:
+            sample = _apply_filter(sample.lazy(), filters[member][0]).collect()
+        group = []
+        if fltr is not None:
+            order.append(index)
+            sample = _apply_filter(sample.lazy(), fltr).collect()
+    return order
+
+
+def _measure(sample: pl.DataFrame, fltr: Union[pl.Expr, Callable]) -> Tuple[float, pl.DataFrame]:
+    """Best of two timings of a filter on a sample and its output."""
+    start = time.perf_counter()
+    out = _apply_filter(sample.lazy(), fltr).collect()
+    timing = time.perf_counter() - start
+    start = time.perf_counter()
+    _apply_filter(sample.lazy(), fltr).collect()
+    return min(timing, time.perf_counter() - start), out
+
+
+def _named_filters(filters: list) -> Tuple[list[tuple], list[str]]:
     filters = [item if isinstance(item, tuple) else (item, None) for item in filters]
+    names = [
+        name[0] if len(name) > 0 and name[0] is not None else extract_function_name(f)
+        for f, *name in filters
+    ]
+    return filters, names
 
-    for f, *name in (pbar := tqdm(filters)):
-        name = name[0] if len(name) > 0 else None
-        if name is None:
-            name = extract_function_name(f)
-        pbar.set_postfix_str(str(name))
 
-        df, stat = filter(df, f)
-        stats.extend(stat)
-        names.append(name)
-    return df, stats, names
+def _steps(
+    df: pl.LazyFrame,
+    filters: list[tuple],
+    names: list[str],
+    start: int,
+    single_pass: bool,
+    id_col: str,
+    boundaries: Collection[int],
+    progress: bool = True,
+) -> Iterator[tuple[int, pl.LazyFrame, list[pl.LazyFrame]]]:
+    """Apply `filters[start:]`, yielding the last step index, output and statistics of each segment.
+
+    A segment is a single step or, with `single_pass`, a run of expression
+    filters that ends at a callable, a boundary or the last step.
+    """
+    segment = []
+    for index in (pbar := tqdm(range(start, len(filters)), disable=not progress)):
+        f = filters[index][0]
+        pbar.set_postfix_str(str(names[index]))
+
+        if single_pass and isinstance(f, pl.Expr):
+            segment.append(f)
+            last = index + 1 == len(filters) or index in boundaries
+            if not last and isinstance(filters[index + 1][0], pl.Expr):
+                continue
+            df, stat = filter_pass(df, segment, id_col=id_col, offset=index + 1 - len(segment))
+            segment = []
+        else:
+            df, stat = filter(df, f, id_col=id_col)
+        yield index, df, stat
+
+
+def _checkpoint_key(df: pl.LazyFrame, id_col: str) -> Optional[str]:
+    fingerprint = plan_fingerprint(df)
+    return fingerprint and digest(fingerprint, id_col)
+
+
+def _checkpoint_exists(directory: Path, key: str) -> bool:
+    return (directory / f"{key}.pq.zst").is_file() and (directory / f"{key}.meta.pq.zst").is_file()
+
+
+def _write_checkpoint(directory: Path, key: str, df: pl.LazyFrame, stats: list[pl.LazyFrame]):
+    """Materialize the output of a step and the statistics of all steps up to it."""
+    directory.mkdir(parents=True, exist_ok=True)
+    sink_parquet(df, directory / f"{key}.pq.zst", compression="zstd")
+    meta = assemble_meta_frame(stats).drop("name").with_row_index("step")
+    # Written last, a checkpoint only counts once its statistics exist
+    write_parquet(meta, directory / f"{key}.meta.pq.zst", compression="zstd")
+
+
+def _load_checkpoint(
+    directory: Path, key: str, index: int, id_col: str
+) -> Tuple[pl.LazyFrame, list[pl.LazyFrame]]:
+    meta = pl.scan_parquet(directory / f"{key}.meta.pq.zst")
+    stats = []
+    for step in range(index + 1):
+        row = meta.filter(pl.col("step") == step)
+        stats += [
+            row.select("before"),
+            row.select("after"),
+            row.select(pl.col("ids").explode().alias(id_col)).drop_nulls(),
+        ]
+    return pl.scan_parquet(directory / f"{key}.pq.zst"), stats
+
+
+def prune_checkpoints(max_age: timedelta, checkpoint_dir: Optional[Path] = None) -> list[Path]:
+    """Remove filter checkpoints that were written more than `max_age` ago.
+
+    `apply_filters` never removes checkpoints, since several pipelines may share
+    a directory and a checkpoint that does not match one of them may still
+    match another. A removed checkpoint that is still valid is written again by
+    the next run that selects its step.
+
+    Args:
+        max_age: checkpoints and leftovers of interrupted writes older than this are removed
+        checkpoint_dir: directory for checkpoints, default: `settings.interim_data_dir / "filter_checkpoints"`
+
+    Returns:
+        Removed files
+    """
+    checkpoint_dir = checkpoint_dir or settings.interim_data_dir / "filter_checkpoints"
+    if not checkpoint_dir.is_dir():
+        return []
+    cutoff = time.time() - max_age.total_seconds()
+    removed = []
+    # Statistics first, a checkpoint without them is never read
+    for path in sorted(checkpoint_dir.iterdir(), key=lambda path: ".meta." not in path.name):
+        if path.is_file() and path.stat().st_mtime < cutoff:
+            path.unlink()
+            removed.append(path)
+    return removed
+
+
+def profile_filters(
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    filters: list,
+    id_col="id",
+    name: Union[str, None] = None,
+    compact_ids: bool = False,
+) -> Tuple[pl.LazyFrame, pl.DataFrame, pl.DataFrame]:
+    """Execute a set of filters step by step and measure every step.
+
+    Unlike `apply_filters`, each step is collected right away on the collected
+    output of the previous step, so its measurements only cover its own work.
+    The first step also includes reading `df`. Outputs are kept in memory,
+    profile a sample of very large inputs.
+
+    The profile has one row per step with
+    - `time`: seconds to compute the output of the step
+    - `stats_time`: seconds to compute its statistics (row counts and removed ids)
+    - `rows_in` and `rows_out`
+    - `peak_rss`: highest resident memory of the process in bytes while the step
+      ran, sampled every few milliseconds (null where `/proc` is unavailable)
+    - `nodes`: polars `LazyFrame.profile` timings of the output query, with
+      `start` and `end` in microseconds
+
+    Args:
+        df: to apply filters on
+        filters: list of filters with (filter_function, optional_filter_name)
+        id_col: column with unique value
+        name: label for the meta frame, see `assemble_meta_frame`
+        compact_ids: store removed ids as `IdSet`, see `assemble_meta_frame`
+
+    Returns:
+        Filtered lazy dataframe, meta frame and profile
+    """
+    filters, names = _named_filters(filters)
+    current: Union[pl.DataFrame, pl.LazyFrame] = df
+
+    stats = []
+    rows = []
+    for (f, _), step_name in zip(pbar := tqdm(filters), names):
+        pbar.set_postfix_str(str(step_name))
+        out, _ = filter(current, f, id_col=id_col)
+        with _PeakRss() as rss:
+            start = time.perf_counter()
+            collected, nodes = _profile(out)
+            duration = time.perf_counter() - start
+            # Derived from the collected output instead of executing the step again
+            ids = current.lazy().select(id_col)
+            stat = pl.collect_all(
+                [
+                    ids.select(pl.len()),
+                    collected.lazy().select(pl.len()),
+                    ids.join(collected.lazy(), on=id_col, how="anti").select(id_col),
+                ]
+            )
+            stats_duration = time.perf_counter() - start - duration
+        stats += [frame.lazy() for frame in stat]
+        rows.append(
+            {
+                "step": len(rows),
+                "name": step_name,
+                "time": duration,
+                "stats_time": stats_duration,
+                "rows_in": stat[0].item(),
+                "rows_out": stat[1].item(),
+                "peak_rss": rss.peak,
+                "nodes": nodes.to_dicts(),
+            }
+        )
+        current = collected
+
+    schema = {
+        "step": pl.UInt32,
+        "name": pl.String,
+        "time": pl.Float64,
+        "stats_time": pl.Float64,
+        "rows_in": pl.Int64,
+        "rows_out": pl.Int64,
+        "peak_rss": pl.Int64,
+        "nodes": pl.List(pl.Struct(NODE_SCHEMA)),
+    }
+    profile = pl.DataFrame(rows, schema=schema)
+    meta = assemble_meta_frame(stats, name, compact_ids=compact_ids)
+    return current.lazy(), meta, profile
+
+
+def _profile(lf: pl.LazyFrame) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    try:
+        return lf.profile()
+    except pl.exceptions.ComputeError as error:
+        # Raised for plans without any node that does work, e.g. a plain projection
+        if "no data to time" not in str(error):
+            raise
+        return lf.collect(), pl.DataFrame(schema=NODE_SCHEMA)
+
+
+class _PeakRss:
+    """Sample the resident memory of the process in a thread and keep the maximum."""
+
+    INTERVAL = 0.005
+    STATM = Path("/proc/self/statm")
+
+    def __init__(self):
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _read(self) -> Optional[int]:
+        try:
+            return int(self.STATM.read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _sample(self):
+        while True:
+            rss = self._read()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.INTERVAL):
+                break
+
+    def __enter__(self) -> "_PeakRss":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
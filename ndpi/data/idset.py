@@ -0,0 +1,195 @@
+"""Compact sets of integer ids, e.g. the ids removed by a filter step.
+
+Ids are grouped into 64-bit words (`id // 64`). Consecutive words in which
+every id is set are stored as runs of word indices, words with a single id as
+that id and all other words as bitmap. Filter steps usually drop long runs of
+row ids or scattered ids, both of which take a fraction of the memory of a
+materialized id column.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Union
+
+import polars as pl
+
+WORD_BITS = 64
+FULL_WORD = (1 << WORD_BITS) - 1
+# mask of every bit within a word
+BITS = pl.Series("bits", [1 << bit for bit in range(WORD_BITS)], dtype=pl.UInt64)
+
+
+@dataclass(frozen=True, eq=False)
+class IdSet:
+    # first and last word index of every run of full words, sorted
+    runs: pl.DataFrame
+    # words with more than one but not all ids set, sorted
+    words: pl.DataFrame
+    # ids that are alone in their word, sorted
+    singles: pl.Series
+    # name and dtype of the id column
+    name: str = "id"
+    dtype: pl.DataType = pl.Int64()
+
+    @staticmethod
+    def aggregate(ids: Union[pl.Series, pl.DataFrame, pl.LazyFrame]) -> pl.LazyFrame:
+        """Query for the bitmap words of an id column, the input of `from_words`.
+
+        Args:
+            ids: integer ids, the first column is used for frames
+
+        Returns:
+            LazyFrame with the columns `word` (Int64) and `mask` (UInt64)
+        """
+        lf = ids.to_frame().lazy() if isinstance(ids, pl.Series) else ids.lazy()
+        id_ = pl.first().cast(pl.Int64)
+        return (
+            lf.select(word=id_ // WORD_BITS, mask=pl.lit(BITS).gather(id_ % WORD_BITS))
+            .drop_nulls()
+            .group_by("word")
+            .agg(pl.col("mask").bitwise_or())
+        )
+
+    @classmethod
+    def from_words(
+        cls, words: pl.DataFrame, name: str = "id", dtype: pl.DataType = pl.Int64()
+    ) -> IdSet:
+        """Build a set from the result of `aggregate`.
+
+        Args:
+            words: DataFrame with the columns `word` and `mask`
+            name: name of the id column for `expand`
+            dtype: dtype of the ids for `expand`
+
+        Returns:
+            IdSet
+        """
+        words = words.sort("word")
+        full = pl.col("mask") == FULL_WORD
+        single = pl.col("mask").bitwise_count_ones() == 1
+        runs = (
+            words.filter(full)
+            .group_by(pl.col("word") - pl.int_range(pl.len()), maintain_order=True)
+            .agg(start=pl.col("word").first(), end=pl.col("word").last())
+            .select("start", "end")
+        )
+        singles = words.filter(single).select(
+            pl.col("word") * WORD_BITS + pl.col("mask").bitwise_trailing_zeros()
+        )
+        return cls(
+            runs=runs,
+            words=words.filter(~full & ~single),
+            singles=singles.to_series().alias(name),
+            name=name,
+            dtype=dtype,
+        )
+
+    @classmethod
+    def from_ids(cls, ids: Union[pl.Series, pl.DataFrame, pl.LazyFrame]) -> IdSet:
+        """Build a set from an integer id column.
+
+        Args:
+            ids: integer ids, the first column is used for frames
+
+        Returns:
+            IdSet
+        """
+        if isinstance(ids, pl.Series):
+            name, dtype = ids.name, ids.dtype
+        else:
+            name, dtype = next(iter(ids.lazy().collect_schema().items()))
+        if not dtype.is_integer():
+            raise TypeError(f"IdSet requires integer ids, got {dtype}")
+        return cls.from_words(cls.aggregate(ids).collect(), name, dtype)
+
+    def __len__(self) -> int:
+        run_words = int((self.runs["end"] - self.runs["start"] + 1).sum())
+        return (
+            run_words * WORD_BITS
+            + int(self.words["mask"].bitwise_count_ones().sum())
+            + self.singles.len()
+        )
+
+    def __contains__(self, value: int) -> bool:
+        value = int(value)
+        word = value // WORD_BITS
+        index = self.runs["start"].search_sorted(word, side="right") - 1
+        if index >= 0 and word <= self.runs["end"][index]:
+            return True
+        index = self.words["word"].search_sorted(word)
+        if index < self.words.height and self.words["word"][index] == word:
+            return bool(self.words["mask"][index] & (1 << value % WORD_BITS))
+        index = self.singles.search_sorted(value)
+        return index < self.singles.len() and self.singles[index] == value
+
+    def contains(self, expr: Union[str, pl.Expr]) -> pl.Expr:
+        """Expression testing whether the values of `expr` are in the set, without expanding it.
+
+        Args:
+            expr: column name or integer expression
+
+        Returns:
+            Boolean expression, False for nulls
+        """
+        value = (pl.col(expr) if isinstance(expr, str) else expr).cast(pl.Int64)
+        word = value // WORD_BITS
+        found = pl.lit(False)
+        if self.runs.height:
+            starts = pl.lit(self.runs["start"])
+            index = starts.search_sorted(word, side="right").cast(pl.Int64) - 1
+            end = pl.lit(self.runs["end"]).gather(index.clip(0))
+            found = found | ((index >= 0) & (word <= end))
+        if self.words.height:
+            words = pl.lit(self.words["word"])
+            index = words.search_sorted(word).clip(upper_bound=self.words.height - 1)
+            mask = pl.lit(self.words["mask"]).gather(index)
+            bit = pl.lit(BITS).gather(value % WORD_BITS)
+            found = found | ((words.gather(index) == word) & ((mask & bit) != 0))
+        if self.singles.len():
+            found = found | value.is_in(self.singles.cast(pl.Int64).implode())
+        return found.fill_null(False)
+
+    def expand(self) -> pl.LazyFrame:
+        """All ids of the set in ascending order, computed when the frame is collected."""
+        runs = self.runs.lazy().select(
+            pl.int_ranges(pl.col("start") * WORD_BITS, (pl.col("end") + 1) * WORD_BITS)
+            .explode()
+            .alias(self.name)
+        )
+        words = (
+            self.words.lazy()
+            .with_columns(bit=pl.int_ranges(0, WORD_BITS))
+            .explode("bit")
+            .filter((pl.col("mask") & pl.lit(BITS).gather(pl.col("bit"))) != 0)
+            .select((pl.col("word") * WORD_BITS + pl.col("bit")).alias(self.name))
+        )
+        singles = self.singles.to_frame().lazy()
+        return (
+            pl.concat([runs.cast(pl.Int64), words.cast(pl.Int64), singles.cast(pl.Int64)])
+            .sort(self.name)
+            .cast(self.dtype)
+        )
+
+    def to_series(self) -> pl.Series:
+        """All ids of the set in ascending order."""
+        return self.expand().collect().to_series()
+
+    def estimated_size(self) -> int:
+        """Bytes used by the set."""
+        return int(
+            self.runs.estimated_size()
+            + self.words.estimated_size()
+            + self.singles.estimated_size()
+        )
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, IdSet)
+            and self.runs.equals(other.runs)
+            and self.words.equals(other.words)
+            and self.singles.equals(other.singles)
+        )
+
+    def __repr__(self) -> str:
+        return f"IdSet({self.name}, {len(self)} ids, {self.estimated_size()} bytes)"
@@ -1,13 +1,112 @@
 from collections.abc import Collection
-from typing import Any, Union
+import ipaddress
+from typing import Any, Optional, Union
 import polars as pl
 
+_LOW_64 = (1 << 64) - 1
+_V4_OCTET = r"(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)"
+_V4_PATTERN = rf"^({_V4_OCTET}\.){{3}}{_V4_OCTET}$"
+
+_PRIVATE_V4 = (
+    "0.0.0.0/8",
+    "10.0.0.0/8",
+    "127.0.0.0/8",
+    "169.254.0.0/16",
+    "172.16.0.0/12",
+    "192.0.0.0/29",
+    "192.0.0.170/31",
+    "192.0.2.0/24",
+    "192.168.0.0/16",
+    "198.18.0.0/15",
+    "198.51.100.0/24",
+    "203.0.113.0/24",
+    "240.0.0.0/4",
+    "255.255.255.255/32",
+)
+
+# Networks for which `ipaddress` reports `is_private` (Python 3.11), IPv4-mapped
+# IPv6 addresses are private if the mapped IPv4 address is.
+PRIVATE_NETWORKS = (
+    *_PRIVATE_V4,
+    "::1/128",
+    "::/128",
+    "100::/64",
+    "2001::/23",
+    "2001:2::/48",
+    "2001:db8::/32",
+    "2001:10::/28",
+    "fc00::/7",
+    "fe80::/10",
+    *(
+        f"::ffff:{net.split('/')[0]}/{96 + int(net.split('/')[1])}"
+        for net in _PRIVATE_V4
+    ),
+)
+
+# Addresses that must never appear as source on the public internet: the Team
+# Cymru IPv4 bogons and the IPv6 martians, plus everything outside 2000::/3.
+BOGON_NETWORKS = (
+    "0.0.0.0/8",
+    "10.0.0.0/8",
+    "100.64.0.0/10",
+    "127.0.0.0/8",
+    "169.254.0.0/16",
+    "172.16.0.0/12",
+    "192.0.0.0/24",
+    "192.0.2.0/24",
+    "192.168.0.0/16",
+    "198.18.0.0/15",
+    "198.51.100.0/24",
+    "203.0.113.0/24",
+    "224.0.0.0/4",
+    "240.0.0.0/4",
+    "::/3",
+    "4000::/2",
+    "8000::/1",
+    "2001:2::/48",
+    "2001:10::/28",
+    "2001:db8::/32",
+    "2002:a00::/24",
+    "2002:7f00::/24",
+    "2002:a9fe::/32",
+    "2002:ac10::/28",
+    "2002:c000::/40",
+    "2002:c000:200::/40",
+    "2002:c0a8::/32",
+    "2002:c612::/31",
+    "2002:c633:6400::/40",
+    "2002:cb00:7100::/40",
+    "2002:e000::/20",
+    "2002:f000::/20",
+    "2002:ffff:ffff::/48",
+    "2001::/40",
+    "2001:0:a00::/40",
+    "2001:0:7f00::/40",
+    "2001:0:a9fe::/48",
+    "2001:0:ac10::/44",
+    "2001:0:c000::/56",
+    "2001:0:c000:200::/56",
+    "2001:0:c0a8::/48",
+    "2001:0:c612::/47",
+    "2001:0:c633:6400::/56",
+    "2001:0:cb00:7100::/56",
+    "2001:0:e000::/36",
+    "2001:0:f000::/36",
+    "2001:0:ffff:ffff::/64",
+    "3ffe::/16",
+)
+
 
 @pl.api.register_expr_namespace("ndpi")
 class Ndpi:
     def __init__(self, expr: pl.Expr) -> None:
         self._expr = expr
 
+    def _keep_name(self, expr: pl.Expr) -> pl.Expr:
+        """`expr` with the output name of the input, like the other methods."""
+        name = self._expr.meta.output_name(raise_if_undetermined=False)
+        return expr if name is None else expr.alias(name)
+
     def list_index_of(
         self, values: Union[pl.Expr, Collection[Any], pl.Series]
     ) -> pl.Expr:
@@ -17,16 +116,258 @@ class Ndpi:
             values: Values to get the indices from.
 
         Returns:
-            list of indices or empty list if values are not found.
+            list of indices (Int64) or empty list if values are not found.
+        """
+        # Only elementwise expressions are vectorized over all lists in `list.eval`,
+        # so positions are taken from `int_ranges` instead of per-list `arg_true`
+        positions = pl.int_ranges(1, self._expr.list.len() + 1, dtype=pl.Int64)
+        found = positions * self._list_mask(values).cast(pl.List(pl.Int64))
+        return found.list.eval(
+            pl.when(pl.element() > 0).then(pl.element() - 1)
+        ).list.drop_nulls()
+
+    def _list_mask(self, values: Union[pl.Expr, Collection[Any], pl.Series]) -> pl.Expr:
+        return self._expr.list.eval(pl.element().is_in(values))
+
+    def list_first_index_of(
+        self, values: Union[pl.Expr, Collection[Any], pl.Series]
+    ) -> pl.Expr:
+        """Return the index of the first element of a list that is in `values`.
+
+        Args:
+            values: Values to search for.
+
+        Returns:
+            Int64 index or null if no value is found.
+        """
+        mask = self._list_mask(values)
+        return pl.when(mask.list.any()).then(mask.list.arg_max().cast(pl.Int64))
+
+    def list_contains_any(
+        self, values: Union[pl.Expr, Collection[Any], pl.Series]
+    ) -> pl.Expr:
+        """Check whether a list contains any of `values`.
+
+        Args:
+            values: Values to search for.
+
+        Returns:
+            Boolean, False for empty lists and null for null lists.
+        """
+        return self._list_mask(values).list.any()
+
+    def list_intersect_positions(self, other: Union[str, pl.Expr]) -> pl.Expr:
+        """Return the indices of the elements of a list that are also in the list `other` of the same row.
+
+        Args:
+            other: list column with elements of the same dtype.
+
+        Returns:
+            list of indices (Int64), null if either list is null.
+        """
+        other = pl.col(other) if isinstance(other, str) else other
+
+        def tagged(expr: pl.Expr, side: int) -> pl.Expr:
+            return expr.list.eval(pl.struct(value=pl.element(), side=pl.lit(side, pl.UInt8)))
+
+        # The elements of both lists in one list, those of `self` come first and
+        # keep their positions. Membership depends on the row, so this is evaluated
+        # per list and much slower than `list_index_of`
+        value = pl.element().struct.field("value")
+        side = pl.element().struct.field("side")
+        in_other = value.is_in(value.filter(side == 1).implode())
+        return pl.concat_list([tagged(self._expr, 0), tagged(other, 1)]).list.eval(
+            ((side == 0) & in_other).arg_true().cast(pl.Int64)
+        )
+
+    def ip_to_int(self) -> pl.Expr:
+        """Convert dotted IPv4 address strings to UInt32.
+
+        Returns:
+            UInt32 address, null for strings that are not IPv4 addresses.
         """
-        position = pl.int_range(start=1, end=pl.len() + 1)
-        true_if_in_p = pl.element().is_in(values)
-        # position * true_if_in_p = 0 for non elements not in p, and index for elements in p
+        octets = self._expr.str.split(".")
+        return pl.when(self._expr.str.contains(_V4_PATTERN)).then(
+            pl.sum_horizontal(
+                octets.list.get(i, null_on_oob=True).cast(pl.UInt32, strict=False)
+                * pl.lit(256 ** (3 - i), dtype=pl.UInt32)
+                for i in range(4)
+            )
+        )
+
+    def int_to_ip(self) -> pl.Expr:
+        """Convert integer IPv4 addresses to dotted strings.
 
-        filter_lt_0 = pl.element().filter(pl.element() > 0)
-        begin_index_at_zero = pl.element() - 1
-        return (
-            self._expr.list.eval(position * true_if_in_p)
-            .list.eval(filter_lt_0)
-            .list.eval(begin_index_at_zero)
+        Returns:
+            IPv4 address string.
+        """
+        value = self._expr.cast(pl.UInt32)
+        return pl.concat_str(
+            [(value // 256 ** (3 - i) % 256).cast(pl.String) for i in range(4)],
+            separator=".",
         )
+
+    def ip6_to_int(self) -> pl.Expr:
+        """Convert IPv6 address strings to 128 bit integers split into UInt64 halves.
+
+        Expands `::` and supports a trailing dotted IPv4 part, e.g. `::ffff:1.2.3.4`.
+
+        Returns:
+            Struct with UInt64 fields `hi` and `lo`, null for strings that are not IPv6 addresses.
+        """
+        # polars only eliminates common subexpressions at the top level, so the
+        # string is turned into 32 hex digits in one chain of string kernels, the
+        # parsed halves are referenced once and the checks only look at the input.
+        embedded_v4 = self._expr.str.contains(".", literal=True)
+        present = self._expr.str.count_matches("[^:]+") + embedded_v4.cast(pl.UInt32)
+        missing = pl.lit(8, dtype=pl.Int64) - present.cast(pl.Int64)
+        zeros = pl.lit(":0" * 8).str.head(2 * missing.clip(0, 8))
+
+        # A trailing dotted IPv4 part is replaced by two zero groups and added later
+        v4_tail = Ndpi(self._expr.str.extract(r":([0-9]*\.[0-9.]*)$")).ip_to_int()
+        hex_only = self._expr.str.replace(r":[0-9]*\.[0-9.]*$", ":0:0")
+        expanded = hex_only.str.replace("::", zeros + ":", literal=True)
+        expanded = expanded.str.strip_chars(":")
+        # Double the separators so every group has its own, then zero-pad groups
+        padded = pl.concat_str(pl.lit(":"), expanded.str.replace_all(":", "::"), pl.lit(":"))
+        for width in range(1, 4):
+            padded = padded.str.replace_all(
+                f":([0-9a-fA-F]{{{width}}}):", f":{'0' * (4 - width)}${{1}}:"
+            )
+        halves = padded.str.replace_all(":", "", literal=True).str.extract_groups(
+            "^(?<hi>[0-9a-fA-F]{16})(?<lo>[0-9a-fA-F]{16})$"
+        )
+
+        # `::` stands for at least one group, without it all eight must be present
+        group = "[0-9a-fA-F]{1,4}"
+        valid = (
+            hex_only.str.contains(f"^({group}(:{group})*)?(::)?({group}(:{group})*)?$")
+            & pl.when(self._expr.str.contains("::", literal=True))
+            .then(missing >= 1)
+            .otherwise(missing == 0)
+            & (v4_tail.is_not_null() | ~embedded_v4)
+        )
+        parsed = pl.when(valid).then(
+            pl.struct(
+                hi=halves.struct.field("hi").str.to_integer(
+                    base=16, dtype=pl.UInt64, strict=False
+                ),
+                lo=halves.struct.field("lo").str.to_integer(
+                    base=16, dtype=pl.UInt64, strict=False
+                )
+                + v4_tail.cast(pl.UInt64).fill_null(0),
+            )
+        )
+        return self._keep_name(parsed)
+
+    def int_to_ip6(self) -> pl.Expr:
+        """Convert `ip6_to_int` structs back to compressed IPv6 strings (RFC 5952).
+
+        Returns:
+            IPv6 address string.
+        """
+
+        def repeat(values: list) -> pl.Expr:
+            return pl.lit(pl.Series([values], dtype=pl.List(pl.UInt64)))
+
+        # Each half is referenced once, see `ip6_to_int`
+        groups = pl.concat_list(
+            self._expr.struct.field("hi").repeat_by(4),
+            self._expr.struct.field("lo").repeat_by(4),
+        ) // repeat([1 << 48, 1 << 32, 1 << 16, 1] * 2) % repeat([1 << 16] * 8)
+        hex_groups = [f"{group:x}" for group in range(1 << 16)]
+        address = groups.list.eval(
+            pl.element().replace_strict(range(1 << 16), hex_groups, return_dtype=pl.String)
+        ).list.join(":", ignore_nulls=False)
+
+        # `#` marks addresses without `::`, the longest (leftmost on ties) run of
+        # two or more zero groups is replaced first and removes the marker.
+        compressed = pl.concat_str(pl.lit("#:"), address, pl.lit(":"))
+        for length in range(8, 1, -1):
+            compressed = compressed.str.replace(
+                f"^#((:[0-9a-f]+)*?):0(:0){{{length - 1}}}:", "${1}::"
+            )
+        return self._keep_name(
+            compressed.str.strip_prefix("#")
+            .str.replace("^:([^:])", "${1}")
+            .str.replace("([^:]):$", "${1}")
+        )
+
+    def in_cidr(self, prefix: Union[str, Collection[str]]) -> pl.Expr:
+        """Test whether IPv4/IPv6 address strings are part of one or more prefixes.
+
+        Args:
+            prefix: prefix like `"10.0.0.0/8"` or `"2001:db8::/32"`, or a collection of prefixes
+
+        Returns:
+            Boolean expression, false for addresses of the other family and null for nulls.
+        """
+        networks = [prefix] if isinstance(prefix, str) else list(prefix)
+        networks = [ipaddress.ip_network(net, strict=False) for net in networks]
+
+        conditions = []
+        if any(net.version == 4 for net in networks):
+            value = self.ip_to_int()
+            conditions += [
+                value.is_between(
+                    int(net.network_address), int(net.broadcast_address)
+                ).fill_null(False)
+                for net in networks
+                if net.version == 4
+            ]
+        if any(net.version == 6 for net in networks):
+            value = self.ip6_to_int()
+            hi, lo = value.struct.field("hi"), value.struct.field("lo")
+            for net in networks:
+                if net.version != 6:
+                    continue
+                start, end = int(net.network_address), int(net.broadcast_address)
+                after_start = (hi > start >> 64) | (
+                    (hi == start >> 64) & (lo >= start & _LOW_64)
+                )
+                before_end = (hi < end >> 64) | ((hi == end >> 64) & (lo <= end & _LOW_64))
+                conditions.append((after_start & before_end).fill_null(False))
+        return self._keep_name(
+            pl.when(self._expr.is_not_null()).then(pl.any_horizontal(conditions))
+        )
+
+    def prefix(self, v4: Optional[int] = 24, v6: Optional[int] = 48) -> pl.Expr:
+        """Mask IPv4/IPv6 address strings to their prefix, e.g. `1.2.3.4` -> `1.2.3.0/24`.
+
+        Args:
+            v4: prefix length for IPv4 addresses, None to return null for IPv4
+            v6: prefix length for IPv6 addresses, None to return null for IPv6
+
+        Returns:
+            Prefix string in CIDR notation.
+        """
+        prefixes = [pl.lit(None, dtype=pl.String)]
+        if v4 is not None:
+            size = 1 << (32 - v4)
+            value = self.ip_to_int().cast(pl.UInt64)
+            prefixes.append(Ndpi(value // size * size).int_to_ip() + f"/{v4}")
+        if v6 is not None:
+            mask = ((1 << 128) - 1) ^ ((1 << (128 - v6)) - 1)
+            value = self.ip6_to_int()
+            network = pl.struct(
+                hi=value.struct.field("hi") & pl.lit(mask >> 64, dtype=pl.UInt64),
+                lo=value.struct.field("lo") & pl.lit(mask & _LOW_64, dtype=pl.UInt64),
+            )
+            prefixes.append(Ndpi(network).int_to_ip6() + f"/{v6}")
+        return self._keep_name(pl.coalesce(prefixes))
+
+    def is_private(self) -> pl.Expr:
+        """Test whether IPv4/IPv6 address strings are private, see `PRIVATE_NETWORKS`.
+
+        Returns:
+            Boolean expression matching `ipaddress.ip_address(x).is_private`.
+        """
+        return self.in_cidr(PRIVATE_NETWORKS)
+
+    def is_bogon(self) -> pl.Expr:
+        """Test whether IPv4/IPv6 address strings are bogons, see `BOGON_NETWORKS`.
+
+        Returns:
+            Boolean expression.
+        """
+        return self.in_cidr(BOGON_NETWORKS)
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Optional, Union
 import polars as pl
 
 
@@ -40,3 +40,175 @@ def col_names(
         return False
 
     return True
+
+
+# Integer dtypes from narrow to wide by signedness, proposals pick the first that fits
+_INTEGER_DTYPES = {
+    False: [pl.UInt8(), pl.UInt16(), pl.UInt32(), pl.UInt64()],
+    True: [pl.Int8(), pl.Int16(), pl.Int32(), pl.Int64()],
+}
+# Bytes per row of a string in addition to its content (view) and of a category
+_STRING_OVERHEAD = 16
+_CATEGORY_BYTES = 4
+# Bytes per value of the fixed-width dtypes that are audited
+_WIDTHS = {
+    pl.Int8: 1,
+    pl.Int16: 2,
+    pl.Int32: 4,
+    pl.Int64: 8,
+    pl.Int128: 16,
+    pl.UInt8: 1,
+    pl.UInt16: 2,
+    pl.UInt32: 4,
+    pl.UInt64: 8,
+    pl.Float32: 4,
+    pl.Float64: 8,
+}
+AUDIT_SCHEMA = {
+    "column": pl.String(),
+    "dtype": pl.String(),
+    "proposed": pl.String(),
+    "min": pl.Int128(),
+    "max": pl.Int128(),
+    "unique": pl.Int64(),
+    "bytes": pl.Int64(),
+    "proposed_bytes": pl.Int64(),
+}
+
+
+def audit_schema(
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    max_categories: int = 1_000,
+    max_category_ratio: float = 0.5,
+    verbose: bool = False,
+) -> pl.DataFrame:
+    """Propose the narrowest dtype of every column in one pass over the data.
+
+    Integer columns are narrowed to the smallest integer dtype that holds
+    their range, unsigned if there are no negative values. Float64 columns are
+    proposed as Float32 if every value survives the round trip. String columns
+    with few distinct values are proposed as Categorical. Memory is estimated
+    from the dtype widths and string lengths, validity bitmaps are ignored.
+    Other columns keep their dtype.
+
+    Args:
+        df: dataframe to audit
+        max_categories: maximum number of distinct strings of a Categorical column
+        max_category_ratio: maximum ratio of distinct strings to rows of a Categorical column
+        verbose: print the columns that can be narrowed and the projected savings
+
+    Returns:
+        DataFrame with one row per column: `column`, current `dtype`, `proposed`
+        dtype, `min`/`max` of integer columns, `unique` strings and the estimated
+        `bytes` before and after, see `compact_dtypes`
+    """
+    lf = df.lazy()
+    schema = lf.collect_schema()
+    stats = [pl.len().alias("-rows")]
+    for name, dtype in schema.items():
+        if _audited(dtype):
+            stats += [
+                pl.col(name).min().alias(f"{name}-min"),
+                pl.col(name).max().alias(f"{name}-max"),
+            ]
+        elif dtype == pl.Float64:
+            narrow = pl.col(name).cast(pl.Float32).cast(pl.Float64)
+            stats.append(
+                (narrow.eq_missing(pl.col(name)) | pl.col(name).is_nan())
+                .all()
+                .alias(f"{name}-lossless")
+            )
+        elif dtype == pl.String:
+            stats += [
+                pl.col(name).n_unique().alias(f"{name}-unique"),
+                pl.col(name).str.len_bytes().sum().alias(f"{name}-length"),
+            ]
+    values = lf.select(stats).collect().row(0, named=True)
+    rows = values["-rows"]
+
+    report = []
+    for name, dtype in schema.items():
+        entry = {"column": name, "dtype": str(dtype), "proposed": str(dtype)}
+        if _audited(dtype):
+            low, high = values[f"{name}-min"], values[f"{name}-max"]
+            entry |= {"min": low, "max": high, "bytes": rows * _width(dtype)}
+            fitting = [
+                candidate
+                for candidate in _INTEGER_DTYPES[low is not None and low < 0]
+                if low is not None and _fits(candidate, low, high)
+            ]
+            proposed = fitting[0] if fitting and _width(fitting[0]) < _width(dtype) else dtype
+            entry |= {"proposed": str(proposed), "proposed_bytes": rows * _width(proposed)}
+        elif dtype.is_float():
+            proposed = pl.Float32() if values.get(f"{name}-lossless") else dtype
+            entry |= {
+                "proposed": str(proposed),
+                "bytes": rows * _width(dtype),
+                "proposed_bytes": rows * _width(proposed),
+            }
+        elif dtype == pl.String:
+            unique, length = values[f"{name}-unique"], values[f"{name}-length"] or 0
+            entry |= {"unique": unique, "bytes": length + rows * _STRING_OVERHEAD}
+            entry["proposed_bytes"] = entry["bytes"]
+            if unique <= max_categories and unique <= max_category_ratio * rows:
+                entry["proposed"] = str(pl.Categorical())
+                # The categories hold every distinct string once
+                average = length // max(rows, 1) + _STRING_OVERHEAD
+                entry["proposed_bytes"] = rows * _CATEGORY_BYTES + unique * average
+        elif dtype == pl.Boolean or isinstance(dtype, (pl.Categorical, pl.Enum)):
+            # Already compact: bit-packed or dictionary encoded
+            pass
+        report.append(entry)
+    report = pl.DataFrame(report, schema=AUDIT_SCHEMA)
+
+    if verbose:
+        changed = report.filter(pl.col("proposed") != pl.col("dtype"))
+        saved = (changed.get_column("bytes") - changed.get_column("proposed_bytes")).sum()
+        total = report.get_column("bytes").sum()
+        print("Columns with narrower dtypes:")
+        print(changed.select("column", "dtype", "proposed"))
+        print(f"Projected savings: {saved / 2**20:.1f} MiB of {total / 2**20:.1f} MiB")
+    return report
+
+
+def _audited(dtype: pl.DataType) -> bool:
+    """Integer dtypes with a known width, e.g. not UInt128 of newer polars."""
+    return dtype.is_integer() and dtype.base_type() in _WIDTHS
+
+
+def _width(dtype: pl.DataType) -> int:
+    """Bytes per value of an integer or float dtype."""
+    return _WIDTHS[dtype.base_type()]
+
+
+def _fits(dtype: pl.DataType, low: int, high: int) -> bool:
+    bits = _width(dtype) * 8
+    if dtype.is_signed_integer():
+        return -(2 ** (bits - 1)) <= low and high < 2 ** (bits - 1)
+    return 0 <= low and high < 2**bits
+
+
+def compact_dtypes(
+    df: Union[pl.DataFrame, pl.LazyFrame], report: Optional[pl.DataFrame] = None, **kwargs
+) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """Cast the columns of `df` to the dtypes proposed by `audit_schema`.
+
+    Args:
+        df: dataframe to compact
+        report: result of `audit_schema`, computed from `df` if missing
+        **kwargs: kwargs for `audit_schema`
+
+    Returns:
+        `df` with narrowed columns
+    """
+    report = audit_schema(df, **kwargs) if report is None else report
+    dtypes = {
+        "Categorical": pl.Categorical(),
+        "Float32": pl.Float32(),
+        **{str(dtype): dtype for dtypes in _INTEGER_DTYPES.values() for dtype in dtypes},
+    }
+    changed = report.filter(pl.col("proposed") != pl.col("dtype"))
+    return df.with_columns(
+        pl.col(column).cast(dtypes[proposed])
+        for column, proposed in changed.select("column", "proposed").iter_rows()
+    )
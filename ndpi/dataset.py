@@ -0,0 +1,210 @@
+"""Datasets made of several parquet parts.
+
+A dataset is a directory with parquet parts and a `_manifest.json` listing
+them in order. `load_data` opens such a directory like a single file.
+
+Partitioned datasets use the hive layout instead, e.g.
+`flows/date=2024-01-01/sensor=a/part-0.pq.zst`, and expose the partition keys
+as columns.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import unquote
+
+import polars as pl
+
+MANIFEST_NAME = "_manifest.json"
+# Value of a partition key that is null
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+
+
+@dataclass
+class Part:
+    # relative to the dataset directory
+    path: str
+    rows: int
+    # input the part was created from, e.g. the capture file
+    source: str = ""
+
+
+@dataclass
+class Manifest:
+    parts: list[Part] = field(default_factory=list)
+    version: int = 1
+    # parts replaced by a compaction, deleted once no reader can still use them
+    retired: list[str] = field(default_factory=list)
+
+    @classmethod
+    def read(cls, directory: Union[str, Path]) -> Manifest:
+        """Read the manifest of a dataset directory.
+
+        Args:
+            directory: dataset directory
+
+        Returns:
+            Manifest
+        """
+        data = json.loads((Path(directory) / MANIFEST_NAME).read_text())
+        return cls(
+            parts=[Part(**part) for part in data.get("parts", [])],
+            version=data.get("version", 1),
+            retired=data.get("retired", []),
+        )
+
+    def write(self, directory: Union[str, Path]) -> None:
+        """Write the manifest into a dataset directory, replacing any existing one atomically.
+
+        Args:
+            directory: dataset directory
+        """
+        path = Path(directory) / MANIFEST_NAME
+        temp_path = f"{path}.temp"
+        with open(temp_path, "w") as file:
+            json.dump(asdict(self), file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        shutil.move(temp_path, path)
+
+    @property
+    def rows(self) -> int:
+        return sum(part.rows for part in self.parts)
+
+    def files(self, directory: Union[str, Path]) -> list[Path]:
+        """Absolute paths of all parts in order."""
+        return [Path(directory) / part.path for part in self.parts]
+
+    def scan(self, directory: Union[str, Path], **kwargs) -> pl.LazyFrame:
+        """Scan all parts of the dataset in order.
+
+        Parts may have been written with different inferred dtypes, e.g. a column
+        that is empty in one capture, so they are combined with their supertypes.
+
+        Args:
+            directory: dataset directory
+            **kwargs: kwargs for pl.scan_parquet
+
+        Returns:
+            pl.LazyFrame over all parts
+        """
+        files = self.files(directory)
+        if not files:
+            raise ValueError(f"Dataset {directory} has no parts")
+        return pl.concat(
+            [pl.scan_parquet(file, **kwargs) for file in files], how="vertical_relaxed"
+        )
+
+
+def is_dataset(path: Union[str, Path]) -> bool:
+    """Check whether `path` is a dataset directory with a manifest."""
+    return (Path(path) / MANIFEST_NAME).is_file()
+
+
+def scan_dataset(directory: Union[str, Path], **kwargs) -> pl.LazyFrame:
+    """Scan all parts listed in the manifest of a dataset directory.
+
+    Args:
+        directory: dataset directory
+        **kwargs: kwargs for pl.scan_parquet
+
+    Returns:
+        pl.LazyFrame over all parts
+    """
+    return Manifest.read(directory).scan(directory, **kwargs)
+
+
+def is_partitioned(path: Union[str, Path]) -> bool:
+    """Check whether `path` is a hive partitioned directory, i.e. has `key=value` subdirectories."""
+    path = Path(path)
+    return path.is_dir() and any(
+        "=" in child.name and child.is_dir() for child in path.iterdir()
+    )
+
+
+def partitions(directory: Union[str, Path]) -> pl.DataFrame:
+    """List the files of a hive partitioned directory with their partition values.
+
+    Only directory names are read, no file is opened. Hidden files and files
+    starting with `_` (e.g. `_SUCCESS`) are skipped. Partition values are parsed
+    as integers or dates if all values of a key parse, otherwise kept as strings.
+
+    Args:
+        directory: partitioned directory
+
+    Returns:
+        DataFrame with the column `path` and one column per partition key, sorted by path
+    """
+    rows = []
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        keys = {}
+        for part in Path(root).relative_to(directory).parts:
+            key, _, value = part.partition("=")
+            keys[unquote(key)] = None if value == HIVE_NULL else unquote(value)
+        rows += [
+            {"path": os.path.join(root, file), **keys}
+            for file in sorted(files)
+            if not file.startswith((".", "_")) and keys
+        ]
+    if not rows:
+        return pl.DataFrame(schema={"path": pl.String})
+    df = pl.DataFrame(rows, infer_schema_length=None)
+    return df.with_columns(
+        df.get_column(key).cast(_partition_dtype(df.get_column(key))) for key in df.columns[1:]
+    )
+
+
+def _partition_dtype(values: pl.Series) -> pl.DataType:
+    values = values.drop_nulls()
+    if values.is_empty():
+        return pl.String()
+    if values.str.to_integer(strict=False).null_count() == 0:
+        return pl.Int64()
+    if values.str.to_date("%Y-%m-%d", strict=False).null_count() == 0:
+        return pl.Date()
+    return pl.String()
+
+
+def scan_partitioned(
+    directory: Union[str, Path],
+    partition_filter: Optional[pl.Expr] = None,
+    files: Optional[list[str]] = None,
+    **kwargs,
+) -> pl.LazyFrame:
+    """Scan a hive partitioned directory, pruning partitions before any file is opened.
+
+    Args:
+        directory: partitioned directory
+        partition_filter: predicate on the partition columns, only files of matching
+            partitions are scanned
+        **kwargs: kwargs for pl.scan_parquet
+
+    Returns:
+        pl.LazyFrame over the matching files with the partition keys as columns
+    """
+    paths = partitions(directory)
+    schema = dict(paths.drop("path").schema)
+    if paths.is_empty():
+        raise ValueError(f"Partitioned dataset {directory} has no files")
+    matching = paths
+    if partition_filter is not None:
+        matching = matching.filter(partition_filter)
+    if files is not None:
+        matching = matching.filter(pl.col("path").is_in(files))
+    # Without any match the first file only provides the schema of the empty result
+    empty = matching.is_empty()
+    lf = pl.scan_parquet(
+        (paths.head(1) if empty else matching).get_column("path").to_list(),
+        hive_partitioning=True,
+        hive_schema=schema,
+        **kwargs,
+    )
+    if empty:
+        return lf.clear()
+    return lf if partition_filter is None else lf.filter(partition_filter)
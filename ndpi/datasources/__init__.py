@@ -1 +1,5 @@
-from .acknowledged_scanners import acknowledged_scanners
+from .acknowledged_scanners import (
+    acknowledged_scanners,
+    tag_acknowledged_scanners,
+    tag_acknowledged_scanners_v6,
+)
@@ -1,7 +1,17 @@
 from pathlib import Path
 import polars as pl
 import ipaddress
-from typing import Union
+from typing import Optional, Union
+
+from loguru import logger
+
+from ndpi.data.polars import Ndpi
+from ndpi.convenience import write_parquet
+from ndpi.fingerprint import digest, frame_digest
+
+_LOW_64 = (1 << 64) - 1
+
+V4_PATTERN = r"^\d{1,3}(\.\d{1,3}){3}(/([0-9]|[12][0-9]|3[0-2]))?$"
 
 
 def dict_to_acknowledged_scanners(
@@ -33,6 +43,9 @@ def acknowledged_scanners(
     expand_v4_subnets: bool = False,
     scanner_name_col: str = "scanner",
     addr_col: str = "ip.addr",
+    as_ranges: bool = False,
+    ip_version: int = 4,
+    cache: bool = False,
 ) -> pl.LazyFrame:
     """Load list of acknowledged scanners from folder.
 
@@ -49,10 +62,54 @@ def acknowledged_scanners(
         expand_subnets: expand all rows from the input address into IP addresses. Allows for fast polars joins
         scanner_name_col: column name for scanner information
         addr_col: column_name for address field
+        as_ranges: return IPv4 prefixes as sorted, disjoint integer ranges in the columns
+            `f"{addr_col}-start"` and `f"{addr_col}-end"` instead of address strings. Memory
+            is proportional to the number of prefixes, use with `tag_acknowledged_scanners`.
+            Nested prefixes are split so that the most specific prefix wins.
+        ip_version: address family returned with `as_ranges`. For 6, each IPv6 prefix is
+            returned with its prefix length and 128 bit bounds split into UInt64 halves
+            (`f"{addr_col}-start-hi"`, `-start-lo`, `-end-hi`, `-end-lo`), use with
+            `tag_acknowledged_scanners_v6`.
+        cache: compile the list into a parquet snapshot in `f"{path}.snapshot"` and reuse
+            it while the clone (git HEAD, file mtimes and sizes), `additional_prefixes` and
+            the other arguments are unchanged. The schema is the same as without cache.
 
     Returns:
         DataFrame with acknowledged scanners and their used ip addresses/subnets
     """
+    path = Path(path)
+    arguments = [expand_v4_subnets, scanner_name_col, addr_col, as_ranges, ip_version]
+    if not cache:
+        return _compile(path, additional_prefixes, *arguments)
+
+    snapshot_dir = path.with_name(f"{path.name}.snapshot")
+    variant = digest(arguments, frame_digest(additional_prefixes))
+    snapshot = snapshot_dir / f"{variant}-{digest(_clone_fingerprint(path))}.pq.zst"
+    if snapshot.is_file():
+        return pl.scan_parquet(snapshot)
+
+    df = _compile(path, additional_prefixes, *arguments).collect()
+    try:
+        snapshot_dir.mkdir(exist_ok=True)
+        # Snapshots of older versions of the clone are never read again
+        for stale in snapshot_dir.glob(f"{variant}-*.pq.zst"):
+            stale.unlink()
+        write_parquet(df, snapshot, compression="zstd")
+    except OSError as error:
+        logger.warning(f"Could not write acknowledged scanners snapshot {snapshot}: {error}")
+        return df.lazy()
+    return pl.scan_parquet(snapshot)
+
+
+def _compile(
+    path: Path,
+    additional_prefixes: Union[pl.DataFrame, pl.LazyFrame],
+    expand_v4_subnets: bool,
+    scanner_name_col: str,
+    addr_col: str,
+    as_ranges: bool,
+    ip_version: int,
+) -> pl.LazyFrame:
     df = pl.concat(
         [
             pl.scan_csv(
@@ -68,28 +125,28 @@ def acknowledged_scanners(
         # Remove empty lines
     ).filter(pl.col(addr_col).is_not_null())
 
+    if as_ranges:
+        if ip_version == 6:
+            return _v6_ranges(df, scanner_name_col, addr_col)
+        if ip_version != 4:
+            raise ValueError(f"ip_version must be 4 or 6, got {ip_version}")
+        return _v4_ranges(df, scanner_name_col, addr_col)
+
     if expand_v4_subnets:
+        # Malformed prefixes like `1.2.3.4/33` are kept as they are
         v4_subnet_condition = [
-            pl.col(addr_col).str.contains("/"),
-            pl.col(addr_col).str.contains("\."),
+            pl.col(addr_col).str.contains("/", literal=True),
+            pl.col(addr_col).str.contains(V4_PATTERN),
         ]
 
         df = df.with_row_index("id")
 
+        start, size = _v4_prefix_bounds(pl.col(addr_col))
         v4 = (
             df.filter(v4_subnet_condition)
-            .with_columns(
-                pl.col(addr_col).map_elements(
-                    # lambda x: [str(addr) for addr in ipaddress.ip_network(x, strict=False)],
-                    lambda x: [
-                        str(addr)
-                        for addr in ipaddress.ip_network(x, strict=False)
-                        if "." in x
-                    ],
-                    return_dtype=pl.List(pl.String),
-                )
-            )
+            .with_columns(pl.int_ranges(start, start + size).alias(addr_col))
             .explode(addr_col)
+            .with_columns(Ndpi(pl.col(addr_col)).int_to_ip())
         )
 
         df = pl.concat([v4, df.join(v4, on="id", how="anti")]).drop("id")
@@ -97,3 +154,244 @@ def acknowledged_scanners(
     df = df.unique(addr_col)
 
     return df
+
+
+def _clone_fingerprint(path: Path) -> list:
+    """git HEAD of the clone and path, mtime and size of every list file."""
+    head: Optional[str] = None
+    git_dir = path / ".git"
+    if (git_dir / "HEAD").is_file():
+        head = (git_dir / "HEAD").read_text().strip()
+        if head.startswith("ref: "):
+            ref = head.removeprefix("ref: ")
+            if (git_dir / ref).is_file():
+                head = (git_dir / ref).read_text().strip()
+            elif (git_dir / "packed-refs").is_file():
+                packed = (git_dir / "packed-refs").read_text().splitlines()
+                head = next((line for line in packed if line.endswith(f" {ref}")), head)
+    files = [
+        (str(file.relative_to(path)), file.stat().st_mtime_ns, file.stat().st_size)
+        for file in sorted(path.glob("data/*/*.txt"))
+    ]
+    return [head, files]
+
+
+def _v4_prefix_bounds(expr: pl.Expr) -> tuple[pl.Expr, pl.Expr]:
+    """First address and number of addresses of IPv4 prefix strings like `1.2.3.0/24`."""
+    parts = expr.str.split("/")
+    length = parts.list.get(1, null_on_oob=True).str.to_integer(strict=False).fill_null(32)
+    # Invalid lengths give null bounds instead of failing the cast of a negative exponent
+    length = pl.when(length.is_between(0, 32)).then(length)
+    size = pl.lit(2, dtype=pl.Int64).pow(32 - length)
+    return Ndpi(parts.list.first()).ip_to_int().cast(pl.Int64) // size * size, size
+
+
+def _disjoint_ranges(rows: list[tuple]) -> list[tuple]:
+    """Split nested (start, end, *payload) intervals into disjoint pieces.
+
+    CIDR prefixes either nest or are disjoint, so a stack of open intervals is
+    enough. Each piece keeps the payload of the innermost interval covering it,
+    identical intervals keep the first occurrence.
+    """
+    pieces = []
+    stack: list[tuple] = []
+    cursor = 0
+
+    def emit(until: int, interval: tuple):
+        if cursor <= until:
+            pieces.append((cursor, until, *interval[2:]))
+
+    for interval in sorted(rows, key=lambda row: (row[0], -row[1])):
+        start, end = interval[0], interval[1]
+        while stack and stack[-1][1] < start:
+            top = stack.pop()
+            emit(top[1], top)
+            cursor = top[1] + 1
+        if stack and stack[-1][:2] == (start, end):
+            continue
+        if stack:
+            emit(start - 1, stack[-1])
+        stack.append(interval)
+        cursor = start
+    while stack:
+        top = stack.pop()
+        emit(top[1], top)
+        cursor = top[1] + 1
+    return pieces
+
+
+def _v4_ranges(df: pl.LazyFrame, scanner_name_col: str, addr_col: str) -> pl.LazyFrame:
+    start, end = f"{addr_col}-start", f"{addr_col}-end"
+    first, size = _v4_prefix_bounds(pl.col(addr_col))
+    prefixes = (
+        df.filter(pl.col(addr_col).str.contains(V4_PATTERN))
+        .select(
+            first.alias(start),
+            (first + size - 1).alias(end),
+            scanner_name_col,
+            addr_col,
+        )
+        .filter(pl.col(start).is_not_null())
+        .collect()
+    )
+
+    pieces = _disjoint_ranges(prefixes.rows())
+    return pl.LazyFrame(
+        pieces, schema=prefixes.schema, orient="row"
+    ).with_columns(
+        pl.col(start).cast(pl.UInt32).set_sorted(), pl.col(end).cast(pl.UInt32)
+    )
+
+
+def _v6_ranges(df: pl.LazyFrame, scanner_name_col: str, addr_col: str) -> pl.LazyFrame:
+    # The prefix list is small, so its bounds are computed with ipaddress; only
+    # the matching against packet data needs to be vectorized.
+    prefixes = (
+        df.filter(pl.col(addr_col).str.contains(":", literal=True))
+        .select(scanner_name_col, addr_col)
+        .collect()
+    )
+    rows = []
+    seen = set()
+    for scanner, prefix in prefixes.iter_rows():
+        try:
+            network = ipaddress.IPv6Network(prefix.strip(), strict=False)
+        except ValueError as error:
+            logger.warning(f"Skipping malformed IPv6 prefix of {scanner}: {error}")
+            continue
+        start, end = int(network.network_address), int(network.broadcast_address)
+        if (start, network.prefixlen) in seen:
+            continue
+        seen.add((start, network.prefixlen))
+        rows.append(
+            (
+                start >> 64,
+                start & _LOW_64,
+                end >> 64,
+                end & _LOW_64,
+                network.prefixlen,
+                scanner,
+                prefix,
+            )
+        )
+
+    return pl.LazyFrame(
+        rows,
+        schema={
+            f"{addr_col}-start-hi": pl.UInt64,
+            f"{addr_col}-start-lo": pl.UInt64,
+            f"{addr_col}-end-hi": pl.UInt64,
+            f"{addr_col}-end-lo": pl.UInt64,
+            f"{addr_col}-prefixlen": pl.UInt8,
+            scanner_name_col: pl.String,
+            addr_col: pl.String,
+        },
+        orient="row",
+    )
+
+
+def tag_acknowledged_scanners(
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    scanners: Union[pl.DataFrame, pl.LazyFrame],
+    addr_col: str = "ip.addr",
+    scanner_name_col: str = "scanner",
+) -> pl.LazyFrame:
+    """Tag rows of `df` with the acknowledged scanner their address belongs to.
+
+    Uses a sorted (asof) range join against the output of
+    `acknowledged_scanners(..., as_ranges=True)`, so the cost does not depend on
+    the number of addresses covered by the scanner prefixes.
+
+    Args:
+        df: packet or flow frame with a numeric IPv4 address column, e.g. UInt32
+        scanners: ranges from `acknowledged_scanners(..., as_ranges=True)`
+        addr_col: numeric address column in `df`, also the `addr_col` used for `scanners`
+        scanner_name_col: column name for scanner information
+
+    Returns:
+        `df` sorted by `addr_col` with an additional `scanner_name_col` column, null for
+        addresses not covered by any scanner
+    """
+    df = df.lazy()
+    start, end = f"{addr_col}-start", f"{addr_col}-end"
+    dtype = df.collect_schema()[addr_col]
+    ranges = scanners.lazy().select(
+        pl.col(start).cast(dtype).set_sorted(),
+        pl.col(end).cast(dtype),
+        scanner_name_col,
+    )
+
+    return (
+        df.sort(addr_col)
+        .join_asof(ranges, left_on=addr_col, right_on=start, strategy="backward")
+        .with_columns(
+            pl.when(pl.col(addr_col) <= pl.col(end)).then(pl.col(scanner_name_col))
+        )
+        .drop(start, end)
+    )
+
+
+def tag_acknowledged_scanners_v6(
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    scanners: Union[pl.DataFrame, pl.LazyFrame],
+    addr_col: str = "ipv6.addr",
+    scanner_name_col: str = "scanner",
+    scanner_addr_col: str = "ip.addr",
+) -> pl.LazyFrame:
+    """Tag rows of `df` with the acknowledged scanner their IPv6 address belongs to.
+
+    Longest-prefix match: the parsed address is masked to every prefix length in
+    the list and equi-joined against the prefixes of that length, the longest
+    matching prefix wins. Nothing is expanded and no Python code runs per row.
+
+    Args:
+        df: packet or flow frame with an IPv6 address string column
+        scanners: prefixes from `acknowledged_scanners(..., as_ranges=True, ip_version=6)`
+        addr_col: IPv6 address column in `df`
+        scanner_name_col: column name for scanner information
+        scanner_addr_col: `addr_col` used when loading `scanners`
+
+    Returns:
+        `df` with an additional `scanner_name_col` column, null for addresses not
+        covered by any scanner
+    """
+    hi, lo, length = (
+        f"{scanner_addr_col}-start-hi",
+        f"{scanner_addr_col}-start-lo",
+        f"{scanner_addr_col}-prefixlen",
+    )
+    scanners = scanners.lazy().select(hi, lo, length, scanner_name_col)
+    lengths = sorted(
+        scanners.select(pl.col(length).unique()).collect().get_column(length),
+        reverse=True,
+    )
+
+    # Drop zone indices like `fe80::1%eth0` before parsing
+    address = Ndpi(pl.col(addr_col).str.replace("%.*$", "")).ip6_to_int()
+    df = df.lazy().with_columns(
+        address.struct.field("hi").alias("_hi"), address.struct.field("lo").alias("_lo")
+    )
+
+    matches = []
+    for prefixlen in lengths:
+        mask = ((1 << 128) - 1) ^ ((1 << (128 - prefixlen)) - 1)
+        match = f"_{scanner_name_col}_{prefixlen}"
+        df = df.with_columns(
+            (pl.col("_hi") & pl.lit(mask >> 64, dtype=pl.UInt64)).alias("_hi_masked"),
+            (pl.col("_lo") & pl.lit(mask & _LOW_64, dtype=pl.UInt64)).alias("_lo_masked"),
+        ).join(
+            scanners.filter(pl.col(length) == prefixlen).select(
+                pl.col(hi).alias("_hi_masked"),
+                pl.col(lo).alias("_lo_masked"),
+                pl.col(scanner_name_col).alias(match),
+            ),
+            on=["_hi_masked", "_lo_masked"],
+            how="left",
+        )
+        matches.append(match)
+
+    return df.with_columns(
+        pl.coalesce(matches).alias(scanner_name_col)
+        if matches
+        else pl.lit(None, dtype=pl.String).alias(scanner_name_col)
+    ).drop("_hi", "_lo", "_hi_masked", "_lo_masked", *matches, strict=False)
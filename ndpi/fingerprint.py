@@ -0,0 +1,115 @@
+"""Fingerprints for caches that must be invalidated when their inputs change.
+
+Files are identified by path, modification time and size, lazy queries by
+their serialized plan together with the files they scan.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import warnings
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import polars as pl
+
+# Nodes of `LazyFrame.explain` that run Python code
+PYTHON_NODES = ("python_udf()", "OPAQUE_PYTHON", "PYTHON SCAN")
+
+
+def digest(*parts) -> str:
+    """Short hash of JSON-serializable `parts` and the polars version."""
+    payload = json.dumps([*parts, pl.__version__], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def file_fingerprint(path: Union[str, Path]) -> tuple[str, int, int]:
+    """Path, modification time and size of a file."""
+    stat = os.stat(path)
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def frame_digest(df: Union[pl.DataFrame, pl.LazyFrame]) -> str:
+    """Hash of the schema and the rows of `df`, independent of the row order."""
+    df = df.lazy().collect()
+    rows = df.hash_rows().sort().to_list() if df.width else []
+    return digest(df.schema, rows)
+
+
+def plan_sources(plan: Any) -> list[str]:
+    """Local files scanned by a plan, see `plan_fingerprint`.
+
+    Args:
+        plan: plan deserialized from JSON
+
+    Returns:
+        Sorted file paths, glob patterns and directories are expanded
+    """
+    paths = set()
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for path in node.get("Paths", []) if isinstance(node.get("Paths"), list) else []:
+                if isinstance(path, dict) and "Local" in path:
+                    paths.add(path["Local"])
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    files = set()
+    for path in paths:
+        for match in glob.glob(path, recursive=True) if glob.has_magic(path) else [path]:
+            if os.path.isdir(match):
+                # Directory scans, e.g. of hive partitioned datasets, read every file below
+                files.update(str(file) for file in Path(match).rglob("*") if file.is_file())
+            else:
+                files.add(match)
+    return sorted(files)
+
+
+def plan_fingerprint(lf: pl.LazyFrame) -> Optional[str]:
+    """Hash of a lazy query and the fingerprints of all local files it scans.
+
+    The hash changes when the query, the data of embedded DataFrames or one of
+    the scanned files changes. Plans with Python functions (`map_elements`,
+    `map_batches`, IO plugins) have no fingerprint: functions imported from a
+    module are pickled by reference, so editing them would not change the hash.
+    Neither have plans that cannot be serialized or do not serialize
+    deterministically. `LazyFrame.cache` nodes get a new id every time they are
+    created.
+
+    Args:
+        lf: lazy query
+
+    Returns:
+        Hash or None if the plan cannot be fingerprinted
+    """
+    try:
+        if any(node in lf.explain(optimized=False) for node in PYTHON_NODES):
+            return None
+        plan = lf.serialize()
+        if plan != lf.serialize():
+            return None
+        files = [file_fingerprint(file) for file in scan_sources(lf)]
+    except Exception:
+        return None
+    return digest(hashlib.sha256(plan).hexdigest(), files)
+
+
+def scan_sources(lf: pl.LazyFrame) -> list[str]:
+    """Local files scanned by a lazy query, see `plan_sources`.
+
+    Args:
+        lf: lazy query
+
+    Returns:
+        Sorted file paths, empty for queries on in-memory data
+    """
+    if "SCAN [" not in lf.explain(optimized=False):
+        return []
+    # Only the JSON format exposes the scanned paths, but it is slow for
+    # plans that embed large DataFrames, so it is only used for scans
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return plan_sources(json.loads(lf.serialize(format="json")))
@@ -0,0 +1,437 @@
+"""Row group statistics of parquet files, used to skip files before they are scanned.
+
+Every parquet file stores min/max/null-count statistics per row group in its
+footer. With many parts, reading those footers dominates the startup of small
+queries, so the statistics of a file or dataset are collected once into a
+statistics manifest next to the data:
+
+- `flows.pq.zst` -> `flows.pq.zst.stats.pq`
+- dataset or partitioned directory `flows/` -> `flows/_stats.pq`
+
+`load_data(..., ranges=...)` consults the manifest to drop files and row
+groups whose values cannot fall into the requested ranges. Entries of files
+that changed since the manifest was built are ignored, `build_stats` rebuilds
+them.
+
+The footer is decoded here directly (thrift compact protocol), since pyarrow
+is not a dependency.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import struct
+from collections.abc import Iterable
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import polars as pl
+
+from .dataset import Manifest, is_dataset, is_partitioned, partitions
+
+STATS_NAME = "_stats.pq"
+# file metadata key of the sort order written by `ndpi.writer.WriterProfile`,
+# JSON list of [column, descending] pairs
+SORT_KEY = "ndpi.sort"
+# Columns of the manifest besides the `{column}-min`, `-max` and `-nulls` statistics
+FILE_COLUMNS = {
+    "file": pl.String(),
+    "mtime": pl.Int64(),
+    "size": pl.Int64(),
+    "row_group": pl.Int64(),
+    "offset": pl.Int64(),
+    "rows": pl.Int64(),
+    # sort order of the file as JSON, see `sort_order`
+    "sort": pl.String(),
+}
+# Statistics are only kept for these dtypes, strings would bloat the manifest
+STATS_DTYPES = (
+    pl.Boolean,
+    pl.Date,
+    pl.Datetime,
+    pl.Duration,
+    pl.Time,
+    pl.Int8,
+    pl.Int16,
+    pl.Int32,
+    pl.Int64,
+    pl.UInt8,
+    pl.UInt16,
+    pl.UInt32,
+    pl.UInt64,
+    pl.Float32,
+    pl.Float64,
+)
+
+# parquet physical types
+_BOOLEAN, _INT32, _INT64, _INT96, _FLOAT, _DOUBLE, _BYTE_ARRAY = range(7)
+# parquet converted types of unsigned integers (UINT_8 ... UINT_64)
+_UNSIGNED = {11, 12, 13, 14}
+_FORMATS = {_INT32: "<i", _INT64: "<q", _FLOAT: "<f", _DOUBLE: "<d"}
+
+
+class _CompactReader:
+    """Decoder for the thrift compact protocol, structs become {field id: value}."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def byte(self) -> int:
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    def zigzag(self) -> int:
+        value = self.varint()
+        return (value >> 1) ^ -(value & 1)
+
+    def value(self, kind: int) -> Any:
+        if kind in (1, 2):
+            return kind == 1
+        if kind == 3:
+            return struct.unpack("<b", bytes([self.byte()]))[0]
+        if kind in (4, 5, 6):
+            return self.zigzag()
+        if kind == 7:
+            self.pos += 8
+            return struct.unpack("<d", self.data[self.pos - 8 : self.pos])[0]
+        if kind == 8:
+            size = self.varint()
+            self.pos += size
+            return self.data[self.pos - size : self.pos]
+        if kind in (9, 10):
+            header = self.byte()
+            size, kind = header >> 4, header & 0x0F
+            if size == 15:
+                size = self.varint()
+            if kind in (1, 2):
+                return [self.byte() == 1 for _ in range(size)]
+            return [self.value(kind) for _ in range(size)]
+        if kind == 11:
+            size = self.varint()
+            if not size:
+                return {}
+            kinds = self.byte()
+            return {self.value(kinds >> 4): self.value(kinds & 0x0F) for _ in range(size)}
+        if kind == 12:
+            return self.struct()
+        raise ValueError(f"Unknown thrift compact type {kind}")
+
+    def struct(self) -> dict[int, Any]:
+        fields = {}
+        last = 0
+        while True:
+            header = self.byte()
+            if not header:
+                return fields
+            delta, kind = header >> 4, header & 0x0F
+            last = last + delta if delta else self.zigzag()
+            fields[last] = self.value(kind)
+
+
+def read_footer(path: Union[str, Path]) -> dict[int, Any]:
+    """Decode the FileMetaData of a parquet file.
+
+    Args:
+        path: parquet file
+
+    Returns:
+        FileMetaData as nested {thrift field id: value} dicts
+    """
+    with open(path, "rb") as file:
+        file.seek(-8, os.SEEK_END)
+        size, magic = struct.unpack("<i4s", file.read(8))
+        if magic != b"PAR1":
+            raise ValueError(f"{path} is not a parquet file")
+        file.seek(-8 - size, os.SEEK_END)
+        return _CompactReader(file.read(size)).struct()
+
+
+def sort_order(path: Union[str, Path]) -> list[tuple[str, bool]]:
+    """Sort order recorded by a writer profile in a parquet file.
+
+    Args:
+        path: parquet file
+
+    Returns:
+        (column, descending) pairs, empty if the file was not written sorted
+    """
+    return _sort_order(read_footer(path))
+
+
+def _sort_order(metadata: dict[int, Any]) -> list[tuple[str, bool]]:
+    for entry in metadata.get(5, []):
+        if entry.get(1) == SORT_KEY.encode():
+            return [(column, descending) for column, descending in json.loads(entry[2])]
+    return []
+
+
+def _decode(raw: Optional[bytes], element: dict[int, Any]) -> Any:
+    """Python value of a plain encoded statistics value of a schema element."""
+    kind = element.get(1)
+    if raw is None or kind not in (_BOOLEAN, *_FORMATS):
+        return None
+    if kind == _BOOLEAN:
+        return bool(raw[0])
+    logical = element.get(10, {})
+    unsigned = element.get(6) in _UNSIGNED or logical.get(10, {}).get(2) is False
+    fmt = _FORMATS[kind].upper() if unsigned and kind in (_INT32, _INT64) else _FORMATS[kind]
+    return struct.unpack(fmt, raw)[0]
+
+
+def file_stats(path: Union[str, Path], columns: Optional[Iterable[str]] = None) -> pl.DataFrame:
+    """Statistics of every row group of a parquet file.
+
+    Only top level columns with numeric or temporal dtypes have statistics.
+    Min/max are null where the writer did not record them.
+
+    Args:
+        path: parquet file
+        columns: columns to collect statistics for, default: all supported columns
+
+    Returns:
+        DataFrame with one row per row group, the columns of `FILE_COLUMNS` and
+        `{column}-min`, `{column}-max` and `{column}-nulls` per column
+    """
+    metadata = read_footer(path)
+    schema = pl.read_parquet_schema(path)
+    wanted = [
+        column
+        for column in (schema if columns is None else columns)
+        if isinstance(schema.get(column), STATS_DTYPES)
+    ]
+    elements = {element[4].decode(): element for element in metadata[2][1:] if 5 not in element}
+    stat = os.stat(path)
+    sort = json.dumps(_sort_order(metadata))
+    rows = []
+    offset = 0
+    for index, row_group in enumerate(metadata.get(4, [])):
+        row = {
+            "file": str(path),
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "row_group": index,
+            "offset": offset,
+            "rows": row_group[3],
+            "sort": sort,
+        }
+        offset += row_group[3]
+        chunks = {
+            chunk[3][3][0].decode(): chunk[3] for chunk in row_group[1] if len(chunk[3][3]) == 1
+        }
+        for column in wanted:
+            statistics = chunks.get(column, {}).get(12, {})
+            element = elements.get(column, {})
+            # min_value/max_value, the deprecated min/max use signed order for all types
+            minimum, maximum = statistics.get(6), statistics.get(5)
+            if minimum is None and element.get(6) not in _UNSIGNED and 10 not in element:
+                minimum, maximum = statistics.get(2), statistics.get(1)
+            row[f"{column}-min"] = _decode(minimum, element)
+            row[f"{column}-max"] = _decode(maximum, element)
+            row[f"{column}-nulls"] = statistics.get(3)
+        rows.append(row)
+    stats_schema = dict(FILE_COLUMNS)
+    for column in wanted:
+        physical = pl.Float64() if schema[column].is_float() else pl.Int64()
+        if schema[column] == pl.UInt64 or schema[column] == pl.Boolean:
+            physical = schema[column]
+        stats_schema |= {f"{column}-min": physical, f"{column}-max": physical}
+        stats_schema[f"{column}-nulls"] = pl.Int64()
+    df = pl.DataFrame(rows, schema=stats_schema, orient="row")
+    return df.with_columns(
+        pl.col(f"{column}-{bound}").cast(_stats_dtype(schema[column]))
+        for column in wanted
+        for bound in ("min", "max")
+    )
+
+
+def _stats_dtype(dtype: pl.DataType) -> pl.DataType:
+    # Statistics of timezone aware datetimes are stored in UTC
+    return pl.Datetime(dtype.time_unit) if isinstance(dtype, pl.Datetime) else dtype
+
+
+def stats_path(path: Union[str, Path]) -> Path:
+    """Location of the statistics manifest of a parquet file or dataset directory."""
+    path = Path(path)
+    return path / STATS_NAME if path.is_dir() else path.with_name(f"{path.name}.stats.pq")
+
+
+def data_files(path: Union[str, Path]) -> list[Path]:
+    """Parquet files of a file, dataset or partitioned directory, in scan order."""
+    path = Path(path)
+    if is_dataset(path):
+        return Manifest.read(path).files(path)
+    if is_partitioned(path):
+        return [Path(file) for file in partitions(path).get_column("path")]
+    return [path]
+
+
+def build_stats(
+    path: Union[str, Path], columns: Optional[Iterable[str]] = None, rebuild: bool = False
+) -> pl.DataFrame:
+    """Collect and write the statistics manifest of a parquet file or dataset directory.
+
+    Footers are only read for files that are new or changed since the existing
+    manifest was written, unless `rebuild` is set or `columns` differ.
+
+    Args:
+        path: parquet file, dataset or partitioned directory
+        columns: columns to collect statistics for, default: all supported columns
+        rebuild: read all footers again
+
+    Returns:
+        The manifest, see `file_stats`. File paths are relative to the manifest
+    """
+    path = Path(path)
+    root = path if path.is_dir() else path.parent
+    columns = None if columns is None else list(columns)
+    existing = None if rebuild else read_stats(path)
+    if existing is not None and columns is not None:
+        known = {name[: -len("-min")] for name in existing.columns if name.endswith("-min")}
+        if not set(columns) <= known:
+            existing = None
+    known = {} if existing is None else existing.partition_by("file", as_dict=True)
+    frames = []
+    for file in data_files(path):
+        name = os.path.relpath(file, root)
+        cached = known.get((name,))
+        if cached is not None and _is_current(cached.row(0, named=True), file):
+            frames.append(cached)
+        else:
+            frames.append(file_stats(file, columns).with_columns(file=pl.lit(name)))
+    df = (
+        pl.concat(frames, how="diagonal_relaxed")
+        if frames
+        else pl.DataFrame(schema=FILE_COLUMNS)
+    )
+    manifest = stats_path(path)
+    df.write_parquet(f"{manifest}.temp")
+    shutil.move(f"{manifest}.temp", manifest)
+    return df
+
+
+def _is_current(row: dict[str, Any], file: Path) -> bool:
+    stat = os.stat(file)
+    return row["mtime"] == stat.st_mtime_ns and row["size"] == stat.st_size
+
+
+def read_stats(path: Union[str, Path]) -> Optional[pl.DataFrame]:
+    """Read the statistics manifest of a parquet file or dataset directory.
+
+    Args:
+        path: parquet file, dataset or partitioned directory
+
+    Returns:
+        The manifest or None if there is none
+    """
+    manifest = stats_path(path)
+    return pl.read_parquet(manifest) if manifest.is_file() else None
+
+
+def _in_ranges(ranges: dict[str, tuple[Any, Any]], columns: Iterable[str]) -> pl.Expr:
+    """Whether a row group may contain values within all `ranges`, see `prune`."""
+    columns = set(columns)
+    keep = pl.lit(True)
+    for column, (low, high) in ranges.items():
+        if f"{column}-min" not in columns:
+            continue
+        minimum, maximum = pl.col(f"{column}-min"), pl.col(f"{column}-max")
+        if low is not None:
+            keep &= maximum.is_null() | (maximum >= low)
+        if high is not None:
+            keep &= minimum.is_null() | (minimum <= high)
+        # Row groups without any value of the column cannot match a range
+        keep &= pl.col(f"{column}-nulls").is_null() | (pl.col(f"{column}-nulls") < pl.col("rows"))
+    return keep
+
+
+def range_filter(ranges: dict[str, tuple[Any, Any]]) -> pl.Expr:
+    """Predicate keeping the rows within all `ranges`, bounds are inclusive and None is open."""
+    keep = pl.lit(True)
+    for column, (low, high) in ranges.items():
+        if low is not None:
+            keep &= pl.col(column) >= low
+        if high is not None:
+            keep &= pl.col(column) <= high
+    return keep
+
+
+def _naive(value: Any) -> Any:
+    # Manifest datetimes are naive UTC
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def prune(
+    path: Union[str, Path], ranges: dict[str, tuple[Any, Any]]
+) -> Optional[dict[Path, Optional[list[tuple[int, int]]]]]:
+    """Files and row groups of a file or dataset that may contain rows within `ranges`.
+
+    Args:
+        path: parquet file, dataset or partitioned directory
+        ranges: column -> (low, high), inclusive bounds, None for an open bound
+
+    Returns:
+        None without a manifest, otherwise matching file -> None to scan the whole
+        file or (offset, rows) slices of the matching row groups. Files missing
+        from the manifest or changed since it was built are always kept
+    """
+    stats = read_stats(path)
+    if stats is None:
+        return None
+    path = Path(path)
+    root = path if path.is_dir() else path.parent
+    ranges = {column: (_naive(low), _naive(high)) for column, (low, high) in ranges.items()}
+    stats = stats.with_columns(keep=_in_ranges(ranges, stats.columns))
+    by_file = stats.partition_by("file", as_dict=True)
+    result = {}
+    for file in data_files(path):
+        groups = by_file.get((os.path.relpath(file, root),))
+        if groups is None or not _is_current(groups.row(0, named=True), file):
+            result[file] = None
+        elif groups.get_column("keep").all():
+            result[file] = None
+        elif groups.get_column("keep").any():
+            slices = (
+                groups.filter("keep")
+                .group_by(pl.col("row_group") - pl.int_range(pl.len()), maintain_order=True)
+                .agg(offset=pl.col("offset").first(), rows=pl.col("rows").sum())
+            )
+            result[file] = list(slices.select("offset", "rows").iter_rows())
+    return result
+
+
+def scan_pruned(
+    files: dict[Path, Optional[list[tuple[int, int]]]], **kwargs
+) -> list[pl.LazyFrame]:
+    """Scan the result of `prune`, matching row groups are read as slices of their file.
+
+    Args:
+        files: file -> None or (offset, rows) slices
+        **kwargs: kwargs for pl.scan_parquet
+
+    Returns:
+        One LazyFrame per file
+    """
+    frames = []
+    for file, slices in files.items():
+        lf = pl.scan_parquet(file, **kwargs)
+        if slices is None:
+            frames.append(lf)
+        else:
+            frames += [lf.slice(offset, rows) for offset, rows in slices]
+    return frames
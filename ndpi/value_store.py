@@ -6,9 +6,15 @@ a ``\\setval``/``\\getval`` csname key-value store, or a Markdown table for
 contexts without ``\\getval`` (presentations, notes) where values are copied
 by hand. Metric definitions stay in the paper repository; this module only
 owns registration, collection, and emission.
+
+With a ``cache_dir``, collected query results are kept on disk keyed by the
+fingerprint of their plan and scanned files (``ndpi.fingerprint``), so a
+rebuild only collects queries that changed.
 """
 
+import os
 import re
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Callable, Optional, Union
@@ -17,6 +23,8 @@ import polars as pl
 from loguru import logger
 from matplotlib.ticker import EngFormatter
 
+from .fingerprint import plan_fingerprint, scan_sources
+
 Formatter = Union[str, Callable[[Any], str]]
 
 _NAME_FORBIDDEN = re.compile(r"[\\{}%#\s]")
@@ -55,6 +63,13 @@ def _escape_markdown(text: str) -> str:
     return text.replace("|", "\\|")
 
 
+@dataclass
+class _Derived:
+    # polars expression over the entries in `inputs` or a callable taking their values
+    compute: Union[pl.Expr, Callable[..., Any]]
+    inputs: list[str]
+
+
 @dataclass
 class _Entry:
     value: Any
@@ -62,6 +77,15 @@ class _Entry:
     note: Optional[str]
     emit: bool
     error: Optional[str] = None
+    # derived value whose expression was pushed into the batch as `value`,
+    # its errors are reported once its inputs are resolved
+    derived: Optional[_Derived] = None
+
+    @property
+    def definition(self) -> Optional[_Derived]:
+        if self.derived is not None:
+            return self.derived
+        return self.value if isinstance(self.value, _Derived) else None
 
     @property
     def errored(self) -> bool:
@@ -69,23 +93,93 @@ class _Entry:
 
     @property
     def unresolved(self) -> bool:
-        return self.error is None and isinstance(
-            self.value, (pl.LazyFrame, pl.DataFrame)
+        return self.error is None and self.pending
+
+    @property
+    def pending(self) -> bool:
+        # Checked after `errored` while a background collect may fail the entry
+        return isinstance(self.value, (pl.LazyFrame, pl.DataFrame, _Derived))
+
+
+class CollectHandle:
+    """A ``ValueStore.collect()`` running in a background thread.
+
+    Returned by ``ValueStore.collect_async()``. Entries become readable as
+    their batch finishes, ``write(pending=True)`` emits the values that are
+    ready so far.
+    """
+
+    def __init__(self, store: "ValueStore", **collect_kwargs: Any) -> None:
+        self.store = store
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run,
+            kwargs=collect_kwargs,
+            name="value-store-collect",
+            daemon=True,
         )
+        self._thread.start()
+
+    def _run(self, **collect_kwargs: Any) -> None:
+        try:
+            self.store.collect(**collect_kwargs)
+        except BaseException as error:
+            self.error = error
+
+    def done(self) -> bool:
+        """Whether the collection finished, successfully or not."""
+        return not self._thread.is_alive()
+
+    @property
+    def pending(self) -> list[str]:
+        """Names of the entries that are not resolved or errored yet."""
+        return [name for name, entry in self.store._entries.items() if entry.unresolved]
+
+    def wait(self, timeout: Optional[float] = None) -> "ValueStore":
+        """Block until the collection finished.
+
+        Args:
+            timeout: Seconds to wait at most, None to wait indefinitely.
+
+        Returns:
+            The store.
+
+        Raises:
+            TimeoutError: The collection is still running after ``timeout``.
+            Exception: Whatever ``collect()`` raised, e.g. with ``strict=True``.
+        """
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError(f"collect() still running after {timeout} s")
+        if self.error is not None:
+            raise self.error
+        return self.store
 
 
 class ValueStore:
     """Insertion-ordered registry of named scalar values for a paper.
 
     Workflow: ``register()`` LazyFrame queries, eager DataFrames, or plain
-    values; ``collect()`` to resolve them to scalars; optionally register
-    derived plain values computed from ``store[name]``; emit via
+    values and ``derive()`` values computed from other entries; ``collect()``
+    to resolve them to scalars; emit via
     ``write()`` (``values.tex``) and/or ``write_markdown()`` (a Markdown
     table), whichever output strategy the context calls for.
+
+    Args:
+        cache_dir: Directory of the on-disk result cache, None to disable.
+            Results of LazyFrame entries are stored under the fingerprint of
+            their plan and the files they scan and reused by ``collect()``
+            until either changes. Plans without a fingerprint are always
+            collected.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None) -> None:
         self._entries: dict[str, _Entry] = {}
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        # cache keys of every entry looked up so far, kept by `prune_cache()`
+        self._cache_keys: set[str] = set()
+        # held by `collect()`, a second collect waits for a running one
+        self._collecting = threading.Lock()
 
     def register(
         self,
@@ -129,22 +223,84 @@ class ValueStore:
         self._entries[name] = _Entry(value=value, fmt=fmt, note=note, emit=emit)
         return self
 
+    def derive(
+        self,
+        name: str,
+        compute: Union[pl.Expr, Callable[..., Any]],
+        inputs: Optional[list[str]] = None,
+        fmt: Optional[Formatter] = None,
+        note: Optional[str] = None,
+        emit: bool = True,
+    ) -> "ValueStore":
+        """Register a value computed from other entries, resolved by ``collect()``.
+
+        Expressions refer to other entries as columns, e.g.
+        ``pl.col("failed") / pl.col("total")``. If all their inputs are
+        queries, other expressions of that kind or plain values, they are
+        evaluated within the batched ``collect_all`` on top of the input
+        queries, which common-subplan elimination shares. Callables and
+        expressions over callables are resolved after collection in
+        dependency order. Derived values of errored entries are errored.
+
+        Args:
+            name: Key, see ``register()``.
+            compute: Polars expression over the input entries or a callable
+                that takes the values of ``inputs`` as positional arguments.
+            inputs: Names of the input entries, required for callables. For
+                expressions, defaults to the columns the expression uses.
+            fmt: See ``register()``.
+            note: See ``register()``.
+            emit: See ``register()``.
+
+        Returns:
+            self, for chaining.
+        """
+        if inputs is None:
+            if not isinstance(compute, pl.Expr):
+                raise ValueError(
+                    f"derived value {name!r}: inputs are required for callables"
+                )
+            inputs = compute.meta.root_names()
+        return self.register(name, _Derived(compute, list(inputs)), fmt, note, emit)
+
     def collect(
-        self, individual: bool = False, strict: bool = False, **collect_kwargs: Any
+        self,
+        individual: bool = False,
+        strict: bool = False,
+        max_batch_size: Optional[int] = None,
+        memory_budget: Optional[int] = None,
+        streaming: bool = False,
+        **collect_kwargs: Any,
     ) -> "ValueStore":
         """Resolve all pending LazyFrame/DataFrame entries to scalars.
 
         LazyFrame entries are collected — batched via ``pl.collect_all``
         (parallelism + common-subplan elimination) by default, or one at a
         time with ``individual=True`` (bounded memory). If the batched
-        ``collect_all`` raises, all pending entries fall back to individual
-        collection so one bad query doesn't take down the batch.
+        ``collect_all`` raises, the batch is bisected: both halves are
+        collected again with ``collect_all`` until the failing entries are
+        isolated, so one bad query doesn't take down the batch and the
+        healthy ones are still collected in batches.
+
+        ``max_batch_size`` and ``memory_budget`` split the batch into several
+        ``collect_all`` calls (see ``plan_batches``): entries that scan the
+        same files stay together so they still share common subplans, while
+        the number of queries and the input size per call are bounded.
+
+        With a ``cache_dir``, entries whose plan and input files did not
+        change since they were last collected are read from the cache and
+        only the misses are collected.
 
         Every resulting/registered DataFrame is then validated to be exactly
-        1 row x 1 column and non-null, and replaced by ``df.item()``.
+        1 row x 1 column and non-null, and replaced by ``df.item()``. Derived
+        values that could not be part of the batch are computed last.
 
         Args:
             individual: Collect LazyFrames one at a time instead of batched.
+            max_batch_size: Maximum number of queries per ``collect_all``.
+            memory_budget: Maximum bytes of input files scanned per
+                ``collect_all``, a proxy for the memory a batch needs.
+            streaming: Run the batches on the streaming engine.
             strict: Raise on the first failure instead of isolating it. With
                 the default ``False``, a failing entry logs a warning and is
                 stored as errored; ``write()`` renders it as an ``ERR``
@@ -155,30 +311,66 @@ class ValueStore:
         Returns:
             self, for chaining. Idempotent: already resolved or errored
             entries are skipped (errored entries are not retried).
+
+        Raises:
+            ValueError: A derived value depends on an unknown entry or on itself.
         """
-        lazy = {
-            name: entry
-            for name, entry in self._entries.items()
-            if entry.unresolved and isinstance(entry.value, pl.LazyFrame)
-        }
-        if lazy:
+        with self._collecting:
+            # `register()` may add entries while a `collect_async()` runs
+            entries = dict(self._entries)
+            order = self._derived_order(entries)
+            for name in order:
+                self._push_derived(name)
+            lazy = {
+                name: entry
+                for name, entry in entries.items()
+                if entry.unresolved and isinstance(entry.value, pl.LazyFrame)
+            }
+            keys = self._read_cache(lazy)
+            if streaming:
+                collect_kwargs.setdefault("engine", "streaming")
             if individual:
-                self._collect_individual(lazy, strict, collect_kwargs)
+                batches = [[name] for name in lazy]
             else:
-                try:
-                    frames = pl.collect_all(
-                        [entry.value for entry in lazy.values()], **collect_kwargs
-                    )
-                    for entry, df in zip(lazy.values(), frames):
-                        entry.value = df
-                except Exception as exc:
-                    logger.warning(
-                        f"batched collect_all failed ({exc}); "
-                        "falling back to individual collection"
-                    )
-                    self._collect_individual(lazy, strict, collect_kwargs)
+                frames = {name: entry.value for name, entry in lazy.items()}
+                batches = plan_batches(frames, max_batch_size, memory_budget)
+            for batch in batches:
+                batch = {name: lazy[name] for name in batch}
+                if individual:
+                    self._collect_individual(batch, strict, collect_kwargs)
+                else:
+                    self._collect_batched(batch, strict, collect_kwargs)
+                self._write_cache(batch, keys)
+                # Entries become readable as soon as their batch is done
+                self._extract(batch, strict)
+
+            self._extract(entries, strict)
+            for name in order:
+                self._resolve_derived(name, strict)
+        return self
 
-        for name, entry in self._entries.items():
+    def collect_async(self, **collect_kwargs: Any) -> CollectHandle:
+        """Run ``collect()`` in a background thread and return immediately.
+
+        Entries are resolved batch by batch, so with ``max_batch_size`` or
+        ``memory_budget`` the cheap values are readable (``store[name]``) and
+        emitted by ``write(pending=True)`` / ``to_markdown(pending=True)``
+        before the expensive ones finished; the rest render as ``PENDING``.
+        Without ``max_batch_size`` or ``memory_budget`` all queries form a
+        single batch and nothing becomes readable before it finished. Entries
+        registered while it runs are only resolved by the next ``collect()``.
+
+        Args:
+            **collect_kwargs: Passed through to ``collect()``.
+
+        Returns:
+            Handle to poll (``done()``, ``pending``) or ``wait()`` for.
+        """
+        return CollectHandle(self, **collect_kwargs)
+
+    def _extract(self, entries: dict[str, _Entry], strict: bool) -> None:
+        """Validate collected 1x1 DataFrames and replace them by their item."""
+        for name, entry in entries.items():
             if not (entry.unresolved and isinstance(entry.value, pl.DataFrame)):
                 continue
             df = entry.value
@@ -196,7 +388,197 @@ class ValueStore:
                 self._fail(name, entry, f"value {name!r} is null", strict)
                 continue
             entry.value = item
-        return self
+
+    def _derived_order(self, entries: dict[str, _Entry]) -> list[str]:
+        """Names of the unresolved derived ``entries`` in dependency order."""
+        order: list[str] = []
+        visiting: set[str] = set()
+
+        def visit(name: str) -> None:
+            entry = entries[name]
+            if name in order or entry.definition is None:
+                return
+            if entry.derived is None and not entry.unresolved:
+                return
+            if name in visiting:
+                raise ValueError(f"derived value {name!r} depends on itself")
+            visiting.add(name)
+            for dependency in entry.definition.inputs:
+                if dependency not in entries:
+                    raise ValueError(
+                        f"derived value {name!r} depends on unknown value "
+                        f"{dependency!r}"
+                    )
+                visit(dependency)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in entries:
+            visit(name)
+        return order
+
+    def _lazy_input(self, name: str) -> Optional[pl.LazyFrame]:
+        """Column ``name`` with the value of an entry, None if it cannot be queried."""
+        entry = self._entries[name]
+        if entry.errored or isinstance(entry.value, _Derived):
+            return None
+        if isinstance(entry.value, (pl.LazyFrame, pl.DataFrame)):
+            return entry.value.lazy().select(pl.first().alias(name))
+        try:
+            return pl.LazyFrame({name: [entry.value]})
+        except Exception:
+            return None
+
+    def _push_derived(self, name: str) -> None:
+        """Turn a derived expression over queries into a query of its own."""
+        entry = self._entries[name]
+        derived = entry.value
+        if not isinstance(derived, _Derived):
+            return
+        if not isinstance(derived.compute, pl.Expr):
+            return
+        inputs = [self._lazy_input(dependency) for dependency in derived.inputs]
+        frames = [lf for lf in inputs if lf is not None]
+        if len(frames) < len(inputs):
+            return
+        lf = pl.concat(frames, how="horizontal") if frames else pl.LazyFrame()
+        entry.value = lf.select(derived.compute.alias(name))
+        entry.derived = derived
+
+    def _resolve_derived(self, name: str, strict: bool) -> None:
+        entry = self._entries[name]
+        pushed, entry.derived = entry.derived, None
+        derived = pushed if pushed is not None else entry.value
+        if pushed is None and not (entry.unresolved and isinstance(derived, _Derived)):
+            return
+        # Checked after collection for both paths: a failing or multi-row input
+        # also breaks a pushed query, but with a less helpful error
+        for dependency in derived.inputs:
+            if self._entries[dependency].errored:
+                entry.error = None
+                self._fail(
+                    name, entry, f"value {name!r}: input {dependency!r} errored", strict
+                )
+                return
+        if pushed is not None:
+            if entry.error is not None:
+                # Deferred by `_fail` until the inputs were checked
+                message, entry.error = entry.error, None
+                self._fail(name, entry, message, strict)
+            return
+        values = [self[dependency] for dependency in derived.inputs]
+        try:
+            if isinstance(derived.compute, pl.Expr):
+                row = pl.DataFrame(
+                    [pl.Series(n, [v]) for n, v in zip(derived.inputs, values)]
+                )
+                entry.value = row.select(derived.compute).item()
+            else:
+                entry.value = derived.compute(*values)
+        except Exception as exc:
+            if strict:
+                raise
+            self._fail(name, entry, f"deriving value {name!r} failed: {exc}", False)
+
+    def _read_cache(self, lazy: dict[str, _Entry]) -> dict[str, str]:
+        """Resolve cache hits to DataFrames and remove them from ``lazy``.
+
+        Returns:
+            name -> cache key of the remaining entries that have a fingerprint
+        """
+        if self.cache_dir is None:
+            return {}
+        keys = {}
+        for name, entry in list(lazy.items()):
+            key = plan_fingerprint(entry.value)
+            if key is None:
+                continue
+            self._cache_keys.add(key)
+            path = self.cache_dir / f"{key}.pq"
+            if path.is_file():
+                entry.value = pl.read_parquet(path)
+                del lazy[name]
+            else:
+                keys[name] = key
+        return keys
+
+    def _write_cache(self, lazy: dict[str, _Entry], keys: dict[str, str]) -> None:
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for name, entry in lazy.items():
+            key = keys.get(name)
+            if key is None or entry.errored or not isinstance(entry.value, pl.DataFrame):
+                continue
+            path = self.cache_dir / f"{key}.pq"
+            try:
+                entry.value.write_parquet(f"{path}.temp")
+                Path(f"{path}.temp").replace(path)
+            except Exception as exc:
+                # e.g. Object columns, the value is collected again next time
+                logger.warning(f"caching value {name!r} failed: {exc}")
+
+    def prune_cache(self) -> list[Path]:
+        """Remove cached results that no entry of this store uses.
+
+        ``collect()`` never removes cache files, so results of edited queries
+        and of changed input files pile up. Call this after ``collect()`` and
+        only if ``cache_dir`` is not shared with other stores, their results
+        would be removed as well. Entries that were not collected yet keep
+        their results.
+
+        Returns:
+            Removed files, including leftovers of interrupted writes
+        """
+        if self.cache_dir is None or not self.cache_dir.is_dir():
+            return []
+        with self._collecting:
+            keys = set(self._cache_keys)
+            for entry in self._entries.values():
+                if entry.unresolved and isinstance(entry.value, pl.LazyFrame):
+                    key = plan_fingerprint(entry.value)
+                    if key is not None:
+                        keys.add(key)
+            removed = []
+            for path in self.cache_dir.iterdir():
+                # `<key>.pq` and `<key>.pq.temp`
+                if path.is_file() and path.name.split(".")[0] not in keys:
+                    path.unlink()
+                    removed.append(path)
+        return removed
+
+    def _collect_batched(
+        self,
+        lazy: dict[str, _Entry],
+        strict: bool,
+        collect_kwargs: dict[str, Any],
+        bisecting: bool = False,
+    ) -> None:
+        if len(lazy) == 1 and bisecting:
+            self._collect_individual(lazy, strict, collect_kwargs)
+            return
+        try:
+            frames = pl.collect_all(
+                [entry.value for entry in lazy.values()], **collect_kwargs
+            )
+        except Exception as exc:
+            if not bisecting:
+                logger.warning(
+                    f"batched collect_all failed ({exc}); "
+                    "falling back to bisecting the batch"
+                )
+            if len(lazy) == 1:
+                self._collect_individual(lazy, strict, collect_kwargs)
+                return
+            names = list(lazy)
+            middle = len(names) // 2
+            for half in (names[:middle], names[middle:]):
+                self._collect_batched(
+                    {name: lazy[name] for name in half}, strict, collect_kwargs, True
+                )
+            return
+        for entry, df in zip(lazy.values(), frames):
+            entry.value = df
 
     def _collect_individual(
         self, lazy: dict[str, _Entry], strict: bool, collect_kwargs: dict[str, Any]
@@ -205,14 +587,18 @@ class ValueStore:
             try:
                 entry.value = entry.value.collect(**collect_kwargs)
             except Exception as exc:
-                if strict:
+                if strict and entry.derived is None:
                     raise
                 self._fail(
-                    name, entry, f"collecting value {name!r} failed: {exc}", False
+                    name, entry, f"collecting value {name!r} failed: {exc}", strict
                 )
 
     @staticmethod
     def _fail(name: str, entry: _Entry, message: str, strict: bool) -> None:
+        if entry.derived is not None:
+            # Reported by `_resolve_derived`, an input may be the cause
+            entry.error = message
+            return
         if strict:
             raise ValueError(message)
         entry.error = message
@@ -229,22 +615,27 @@ class ValueStore:
             )
         if entry.unresolved:
             raise RuntimeError(
-                f"value {name!r} is not resolved yet; call collect() first"
+                f"value {name!r} is not resolved yet; call collect() first "
+                "or wait for collect_async()"
             )
         return entry.value
 
     def __contains__(self, name: str) -> bool:
         return name in self._entries
 
-    def write(self, path: Union[str, Path], xspace: bool = True) -> None:
+    def write(
+        self, path: Union[str, Path], xspace: bool = True, pending: bool = False
+    ) -> None:
         """Write all ``emit=True`` entries to ``path`` as ``\\setval`` lines.
 
         Args:
             path: Output file, typically ``values.tex``.
             xspace: Append ``\\xspace`` to every value (requires
                 ``\\usepackage{xspace}`` in the paper).
+            pending: Write unresolved entries as ``PENDING`` placeholders
+                instead of raising, e.g. while ``collect_async()`` runs.
         """
-        self._require_resolved()
+        self._require_resolved(pending)
         lines = [_PREAMBLE]
         for name, entry in self._entries.items():
             if not entry.emit:
@@ -254,6 +645,9 @@ class ValueStore:
                 comment = " ".join(entry.error.split())
                 lines.append(f"\\setval{{{name}}}{{ERR}} % ERROR: {comment}")
                 continue
+            if entry.pending:
+                lines.append(f"\\setval{{{name}}}{{PENDING}} % PENDING")
+                continue
             text = self._format(name, entry)
             value = _escape_tex(text)
             if xspace:
@@ -264,7 +658,7 @@ class ValueStore:
             lines.append(line)
         Path(path).write_text("\n".join(lines) + "\n")
 
-    def to_markdown(self) -> str:
+    def to_markdown(self, pending: bool = False) -> str:
         """Render all ``emit=True`` entries as a Markdown table.
 
         Values are formatted with the same ``fmt`` as in ``write()`` but
@@ -272,10 +666,13 @@ class ValueStore:
         into presentations or notes. Errored entries render as ``ERR`` with
         the error message in the note column.
 
+        Args:
+            pending: Render unresolved entries as ``PENDING`` instead of raising.
+
         Returns:
             The table as a string, ending in a newline.
         """
-        self._require_resolved()
+        self._require_resolved(pending)
         rows = []
         for name, entry in self._entries.items():
             if not entry.emit:
@@ -284,6 +681,8 @@ class ValueStore:
                 assert entry.error is not None
                 value = "ERR"
                 note = f"ERROR: {' '.join(entry.error.split())}"
+            elif entry.pending:
+                value, note = "PENDING", "PENDING"
             else:
                 value = self._format(name, entry)
                 note = entry.note or ""
@@ -304,11 +703,13 @@ class ValueStore:
         lines.insert(1, "|" + "|".join("-" * (w + 2) for w in widths) + "|")
         return "\n".join(lines) + "\n"
 
-    def write_markdown(self, path: Union[str, Path]) -> None:
+    def write_markdown(self, path: Union[str, Path], pending: bool = False) -> None:
         """Write the ``to_markdown()`` table to ``path``, e.g. ``values.md``."""
-        Path(path).write_text(self.to_markdown())
+        Path(path).write_text(self.to_markdown(pending))
 
-    def _require_resolved(self) -> None:
+    def _require_resolved(self, pending: bool = False) -> None:
+        if pending:
+            return
         unresolved = [
             name for name, entry in self._entries.items() if entry.unresolved
         ]
@@ -333,6 +734,77 @@ class ValueStore:
         return text
 
 
+def plan_batches(
+    frames: dict[str, pl.LazyFrame],
+    max_batch_size: Optional[int] = None,
+    memory_budget: Optional[int] = None,
+) -> list[list[str]]:
+    """Group queries into ``collect_all`` batches that share their inputs.
+
+    Queries that scan a common file are kept together, as far as the limits
+    allow, so that common-subplan elimination can share the scans. Groups are
+    packed into batches in registration order until a batch would exceed
+    ``max_batch_size`` queries or ``memory_budget`` bytes of distinct input
+    files, groups exceeding the limits on their own are split. Queries on
+    in-memory data have no input size.
+
+    Args:
+        frames: name -> query
+        max_batch_size: Maximum number of queries per batch, None for no limit.
+        memory_budget: Maximum bytes of input files per batch, None for no limit.
+
+    Returns:
+        Batches of names, every name occurs in exactly one batch.
+    """
+    if max_batch_size is None and memory_budget is None:
+        return [list(frames)] if frames else []
+    limit = max_batch_size or len(frames)
+    budget = float("inf") if memory_budget is None else memory_budget
+    index = {name: position for position, name in enumerate(frames)}
+    # Directory scans are expanded to the files below them
+    sources = {name: set(scan_sources(lf)) for name, lf in frames.items()}
+    sizes = {
+        file: os.path.getsize(file) for files in sources.values() for file in files
+    }
+
+    # Connected components of queries linked by shared files
+    groups: list[tuple[list[str], set[str]]] = []
+    for name, files in sources.items():
+        linked = [group for group in groups if group[1] & files]
+        groups = [group for group in groups if not group[1] & files]
+        names = [other for group in linked for other in group[0]] + [name]
+        groups.append((names, files.union(*(group[1] for group in linked))))
+    groups.sort(key=lambda group: min(index[name] for name in group[0]))
+
+    batches: list[list[str]] = []
+    batch: list[str] = []
+    files: set[str] = set()
+
+    def fits(names: list[str], new_files: set[str]) -> bool:
+        size = sum(sizes[file] for file in files | new_files)
+        return len(batch) + len(names) <= limit and size <= budget
+
+    for names, group_files in groups:
+        if batch and not fits(names, group_files):
+            # Start a new batch rather than splitting a group that fits into one
+            batches.append(batch)
+            batch, files = [], set()
+        # Queries on the same files are adjacent if the group has to be split
+        first = {}
+        for name in sorted(names, key=lambda name: index[name]):
+            first.setdefault(frozenset(sources[name]), index[name])
+        names = sorted(
+            names, key=lambda name: (first[frozenset(sources[name])], index[name])
+        )
+        for name in names:
+            if batch and not fits([name], sources[name]):
+                batches.append(batch)
+                batch, files = [], set()
+            batch.append(name)
+            files |= sources[name]
+    return batches + [batch] if batch else batches
+
+
 def fmt_eng(places: int = 1) -> Callable[[Any], str]:
     """Engineering notation without a separator space, e.g. ``2.1M``, ``116.0k``.
 
@@ -0,0 +1,123 @@
+"""Writer profiles for `sink_parquet` and `write_parquet`.
+
+Min/max statistics only allow skipping row groups (see `ndpi.row_groups`) if
+the rows are clustered by the filtered columns. A profile sorts the rows by its
+keys before writing, chooses the row group layout and compression and records
+the sort order in the file metadata, see `ndpi.row_groups.sort_order`.
+
+polars has no per-column encoding or compression options, string columns that
+are listed in `dictionary` are written as Categorical, i.e. dictionary encoded.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Optional, TypeVar, Union
+
+import polars as pl
+
+from .row_groups import SORT_KEY
+
+Frame = TypeVar("Frame", pl.DataFrame, pl.LazyFrame)
+
+
+@dataclass
+class WriterProfile:
+    # columns the rows are sorted by, in order of precedence
+    sort_by: list[str] = field(default_factory=list)
+    # sort direction of all or of each sort column
+    descending: Union[bool, list[bool]] = False
+    # rows per row group, smaller groups are skipped more precisely but compress worse
+    row_group_size: Optional[int] = None
+    # uncompressed bytes per data page
+    data_page_size: Optional[int] = None
+    compression: str = "zstd"
+    # zstd: 1 (fast) - 22 (small)
+    compression_level: Optional[int] = None
+    # string columns written dictionary encoded, as Categorical
+    dictionary: list[str] = field(default_factory=list)
+    # write the row group statistics manifest, for all or the listed columns
+    stats: Union[bool, list[str]] = False
+
+    @property
+    def sort_order(self) -> list[tuple[str, bool]]:
+        """(column, descending) for every sort column."""
+        descending = self.descending
+        if isinstance(descending, bool):
+            descending = [descending] * len(self.sort_by)
+        return list(zip(self.sort_by, descending))
+
+    def prepare(self, df: Frame) -> Frame:
+        """Sort `df` and cast dictionary columns.
+
+        Sorting a LazyFrame that is sunk runs on the streaming engine, which
+        spills to disk for data larger than memory.
+
+        Args:
+            df: data to write
+
+        Returns:
+            `df` in the layout of the profile
+        """
+        if self.dictionary:
+            df = df.with_columns(pl.col(self.dictionary).cast(pl.Categorical))
+        if self.sort_by:
+            df = df.sort(self.sort_by, descending=self.descending, maintain_order=True)
+        return df
+
+    def options(self, metadata: Optional[dict[str, str]] = None) -> dict[str, Any]:
+        """kwargs for `sink_parquet`/`write_parquet`.
+
+        Args:
+            metadata: additional file metadata
+
+        Returns:
+            kwargs with the compression, row group layout and sort order metadata
+        """
+        options: dict[str, Any] = {"compression": self.compression}
+        if self.compression_level is not None:
+            options["compression_level"] = self.compression_level
+        if self.row_group_size is not None:
+            options["row_group_size"] = self.row_group_size
+        if self.data_page_size is not None:
+            options["data_page_size"] = self.data_page_size
+        metadata = dict(metadata or {})
+        if self.sort_by:
+            metadata[SORT_KEY] = json.dumps(self.sort_order)
+        if metadata:
+            options["metadata"] = metadata
+        return options
+
+
+WRITER_PROFILES: dict[str, WriterProfile] = {
+    # quick intermediate results
+    "fast": WriterProfile(compression_level=1),
+    # long term storage of processed data
+    "archive": WriterProfile(compression_level=19, row_group_size=1_048_576),
+    # packet tables filtered by time windows and addresses
+    "packets": WriterProfile(
+        sort_by=["frame.time", "ip.src"],
+        row_group_size=131_072,
+        compression_level=9,
+        stats=["frame.time", "ip.src", "ip.dst", "tcp.srcport", "tcp.dstport"],
+    ),
+}
+
+
+def writer_profile(profile: Union[str, WriterProfile]) -> WriterProfile:
+    """Resolve the name of a profile in `WRITER_PROFILES`.
+
+    Args:
+        profile: profile or its name
+
+    Returns:
+        WriterProfile
+    """
+    if isinstance(profile, WriterProfile):
+        return profile
+    if profile not in WRITER_PROFILES:
+        raise ValueError(
+            f"Unknown writer profile {profile}, expected one of {list(WRITER_PROFILES)}"
+        )
+    return WRITER_PROFILES[profile]
@@ -0,0 +1,158 @@
+import ipaddress
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from ndpi.datasources import (
+    acknowledged_scanners,
+    tag_acknowledged_scanners,
+    tag_acknowledged_scanners_v6,
+)
+
+
+def _write_clone(path, scanners):
+    for scanner, lines in scanners.items():
+        (path / "data" / scanner).mkdir(parents=True)
+        (path / "data" / scanner / "list.txt").write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.fixture
+def clone(tmp_path):
+    """Minimal clone of the acknowledged_scanners repository."""
+    return _write_clone(
+        tmp_path,
+        {
+            "alpha": [
+                "# comment",
+                "1.2.3.0/24",
+                "1.2.3.4",
+                "10.0.0.0/8",
+                "2001:db8::/32",
+                # Typo in the prefix length
+                "9.8.7.6/33",
+            ],
+            "beta": [
+                "10.1.0.0/16",
+                "10.1.2.3",
+                "",
+                "2001:db8:1::/48",
+                "5.6.7.8",
+                # Prefix length out of range
+                "2001:db8::/129",
+            ],
+        },
+    )
+
+
+def _v4(addresses):
+    return pl.DataFrame(
+        {"ip.addr": [int(ipaddress.ip_address(a)) for a in addresses]},
+        schema={"ip.addr": pl.UInt32},
+    )
+
+
+def test_ranges_are_sorted_and_disjoint(clone):
+    ranges = acknowledged_scanners(clone, as_ranges=True).collect()
+    starts = ranges.get_column("ip.addr-start")
+    ends = ranges.get_column("ip.addr-end")
+    assert starts.is_sorted()
+    assert (starts.slice(1) > ends.slice(0, len(ends) - 1)).all()
+    # IPv6 and invalid prefixes are not part of the IPv4 ranges
+    assert not ranges.get_column("ip.addr").str.contains(":").any()
+    assert "9.8.7.6/33" not in ranges.get_column("ip.addr").to_list()
+
+
+def test_tag_most_specific_prefix_wins(clone):
+    ranges = acknowledged_scanners(clone, as_ranges=True)
+    tagged = tag_acknowledged_scanners(
+        _v4(["10.1.2.3", "10.2.0.0", "10.1.9.9", "1.2.3.5", "9.9.9.9", "5.6.7.8"]),
+        ranges,
+    ).collect()
+    expected = {
+        "10.1.2.3": "beta",
+        "10.2.0.0": "alpha",
+        "10.1.9.9": "beta",
+        "1.2.3.5": "alpha",
+        "9.9.9.9": None,
+        "5.6.7.8": "beta",
+    }
+    assert {
+        str(ipaddress.ip_address(addr)): scanner for addr, scanner in tagged.rows()
+    } == expected
+
+
+def test_tag_matches_subnet_expansion(tmp_path):
+    clone = _write_clone(
+        tmp_path, {"alpha": ["1.2.3.0/28", "1.2.3.4", "9.8.7.6/33"], "beta": ["5.6.7.8"]}
+    )
+    additional = pl.DataFrame({"scanner": ["gamma"], "ip.addr": ["8.8.8.0/30"]})
+    expanded = acknowledged_scanners(
+        clone, additional_prefixes=additional, expand_v4_subnets=True
+    ).collect()
+    addresses = ["8.8.8.1", "8.8.8.4", "1.2.3.15", "1.2.3.16", "5.6.7.8", "5.6.7.9"]
+    covered = set(expanded.get_column("ip.addr")) & set(addresses)
+    # Invalid prefixes are not expanded
+    assert "9.8.7.6/33" in expanded.get_column("ip.addr").to_list()
+
+    tagged = tag_acknowledged_scanners(
+        _v4(addresses),
+        acknowledged_scanners(clone, additional_prefixes=additional, as_ranges=True),
+    ).collect()
+    assert {
+        str(ipaddress.ip_address(addr))
+        for addr in tagged.filter(pl.col("scanner").is_not_null()).get_column("ip.addr")
+    } == covered
+
+
+def test_tag_v6_longest_prefix_match(clone):
+    prefixes = acknowledged_scanners(clone, as_ranges=True, ip_version=6)
+    # The malformed prefix is skipped instead of failing the whole list
+    assert "2001:db8::/129" not in prefixes.collect().get_column("ip.addr").to_list()
+    packets = pl.DataFrame(
+        {"ipv6.addr": ["2001:db8::5", "2001:db8:1::9", "2001:db9::1", "::ffff:1.2.3.4", None]}
+    )
+    tagged = tag_acknowledged_scanners_v6(packets, prefixes).collect()
+    assert tagged.columns == ["ipv6.addr", "scanner"]
+    assert dict(tagged.rows()) == {
+        "2001:db8::5": "alpha",
+        "2001:db8:1::9": "beta",
+        "2001:db9::1": None,
+        "::ffff:1.2.3.4": None,
+        None: None,
+    }
+
+
+def test_snapshot_is_reused_until_clone_changes(clone):
+    snapshot_dir = clone.with_name(f"{clone.name}.snapshot")
+    uncached = acknowledged_scanners(clone, as_ranges=True).collect()
+    # Caching is opt-in
+    assert not snapshot_dir.exists()
+    first = acknowledged_scanners(clone, as_ranges=True, cache=True).collect()
+    (snapshot,) = snapshot_dir.iterdir()
+
+    cached = acknowledged_scanners(clone, as_ranges=True, cache=True).collect()
+    assert_frame_equal(cached, first)
+    assert list(snapshot_dir.iterdir()) == [snapshot]
+    assert_frame_equal(first, uncached)
+
+    with open(clone / "data" / "beta" / "list.txt", "a") as file:
+        file.write("9.9.9.9\n")
+    changed = acknowledged_scanners(clone, as_ranges=True, cache=True).collect()
+    assert 9 * 0x01010101 in changed.get_column("ip.addr-start").to_list()
+    # The outdated snapshot is replaced
+    assert snapshot not in list(snapshot_dir.iterdir())
+    assert len(list(snapshot_dir.iterdir())) == 1
+
+
+def test_snapshot_depends_on_arguments(clone):
+    additional = pl.DataFrame({"scanner": ["gamma"], "ip.addr": ["8.8.8.0/30"]})
+    plain = acknowledged_scanners(clone, cache=True).collect()
+    extended = acknowledged_scanners(
+        clone, additional_prefixes=additional, cache=True
+    ).collect()
+    assert "gamma" not in plain.get_column("scanner").to_list()
+    assert "gamma" in extended.get_column("scanner").to_list()
+    snapshot_dir = clone.with_name(f"{clone.name}.snapshot")
+    assert len(list(snapshot_dir.iterdir())) == 2
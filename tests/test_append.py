@@ -0,0 +1,88 @@
+import threading
+
+import polars as pl
+
+import ndpi.append
+
+from ndpi.append import append, compact, compact_background
+from ndpi.convenience import load_data
+from ndpi.dataset import Manifest
+from ndpi.row_groups import build_stats, read_stats
+
+
+def test_append_adds_immutable_parts(tmp_path):
+    directory = tmp_path / "flows"
+    first = append(directory, pl.DataFrame({"a": [1, 2]}), source="day1")
+    files = {file: file.stat().st_mtime_ns for file in directory.glob("part-*")}
+    build_stats(directory)
+    append(directory, pl.LazyFrame({"a": [3]}), source="day2")
+
+    manifest = Manifest.read(directory)
+    assert manifest.parts[0] == first
+    assert [part.source for part in manifest.parts] == ["day1", "day2"]
+    assert {file: file.stat().st_mtime_ns for file in files} == files
+    assert load_data("flows", directory=tmp_path).collect().get_column("a").to_list() == [1, 2, 3]
+    # The statistics manifest covers the new part
+    assert read_stats(directory).height == 2
+
+
+def test_compact_merges_small_parts(tmp_path):
+    directory = tmp_path / "flows"
+    for day in range(4):
+        append(directory, pl.DataFrame({"a": [day, day]}), source=f"day{day}")
+    old = Manifest.read(directory).files(directory)
+
+    manifest = compact(directory, min_part_size=10**6, target_size=10**6)
+    assert len(manifest.parts) == 1
+    assert manifest.parts[0].rows == 8
+    assert manifest.parts[0].source == "day0;day1;day2;day3"
+    # Merged parts stay readable until the next compaction
+    assert all(file.exists() for file in old)
+    df = load_data("flows", directory=tmp_path).collect()
+    assert df.get_column("a").to_list() == [0, 0, 1, 1, 2, 2, 3, 3]
+
+    append(directory, pl.DataFrame({"a": [4]}))
+    compact_background(directory, min_part_size=10**6, target_size=10**6).join()
+    assert not any(file.exists() for file in old)
+    assert Manifest.read(directory).rows == 9
+
+
+def test_concurrent_compactions(tmp_path):
+    directory = tmp_path / "flows"
+    for day in range(4):
+        append(directory, pl.DataFrame({"a": [day]}), source=f"day{day}")
+    barrier = threading.Barrier(2)
+    threads = [
+        threading.Thread(target=lambda: (barrier.wait(), compact(directory, 10**6, 10**6)))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    manifest = Manifest.read(directory)
+    assert len(manifest.parts) == 1
+    df = load_data("flows", directory=tmp_path).collect()
+    assert df.get_column("a").to_list() == [0, 1, 2, 3]
+    # No merged part is left behind outside of the manifest
+    on_disk = {file.name for file in directory.glob("part-*")}
+    assert on_disk == {part.path for part in manifest.parts} | set(manifest.retired)
+
+
+def test_compact_discards_changed_runs(tmp_path, monkeypatch):
+    directory = tmp_path / "flows"
+    for day in range(3):
+        append(directory, pl.DataFrame({"a": [day]}))
+    sink_parquet = ndpi.append.sink_parquet
+
+    def rewrite_manifest(lf, path, **kwargs):
+        sink_parquet(lf, path, **kwargs)
+        manifest = Manifest.read(directory)
+        del manifest.parts[1]
+        manifest.write(directory)
+
+    monkeypatch.setattr(ndpi.append, "sink_parquet", rewrite_manifest)
+    manifest = compact(directory, 10**6, 10**6)
+    assert len(manifest.parts) == 2
+    assert len(list(directory.glob("part-*"))) == 3
@@ -0,0 +1,64 @@
+from datetime import date
+
+import polars as pl
+
+from ndpi.convenience import load_data
+from ndpi.dataset import MANIFEST_NAME, Manifest, Part, is_dataset, is_partitioned, partitions
+
+
+def _dataset(directory, parts):
+    directory.mkdir()
+    manifest = Manifest()
+    for index, df in enumerate(parts):
+        name = f"part-{index:05d}.pq.zst"
+        df.write_parquet(directory / name)
+        manifest.parts.append(Part(path=name, rows=df.height, source=f"trace{index}"))
+    manifest.write(directory)
+    return manifest
+
+
+def test_manifest_roundtrip(tmp_path):
+    manifest = _dataset(tmp_path / "ds", [pl.DataFrame({"a": [1, 2]}), pl.DataFrame({"a": [3]})])
+    assert is_dataset(tmp_path / "ds")
+    assert not (tmp_path / "ds" / f"{MANIFEST_NAME}.temp").exists()
+    assert Manifest.read(tmp_path / "ds") == manifest
+    assert manifest.rows == 3
+
+
+def test_load_data_opens_datasets_in_order(tmp_path):
+    _dataset(
+        tmp_path / "ds",
+        [
+            pl.DataFrame({"a": [1, 2]}),
+            # Column types inferred from a capture without values for `a`
+            pl.DataFrame({"a": [None]}, schema={"a": pl.String}),
+            pl.DataFrame({"a": [4]}),
+        ],
+    )
+    pl.DataFrame({"a": ["5"]}).write_parquet(tmp_path / "single.pq.zst")
+    df = load_data(["ds", "single"], directory=tmp_path).collect()
+    assert df.get_column("a").to_list() == ["1", "2", None, "4", "5"]
+
+
+def test_load_data_prunes_partitions(tmp_path):
+    for day in ["2024-01-01", "2024-01-02"]:
+        for sensor in ["a", "b"]:
+            directory = tmp_path / "flows" / f"date={day}" / f"sensor={sensor}"
+            directory.mkdir(parents=True)
+            pl.DataFrame({"x": [1, 2]}).write_parquet(directory / "part-0.pq.zst")
+    (tmp_path / "flows" / "_SUCCESS").write_text("")
+    assert is_partitioned(tmp_path / "flows")
+
+    df = load_data("flows", directory=tmp_path).collect()
+    assert df.schema == {"x": pl.Int64, "date": pl.Date, "sensor": pl.String}
+    assert df.height == 8
+
+    # A broken file in a pruned partition is never opened
+    (tmp_path / "flows" / "date=2024-01-01" / "sensor=a" / "part-0.pq.zst").write_text("broken")
+    day = pl.col("date") == date(2024, 1, 2)
+    df = load_data("flows", directory=tmp_path, partition_filter=day).collect()
+    assert df.get_column("sensor").to_list() == ["a", "a", "b", "b"]
+    df = load_data("flows", directory=tmp_path, partition_filter=pl.col("sensor") == "b").collect()
+    assert df.get_column("date").to_list() == [date(2024, 1, 1)] * 2 + [date(2024, 1, 2)] * 2
+
+    assert partitions(tmp_path / "flows").height == 4
@@ -0,0 +1,204 @@
+import importlib
+import os
+import time
+from datetime import timedelta
+from functools import partial
+
+import polars as pl
+from polars.io.plugins import register_io_source
+from polars.testing import assert_frame_equal
+
+from ndpi.data.filter import (
+    _apply_filter,
+    apply_filters,
+    assemble_meta_frame,
+    commutative,
+    optimize_order,
+    profile_filters,
+    prune_checkpoints,
+)
+
+FILTERS = [
+    (pl.col("x") > 2, "gt2"),
+    pl.col("x") < 15,
+    (lambda df: df.filter(pl.col("id") % 2 == 0), "even"),
+    (pl.col("x") != 10, "ne10"),
+    (pl.col("x") != 99, "noop"),
+]
+
+
+def _source(scans: list[int]) -> pl.LazyFrame:
+    df = pl.DataFrame({"id": range(20), "x": [None if i % 7 == 0 else i for i in range(20)]})
+
+    def source(with_columns, predicate, n_rows, batch_size):
+        scans.append(1)
+        batch = df if predicate is None else df.filter(predicate)
+        yield batch if with_columns is None else batch.select(with_columns)
+
+    return register_io_source(source, schema=df.schema)
+
+
+def test_single_pass_matches_step_by_step():
+    expected_df, stats, expected_names = apply_filters(_source([]), FILTERS)
+    expected = assemble_meta_frame(stats, "test")
+    df, stats, names = apply_filters(_source([]), FILTERS, single_pass=True)
+    assert_frame_equal(df.collect(), expected_df.collect())
+    assert_frame_equal(assemble_meta_frame(stats, "test"), expected)
+    assert names == expected_names
+    assert expected.get_column("after").to_list() == [15, 10, 5, 4, 4]
+
+
+def test_single_pass_scans_once_per_segment():
+    scans = []
+    _, stats, _ = apply_filters(_source(scans), FILTERS[:2], single_pass=True)
+    assemble_meta_frame(stats)
+    assert len(scans) == 1
+
+
+def test_checkpoints_resume_from_deepest_valid(tmp_path):
+    path = tmp_path / "input.pq"
+    pl.DataFrame({"id": range(20), "x": [None if i % 7 == 0 else i for i in range(20)]}).write_parquet(path)
+    checkpoints = tmp_path / "checkpoints"
+    expected_df, stats, _ = apply_filters(pl.scan_parquet(path), FILTERS)
+    expected = assemble_meta_frame(stats)
+
+    for single_pass in [False, True]:
+        for _ in range(2):
+            df, stats, _ = apply_filters(
+                pl.scan_parquet(path),
+                FILTERS,
+                single_pass=single_pass,
+                checkpoint=["gt2", 2],
+                checkpoint_dir=checkpoints / str(single_pass),
+            )
+            assert_frame_equal(df.collect(), expected_df.collect())
+            assert_frame_equal(assemble_meta_frame(stats), expected)
+            assert str(checkpoints) in df.explain()
+        assert len(list((checkpoints / str(single_pass)).glob("*.meta.pq.zst"))) == 2
+
+    # Changing a later step keeps the checkpoints before it
+    changed = FILTERS[:3] + [(pl.col("x") != 12, "ne12")]
+    apply_filters(pl.scan_parquet(path), changed, checkpoint=True, checkpoint_dir=checkpoints / "False")
+    assert len(list((checkpoints / "False").glob("*.meta.pq.zst"))) == 3
+
+    # Rewriting the input invalidates all of them
+    pl.DataFrame({"id": range(10), "x": range(10)}).write_parquet(path)
+    df, stats, _ = apply_filters(
+        pl.scan_parquet(path), FILTERS, checkpoint=["gt2", 2], checkpoint_dir=checkpoints / "False"
+    )
+    assert df.collect().get_column("id").to_list() == [4, 6, 8]
+    assert len(list((checkpoints / "False").glob("*.meta.pq.zst"))) == 5
+
+
+def test_checkpoints_follow_directory_scans(tmp_path):
+    dataset = tmp_path / "input" / "day=1"
+    dataset.mkdir(parents=True)
+    pl.DataFrame({"id": range(20), "x": range(20)}).write_parquet(dataset / "part-0.pq")
+    checkpoints = tmp_path / "checkpoints"
+    # A bare name selects that single step
+    kwargs = {"checkpoint": "gt2", "checkpoint_dir": checkpoints}
+    df, _, _ = apply_filters(pl.scan_parquet(tmp_path / "input"), FILTERS, **kwargs)
+    assert df.collect().get_column("id").to_list() == [4, 6, 8, 12, 14]
+    assert len(list(checkpoints.glob("*.meta.pq.zst"))) == 1
+    apply_filters(
+        pl.scan_parquet(tmp_path / "input"), FILTERS, checkpoint="g", checkpoint_dir=checkpoints
+    )
+    assert len(list(checkpoints.glob("*.meta.pq.zst"))) == 1
+
+    # Rewriting a file inside the scanned directory invalidates the checkpoint
+    pl.DataFrame({"id": range(10), "x": range(10)}).write_parquet(dataset / "part-0.pq")
+    df, _, _ = apply_filters(pl.scan_parquet(tmp_path / "input"), FILTERS, **kwargs)
+    assert df.collect().get_column("id").to_list() == [4, 6, 8]
+    assert len(list(checkpoints.glob("*.meta.pq.zst"))) == 2
+
+
+def test_prune_checkpoints(tmp_path):
+    path = tmp_path / "input.pq"
+    pl.DataFrame({"id": range(20), "x": range(20)}).write_parquet(path)
+    checkpoints = tmp_path / "checkpoints"
+    kwargs = {"checkpoint": "gt2", "checkpoint_dir": checkpoints}
+    apply_filters(pl.scan_parquet(path), FILTERS, **kwargs)
+    old = list(checkpoints.iterdir())
+    for file in old:
+        os.utime(file, (time.time() - 7200,) * 2)
+    pl.DataFrame({"id": range(10), "x": range(10)}).write_parquet(path)
+    apply_filters(pl.scan_parquet(path), FILTERS, **kwargs)
+    assert len(list(checkpoints.glob("*.meta.pq.zst"))) == 2
+
+    assert sorted(prune_checkpoints(timedelta(hours=1), checkpoints)) == sorted(old)
+    assert len(list(checkpoints.glob("*.meta.pq.zst"))) == 1
+    df, _, _ = apply_filters(pl.scan_parquet(path), FILTERS, **kwargs)
+    assert df.collect().get_column("id").to_list() == [4, 6, 8]
+    assert prune_checkpoints(timedelta(hours=1), tmp_path / "missing") == []
+
+
+def test_profile_filters():
+    df, meta, profile = profile_filters(_source([]), FILTERS, name="test")
+    expected_df, stats, names = apply_filters(_source([]), FILTERS)
+    assert_frame_equal(df.collect(), expected_df.collect())
+    assert_frame_equal(meta, assemble_meta_frame(stats, "test"))
+    assert profile.get_column("name").to_list() == names
+    assert profile.get_column("rows_out").to_list() == meta.get_column("after").to_list()
+    assert (profile.get_column("time") > 0).all()
+    assert profile.get_column("nodes").list.len().max() > 0
+
+
+def test_optimize_reorders_within_barriers(monkeypatch):
+    # Equal costs, so the order depends on the selectivity and not on timings.
+    # `ndpi.data.filter` as attribute is the `filter` function, not the module
+    module = importlib.import_module("ndpi.data.filter")
+
+    def measure(sample, fltr):
+        return 1.0, _apply_filter(sample.lazy(), fltr).collect()
+
+    monkeypatch.setattr(module, "_measure", measure)
+    lf = pl.LazyFrame({"id": range(10_000), "x": [i % 100 for i in range(10_000)]})
+    barrier = (lambda df: df.filter(pl.col("id") >= 100), "barrier")
+    marked = (commutative(lambda df: df.filter(pl.col("x") < 50)), "marked")
+    filters = [
+        (commutative(pl.col("x") != 1), "ne1"),
+        (commutative(pl.col("x") > 89), "gt89"),
+        barrier,
+        (commutative(pl.col("x") != 95), "ne95"),
+        marked,
+    ]
+    assert optimize_order(lf, filters) == [1, 0, 2, 4, 3]
+
+    expected_df, _, expected_names = apply_filters(lf, filters)
+    df, stats, names = apply_filters(lf, filters, optimize=True)
+    assert_frame_equal(df.collect(), expected_df.collect())
+    assert names == expected_names
+    meta = assemble_meta_frame(stats)
+    # gt89 ran first, ne1 after it removed nothing
+    assert meta.get_column("before").to_list()[:2] == [1_000, 10_000]
+    assert meta.get_column("after").to_list()[:2] == [1_000, 1_000]
+
+
+def test_optimize_keeps_unmarked_expressions():
+    lf = pl.LazyFrame({"id": range(10), "k": [0] * 10, "x": [0] * 5 + [1] * 5})
+    filters = [
+        (pl.col("k").is_first_distinct(), "dedup"),
+        (commutative(pl.col("x") == 1), "x1"),
+        (pl.col("id") == pl.col("id").max().over("k"), "last"),
+    ]
+    assert optimize_order(lf, filters) == [0, 1, 2]
+    expected_df, _, _ = apply_filters(lf, filters)
+    df, _, _ = apply_filters(lf, filters, optimize=True)
+    assert expected_df.collect().height == 0
+    assert_frame_equal(df.collect(), expected_df.collect())
+
+
+class _Scanners:
+    def __init__(self, addresses: list[int]):
+        self.addresses = addresses
+
+    def drop(self, df: pl.LazyFrame) -> pl.LazyFrame:
+        return df.filter(~pl.col("x").is_in(self.addresses))
+
+
+def test_commutative_bound_methods():
+    drop = commutative(_Scanners([1, 2]).drop)
+    lf = pl.LazyFrame({"id": range(5), "x": range(5)})
+    df, _, names = apply_filters(lf, [drop, commutative(partial(_Scanners.drop, _Scanners([3])))])
+    assert df.collect().get_column("x").to_list() == [0, 4]
+    assert names == ["drop", "drop"]
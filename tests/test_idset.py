@@ -0,0 +1,57 @@
+import random
+
+import polars as pl
+import pytest
+
+from ndpi.data.filter import apply_filters, assemble_meta_frame
+from ndpi.data.idset import IdSet
+
+
+def _ids() -> list[int]:
+    rng = random.Random(0)
+    scattered = [rng.randrange(10**7) for _ in range(10_000)]
+    return sorted({*range(1000, 100_000), *scattered, -65, -64, -5, 10**9})
+
+
+def test_roundtrip_and_count():
+    ids = pl.Series("row", _ids(), dtype=pl.Int64)
+    id_set = IdSet.from_ids(ids)
+    assert len(id_set) == ids.len()
+    assert id_set.runs.height > 0 and id_set.words.height > 0 and id_set.singles.len() > 0
+    assert id_set.estimated_size() < ids.estimated_size() / 4
+    assert id_set.to_series().equals(ids)
+
+
+def test_membership():
+    ids = _ids()
+    id_set = IdSet.from_ids(pl.Series("id", ids))
+    probe = pl.Series("x", [*range(-100, 110_000), 10**9, 10**9 + 1])
+    contained = probe.to_frame().select(id_set.contains("x")).to_series()
+    assert contained.equals(probe.is_in(ids).alias("x"))
+    assert [value in id_set for value in [-65, -1, 999, 1000, 99_999, 10**9]] == [
+        True,
+        False,
+        False,
+        True,
+        True,
+        True,
+    ]
+    assert pl.select(id_set.contains(pl.lit(None, pl.Int64))).item() is False
+
+
+def test_empty_and_dtype():
+    id_set = IdSet.from_ids(pl.DataFrame({"id": pl.Series([], dtype=pl.UInt32)}))
+    assert len(id_set) == 0 and 3 not in id_set
+    assert id_set.to_series().dtype == pl.UInt32
+    with pytest.raises(TypeError):
+        IdSet.from_ids(pl.Series(["a"]))
+
+
+def test_compact_meta_frame():
+    lf = pl.LazyFrame({"id": range(1000), "x": range(1000)})
+    _, stats, _ = apply_filters(lf, [pl.col("x") > 100, pl.col("x") % 3 != 0])
+    compact = assemble_meta_frame(stats, compact_ids=True)
+    expected = assemble_meta_frame(stats)
+    assert compact.drop("ids").equals(expected.drop("ids"))
+    for id_set, ids in zip(compact.get_column("ids"), expected.get_column("ids")):
+        assert id_set.to_series().equals(ids.sort())
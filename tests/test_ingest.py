@@ -0,0 +1,161 @@
+import io
+import struct
+import subprocess
+import sys
+
+import polars as pl
+import pytest
+from loguru import logger
+from polars.testing import assert_frame_equal
+
+from ndpi.cli.ingest import expand_captures, ingest_captures, read_batches, scan_batches
+from ndpi.convenience import sink_parquet
+from ndpi.dataset import Manifest
+
+COLUMNS = ["frame.number", "ip.src", "tcp.port"]
+
+
+def _fields_output(rows: int) -> bytes:
+    return b"".join(
+        f"{i}|10.0.0.{i % 256}|{80 if i % 3 == 0 else ''}\n".encode() for i in range(rows)
+    )
+
+
+def test_batches_split_at_line_breaks():
+    data = _fields_output(1000)
+    batches = list(read_batches(io.BytesIO(data), COLUMNS, chunk_size=100))
+    assert len(batches) > 1
+    assert all(batch.schema == batches[0].schema for batch in batches)
+    df = pl.concat(batches)
+    assert df.columns == COLUMNS
+    assert df.get_column("frame.number").to_list() == list(range(1000))
+    assert df.get_column("tcp.port").null_count() == 666
+
+
+def test_last_line_without_line_break():
+    batches = read_batches(io.BytesIO(b"1|a|2\n3|b|"), COLUMNS, chunk_size=4)
+    assert pl.concat(batches).rows() == [(1, "a", 2), (3, "b", None)]
+
+
+def test_inferred_types_tolerate_later_batches():
+    messages = []
+    handler = logger.add(lambda message: messages.append(message), level="WARNING")
+    try:
+        data = b"1|a|80\n2|b|443\n3|c|80,443\n4|d|\n"
+        batches = list(read_batches(io.BytesIO(data), COLUMNS, chunk_size=16))
+    finally:
+        logger.remove(handler)
+    assert len(batches) == 2
+    assert all(batch.schema == batches[0].schema for batch in batches)
+    assert pl.concat(batches).get_column("tcp.port").to_list() == [80, 443, None, None]
+    # Only the value that did not fit is reported, not the empty field
+    assert len(messages) == 1 and "{'tcp.port': 1}" in messages[0]
+
+
+def test_sink_batches(tmp_path):
+    data = _fields_output(5000)
+    batches = read_batches(io.BytesIO(data), COLUMNS, chunk_size=4096)
+    sink_parquet(scan_batches(batches, COLUMNS), tmp_path / "capture.pq.zst")
+    expected = pl.concat(read_batches(io.BytesIO(data), COLUMNS))
+    assert_frame_equal(pl.read_parquet(tmp_path / "capture.pq.zst"), expected)
+
+
+def test_scan_without_batches():
+    df = scan_batches(iter([]), COLUMNS).collect()
+    assert df.columns == COLUMNS
+    assert df.height == 0
+
+
+def test_cli_does_not_import_polars():
+    code = "import sys, ndpi.cli.main; sys.exit('polars' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+def test_expand_captures(tmp_path):
+    for name in ["b.pcap", "a.pcap", "c.pcapng", ".hidden"]:
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "sub").mkdir()
+    assert [path.name for path in expand_captures([tmp_path])] == [
+        "a.pcap",
+        "b.pcap",
+        "c.pcapng",
+    ]
+    assert expand_captures([tmp_path / "*.pcap", tmp_path / "a.pcap"]) == [
+        tmp_path / "a.pcap",
+        tmp_path / "b.pcap",
+    ]
+
+
+# Prints `frame.number` and `frame.len` of every packet of a classic pcap file,
+# a capture starting with `FAIL` exits with an error
+FAKE_TSHARK = """#!{python}
+import struct, sys
+
+args = sys.argv[1:]
+capture = args[args.index("-nr") + 1]
+fields = [args[index + 1] for index, arg in enumerate(args) if arg == "-e"]
+data = sys.stdin.buffer.read() if capture == "-" else open(capture, "rb").read()
+if data.startswith(b"FAIL"):
+    sys.exit(2)
+position, number = 24, 0
+while position < len(data):
+    length = struct.unpack_from("<I", data, position + 8)[0]
+    number += 1
+    values = {{"frame.number": number, "frame.len": length}}
+    print("|".join(str(values[field]) for field in fields))
+    position += 16 + length
+"""
+
+
+@pytest.fixture
+def fake_tshark(monkeypatch, tmp_path):
+    tshark = tmp_path / "bin" / "tshark"
+    tshark.parent.mkdir()
+    tshark.write_text(FAKE_TSHARK.format(python=sys.executable))
+    tshark.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tshark.parent), prepend=":")
+
+
+def _pcap(path, lengths):
+    with open(path, "wb") as file:
+        file.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for index, length in enumerate(lengths):
+            file.write(struct.pack("<IIII", 1700000000 + index, 0, length, length))
+            file.write(bytes(length))
+    return path
+
+
+def test_ingest_captures(fake_tshark, tmp_path):
+    captures = [_pcap(tmp_path / "a.pcap", [60] * 5), _pcap(tmp_path / "b.pcap", [70] * 7)]
+    dataset = tmp_path / "dataset"
+    manifest = ingest_captures(captures, ["frame.number", "frame.len"], dataset, workers=2)
+
+    assert manifest == Manifest.read(dataset)
+    assert [(part.path, part.rows, part.source) for part in manifest.parts] == [
+        ("part-00000.pq.zst", 5, str(captures[0])),
+        ("part-00001.pq.zst", 7, str(captures[1])),
+    ]
+    df = pl.read_parquet(manifest.files(dataset))
+    # Frame numbers count from the start of each capture
+    assert df.get_column("frame.number").to_list() == [*range(1, 6), *range(1, 8)]
+    assert df.get_column("frame.len").to_list() == [60] * 5 + [70] * 7
+
+
+def test_ingest_shards_count_frames_from_capture_start(fake_tshark, tmp_path):
+    capture = _pcap(tmp_path / "a.pcap", [100] * 50)
+    dataset = tmp_path / "dataset"
+    manifest = ingest_captures(
+        [capture], ["frame.number", "frame.len"], dataset, workers=4, shard_size=1_000
+    )
+    assert len(manifest.parts) > 4
+    assert manifest.rows == 50
+    assert manifest.parts[0].source == f"{capture}:24-1068"
+    df = pl.read_parquet(manifest.files(dataset))
+    assert df.get_column("frame.number").to_list() == list(range(1, 51))
+
+
+def test_ingest_captures_reports_failures(fake_tshark, tmp_path):
+    captures = [_pcap(tmp_path / "a.pcap", [60] * 5), tmp_path / "b.pcap"]
+    captures[1].write_bytes(b"FAIL")
+    with pytest.raises(RuntimeError, match="tshark exited with status 2"):
+        ingest_captures(captures, ["frame.number"], tmp_path / "dataset", workers=2)
@@ -0,0 +1,98 @@
+import random
+import struct
+
+import pytest
+
+from ndpi.cli.pcap import Shard, shard_capture
+
+
+def _packets(count):
+    rng = random.Random(0)
+    return [bytes(rng.randrange(256) for _ in range(rng.randrange(40, 1500))) for _ in range(count)]
+
+
+def _pcap(path, packets):
+    with open(path, "wb") as file:
+        file.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for index, packet in enumerate(packets):
+            file.write(struct.pack("<IIII", 1700000000 + index, index, len(packet), len(packet)))
+            file.write(packet)
+
+
+def _block(kind, body):
+    body += b"\0" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack("<II", kind, length) + body + struct.pack("<I", length)
+
+
+def _pcapng(path, packets):
+    with open(path, "wb") as file:
+        file.write(_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)))
+        file.write(_block(1, struct.pack("<HHI", 1, 0, 65535)))
+        for index, packet in enumerate(packets):
+            header = struct.pack("<IIIII", 0, 0, index, len(packet), len(packet))
+            file.write(_block(6, header + packet))
+
+
+def _read_pcap(data):
+    packets, position = [], 24
+    while position < len(data):
+        length = struct.unpack_from("<I", data, position + 8)[0]
+        packets.append(data[position + 16 : position + 16 + length])
+        position += 16 + length
+    return packets
+
+
+def _read_pcapng(data):
+    packets, position = [], 0
+    while position < len(data):
+        kind, length = struct.unpack_from("<II", data, position)
+        if kind == 6:
+            captured = struct.unpack_from("<I", data, position + 20)[0]
+            packets.append(data[position + 28 : position + 28 + captured])
+        position += length
+    return packets
+
+
+@pytest.mark.parametrize("write, read", [(_pcap, _read_pcap), (_pcapng, _read_pcapng)])
+def test_shards_are_standalone_captures_in_order(tmp_path, write, read):
+    packets = _packets(300)
+    write(tmp_path / "trace", packets)
+    shards = shard_capture(tmp_path / "trace", 20_000)
+    assert len(shards) > 5
+
+    stitched = []
+    for index, shard in enumerate(shards):
+        with open(tmp_path / f"shard{index}", "wb") as file:
+            shard.feed(file)
+        stitched += read((tmp_path / f"shard{index}").read_bytes())
+    assert stitched == packets
+
+
+@pytest.mark.parametrize("write, read", [(_pcap, _read_pcap), (_pcapng, _read_pcapng)])
+def test_records_inside_payloads_are_not_split_points(tmp_path, write, read):
+    # A captured transfer of a capture file, its records look like real ones
+    write(tmp_path / "inner", [bytes(40)] * 1000)
+    packets = _packets(20) + [(tmp_path / "inner").read_bytes()] + _packets(20)
+    write(tmp_path / "trace", packets)
+    shards = shard_capture(tmp_path / "trace", 5_000)
+    assert len(shards) > 3
+
+    stitched = []
+    for index, shard in enumerate(shards):
+        assert shard.frame_offset == len(stitched)
+        with open(tmp_path / f"shard{index}", "wb") as file:
+            shard.feed(file)
+        stitched += read((tmp_path / f"shard{index}").read_bytes())
+    assert stitched == packets
+
+
+def test_unknown_format_is_not_sharded(tmp_path):
+    (tmp_path / "trace.gz").write_bytes(b"\x1f\x8b" + bytes(100))
+    assert shard_capture(tmp_path / "trace.gz", 10) is None
+
+
+def test_small_capture_is_one_shard(tmp_path):
+    _pcap(tmp_path / "trace", _packets(3))
+    (shard,) = shard_capture(tmp_path / "trace", 1 << 20)
+    assert shard == Shard(str(tmp_path / "trace"), shard.header, 24, (tmp_path / "trace").stat().st_size)
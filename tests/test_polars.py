@@ -0,0 +1,136 @@
+import ipaddress
+import random
+
+import polars as pl
+import pytest
+
+import ndpi.data.polars  # noqa: F401
+from ndpi.data.polars import BOGON_NETWORKS
+
+INVALID = ["", "garbage", "1.2.3", "256.1.1.1", "01.2.3.4", ":::", "1::2::3", "1:2:3"]
+INVALID += ["1:2:3::4:5:6:7:8", "1:2:3:4:5:6:7:8:9", "12345::", "::1.2.3.400", "::g"]
+
+
+def _parse(address):
+    try:
+        return ipaddress.ip_address(address)
+    except ValueError:
+        return None
+
+
+@pytest.fixture(scope="module")
+def addresses():
+    rng = random.Random(0)
+    v4 = [str(ipaddress.IPv4Address(rng.randrange(2**32))) for _ in range(500)]
+    v6 = []
+    for _ in range(500):
+        groups = [rng.choice([0, 0, 1, 0xFFFF, rng.randrange(2**16)]) for _ in range(8)]
+        address = ipaddress.IPv6Address(int("".join(f"{g:04x}" for g in groups), 16))
+        v6.append(rng.choice([address.compressed, address.exploded.upper()]))
+    mapped = [f"::ffff:{address}" for address in v4[:50]]
+    special = ["0.0.0.0", "255.255.255.255", "10.1.2.3", "::", "::1", "1::", "fe80::1"]
+    # Bounds of 2001:db8::/32 for `in_cidr`
+    special += ["2001:db8::", "2001:DB8:FFFF:FFFF:FFFF:FFFF:FFFF:FFFF", "2001:db8:1::2"]
+    special += ["2001:db7:ffff:ffff:ffff:ffff:ffff:ffff", "2001:db9::", "2002:db8::1"]
+    return v4 + v6 + mapped + special + INVALID
+
+
+def test_ip_to_int_roundtrip(addresses):
+    df = pl.DataFrame({"a": addresses + [None]}).with_columns(
+        v4=pl.col("a").ndpi.ip_to_int()
+    ).with_columns(back=pl.col("v4").ndpi.int_to_ip())
+    assert df.schema["v4"] == pl.UInt32
+    for address, value, back in df.rows():
+        ip = _parse(address) if address is not None else None
+        expected = int(ip) if ip is not None and ip.version == 4 else None
+        assert value == expected, address
+        assert back == (address if expected is not None else None)
+
+
+def test_ip6_to_int_roundtrip(addresses):
+    df = pl.DataFrame({"a": addresses + [None]}).with_columns(
+        v6=pl.col("a").ndpi.ip6_to_int()
+    ).with_columns(back=pl.col("v6").ndpi.int_to_ip6())
+    for address, value, back in df.rows():
+        ip = _parse(address) if address is not None else None
+        if ip is None or ip.version != 6:
+            assert value is None, address
+            continue
+        assert (value["hi"] << 64) | value["lo"] == int(ip), address
+        assert back == ip.compressed
+
+
+def test_classification_matches_ipaddress(addresses):
+    bogons = [ipaddress.ip_network(net) for net in BOGON_NETWORKS]
+    cidrs = [ipaddress.ip_network(net) for net in ["10.0.0.0/8", "2001:db8::/32"]]
+    df = pl.DataFrame({"a": addresses}).with_columns(
+        private=pl.col("a").ndpi.is_private(),
+        bogon=pl.col("a").ndpi.is_bogon(),
+        prefix=pl.col("a").ndpi.prefix(v4=24, v6=48),
+        cidr=pl.col("a").ndpi.in_cidr([str(net) for net in cidrs]),
+    )
+    for address, private, bogon, prefix, cidr in df.rows():
+        ip = _parse(address)
+        if ip is None:
+            assert (private, bogon, prefix, cidr) == (False, False, None, False), address
+            continue
+        length = 24 if ip.version == 4 else 48
+        assert private == ip.is_private, address
+        assert bogon == any(ip in net for net in bogons if net.version == ip.version)
+        assert prefix == str(ipaddress.ip_network(f"{ip}/{length}", strict=False))
+        networks = [net for net in cidrs if net.version == ip.version]
+        assert cidr == any(ip in net for net in networks), address
+    assert df.filter(pl.col("a").str.contains(":") & pl.col("cidr")).height == 3
+
+
+def test_in_cidr_and_prefix_edge_cases():
+    df = pl.DataFrame({"a": ["10.255.255.255", "11.0.0.0", "2001:db8::1", None]})
+    assert df.select(pl.col("a").ndpi.in_cidr("10.0.0.0/8")).to_series().to_list() == [
+        True,
+        False,
+        False,
+        None,
+    ]
+    assert df.select(pl.col("a").ndpi.prefix(v4=8, v6=None)).to_series().to_list() == [
+        "10.0.0.0/8",
+        "11.0.0.0/8",
+        None,
+        None,
+    ]
+
+
+def test_output_names_follow_input():
+    df = pl.DataFrame({"src": ["10.1.2.3", "2001:db8::1"]}).with_columns(
+        pl.col("src").ndpi.ip6_to_int().alias("v6")
+    )
+    a = pl.col("src")
+    expressions = [a.ndpi.ip_to_int(), a.ndpi.ip6_to_int(), a.ndpi.prefix()]
+    expressions += [a.ndpi.in_cidr("10.0.0.0/8"), a.ndpi.is_private(), a.ndpi.is_bogon()]
+    for expr in expressions:
+        assert df.with_columns(expr).columns == ["src", "v6"]
+    assert df.select(pl.col("v6").ndpi.int_to_ip6()).columns == ["v6"]
+    assert df.select(pl.lit("::1").ndpi.ip6_to_int()).columns == ["literal"]
+
+
+def test_list_search():
+    df = pl.DataFrame(
+        {"values": [[1, 2, 3, 2], [], None, [5], [4]], "other": [[2, 3], [1], [1], None, []]}
+    )
+    result = df.select(
+        index_of=pl.col("values").ndpi.list_index_of([2, 5]),
+        first=pl.col("values").ndpi.list_first_index_of([2, 5]),
+        any=pl.col("values").ndpi.list_contains_any([2, 5]),
+        intersect=pl.col("values").ndpi.list_intersect_positions("other"),
+    )
+    assert result.schema == {
+        "index_of": pl.List(pl.Int64),
+        "first": pl.Int64,
+        "any": pl.Boolean,
+        "intersect": pl.List(pl.Int64),
+    }
+    assert result.to_dict(as_series=False) == {
+        "index_of": [[1, 3], [], None, [0], []],
+        "first": [1, None, None, 0, None],
+        "any": [True, False, None, True, False],
+        "intersect": [[1, 2, 3], [], None, None, []],
+    }
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+
+import polars as pl
+
+from ndpi.convenience import load_data, write_parquet
+from ndpi.row_groups import build_stats, file_stats, prune, read_stats, stats_path
+from test_dataset import _dataset
+
+
+def _flows(start: int, rows: int = 100) -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "time": pl.Series(range(start, start + rows)).cast(pl.Datetime("ms", "UTC")),
+            "ip.src": pl.Series(range(start, start + rows), dtype=pl.UInt32),
+            "port": pl.Series([None] * rows, dtype=pl.UInt16),
+            "proto": ["tcp"] * rows,
+        }
+    )
+
+
+def test_file_stats_from_footer(tmp_path):
+    path = tmp_path / "flows.pq.zst"
+    _flows(0).write_parquet(path, row_group_size=25)
+    stats = file_stats(path)
+    # Strings have no statistics
+    assert "proto-min" not in stats.columns
+    assert stats.select("offset", "rows", "ip.src-min", "ip.src-max", "port-nulls").rows() == [
+        (0, 25, 0, 24, 25),
+        (25, 25, 25, 49, 25),
+        (50, 25, 50, 74, 25),
+        (75, 25, 75, 99, 25),
+    ]
+    assert stats.get_column("time-max")[0] == datetime(1970, 1, 1, 0, 0, 0, 24000)
+
+
+def test_load_data_skips_row_groups(tmp_path):
+    write_parquet(_flows(0), tmp_path / "flows.pq.zst", stats=True, row_group_size=25)
+    assert stats_path(tmp_path / "flows.pq.zst").is_file()
+    assert prune(tmp_path / "flows.pq.zst", {"ip.src": (30, 60)}) == {
+        tmp_path / "flows.pq.zst": [(25, 50)]
+    }
+    df = load_data("flows", directory=tmp_path, ranges={"ip.src": (30, 60)}).collect()
+    assert df.get_column("ip.src").to_list() == list(range(30, 61))
+
+    start = datetime(1970, 1, 1, 0, 0, 0, 90000, tzinfo=timezone.utc)
+    df = load_data("flows", directory=tmp_path, ranges={"time": (start, None)}).collect()
+    assert df.height == 10
+    # A column without any value never matches
+    assert load_data("flows", directory=tmp_path, ranges={"port": (0, None)}).collect().is_empty()
+
+
+def test_dataset_stats_drop_files(tmp_path):
+    _dataset(tmp_path / "ds", [_flows(0), _flows(100), _flows(200)])
+    build_stats(tmp_path / "ds", ["ip.src"])
+    assert read_stats(tmp_path / "ds").get_column("file").to_list() == [
+        "part-00000.pq.zst",
+        "part-00001.pq.zst",
+        "part-00002.pq.zst",
+    ]
+    # Files outside the range are never opened
+    assert list(prune(tmp_path / "ds", {"ip.src": (150, 210)})) == [
+        tmp_path / "ds" / "part-00001.pq.zst",
+        tmp_path / "ds" / "part-00002.pq.zst",
+    ]
+    df = load_data("ds", directory=tmp_path, ranges={"ip.src": (150, 210)}).collect()
+    assert df.get_column("ip.src").to_list() == list(range(150, 211))
+
+
+def test_changed_files_are_not_pruned(tmp_path):
+    _dataset(tmp_path / "ds", [_flows(0), _flows(100)])
+    build_stats(tmp_path / "ds")
+    _flows(1000).write_parquet(tmp_path / "ds" / "part-00000.pq.zst")
+    df = load_data("ds", directory=tmp_path, ranges={"ip.src": (1000, 1001)}).collect()
+    assert df.get_column("ip.src").to_list() == [1000, 1001]
+
+    # Rebuilding only reads the changed footer
+    stats = build_stats(tmp_path / "ds")
+    assert stats.filter(pl.col("file") == "part-00000.pq.zst").get_column("ip.src-min").item() == 1000
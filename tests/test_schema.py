@@ -0,0 +1,103 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+from loguru import logger
+
+from ndpi.cli.ingest import convert_batches, read_batches, scan_batches
+from ndpi.cli.schema import field_expr, field_schema
+
+TYPES = {
+    "frame.number": "FT_UINT32",
+    "frame.time": "FT_ABSOLUTE_TIME",
+    "frame.time_delta": "FT_RELATIVE_TIME",
+    "ip.src": "FT_IPv4",
+    "tcp.flags": "FT_UINT16",
+    "tcp.flags.syn": "FT_BOOLEAN",
+    "tcp.port": "FT_UINT16",
+    "_ws.col.protocol": "FT_STRING",
+}
+OUTPUT = (
+    b"1|Oct 18, 2026 12:00:01.123456789 UTC|0.000001000|10.0.0.1,192.168.0.1|0x0012|1|80,443|TCP\n"
+    b"2|Oct  8, 2026 12:00:02.000000000 UTC|-1.5|||0||DNS\n"
+)
+
+
+def _convert(data: bytes, **kwargs) -> pl.DataFrame:
+    columns = list(TYPES)
+    text = {column: pl.String() for column in columns}
+    batches = read_batches(io.BytesIO(data), columns, chunk_size=64, schema=text)
+    return pl.concat(convert_batches(batches, TYPES, **kwargs))
+
+
+def test_types_from_tshark_datatypes():
+    df = _convert(OUTPUT, list_fields=["tcp.port"], categorical_fields=["_ws.col.protocol"])
+    assert df.schema == field_schema(TYPES, ["tcp.port"], ["_ws.col.protocol"])
+    assert df.schema["tcp.port"] == pl.List(pl.UInt16)
+    assert df.schema["_ws.col.protocol"] == pl.Categorical
+    assert df.rows(named=True)[0] == {
+        "frame.number": 1,
+        "frame.time": datetime(2026, 10, 18, 12, 0, 1, 123456, tzinfo=timezone.utc),
+        "frame.time_delta": timedelta(microseconds=1),
+        "ip.src": 167772161,
+        "tcp.flags": 0x12,
+        "tcp.flags.syn": True,
+        "tcp.port": [80, 443],
+        "_ws.col.protocol": "TCP",
+    }
+    assert df.row(1) == (
+        2,
+        datetime(2026, 10, 8, 12, 0, 2, tzinfo=timezone.utc),
+        timedelta(seconds=-1.5),
+        None,
+        None,
+        False,
+        None,
+        "DNS",
+    )
+
+
+def test_unconvertible_values_are_counted():
+    messages = []
+    handler = logger.add(lambda message: messages.append(message), level="WARNING")
+    try:
+        df = _convert(OUTPUT, list_fields=["tcp.port"])
+        assert not messages
+        broken = OUTPUT.replace(b"|0x0012|", b"|SYN|").replace(b"|80,443|", b"|80,http|")
+        df = _convert(broken, list_fields=["tcp.port"])
+    finally:
+        logger.remove(handler)
+    assert df.get_column("tcp.flags").to_list() == [None, None]
+    assert df.get_column("tcp.port").to_list() == [[80, None], None]
+    assert len(messages) == 1
+    assert "{'tcp.flags': 1, 'tcp.port': 1}" in messages[0]
+
+
+def test_char_fields_stay_strings():
+    df = pl.DataFrame({"c": ["A", ""]})
+    assert df.select(field_expr("c", "FT_CHAR")).get_column("c").to_list() == ["A", ""]
+
+
+def test_epoch_times_keep_nanoseconds():
+    df = pl.DataFrame({"t": ["1760788801.000000001", "1760788801", "2026-10-18T12:00:01Z"]})
+    times = df.select(field_expr("t", "FT_ABSOLUTE_TIME")).get_column("t")
+    assert times.dt.epoch("ns").to_list() == [
+        1760788801000000001,
+        1760788801000000000,
+        1792324801000000000,
+    ]
+
+
+def test_unknown_datatypes_stay_strings():
+    df = pl.DataFrame({"name": ["a,b", None]})
+    assert df.select(field_expr("name", "FT_STRING")).get_column("name").to_list() == ["a,b", None]
+    assert df.select(field_expr("name", "FT_BYTES", as_list=True)).get_column("name").to_list() == [
+        ["a", "b"],
+        None,
+    ]
+
+
+def test_empty_capture_keeps_types():
+    schema = field_schema(TYPES)
+    df = scan_batches(iter([]), list(TYPES), schema).collect()
+    assert df.schema == schema
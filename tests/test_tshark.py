@@ -0,0 +1,50 @@
+from ndpi.cli.tshark import (
+    TsharkField,
+    _read_field_cache,
+    _write_field_cache,
+    cache_dir,
+    query_fields,
+)
+
+
+def test_field_cache_roundtrip(tmp_path):
+    fields = [
+        TsharkField("ip", "Internet Protocol Version 4"),
+        TsharkField("ip.src", "Source Address", "FT_IPv4", "ip"),
+    ]
+    _write_field_cache(fields, tmp_path / "fields.arrow")
+    assert _read_field_cache(tmp_path / "fields.arrow") == fields
+    assert list(tmp_path.iterdir()) == [tmp_path / "fields.arrow"]
+
+
+def test_cache_dir_follows_xdg(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert cache_dir() == tmp_path / "ndpi"
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert cache_dir() == tmp_path / ".cache" / "ndpi"
+
+
+def test_valid_field_cache_does_not_start_tshark(monkeypatch, tmp_path, capsys):
+    calls = tmp_path / "calls"
+    tshark = tmp_path / "bin" / "tshark"
+    tshark.parent.mkdir()
+    tshark.write_text(
+        f'#!/bin/sh\necho "$@" >> {calls}\n'
+        'printf "F\\tSource Address\\tip.src\\tFT_IPv4\\tip\\tBASE_NONE\\n"\n'
+    )
+    tshark.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tshark.parent), prepend=":")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    expected = [TsharkField("ip.src", "Source Address", "FT_IPv4", "ip")]
+    assert query_fields() == expected
+    assert query_fields() == expected
+    assert calls.read_text().splitlines() == ["-G fields"]
+
+    # A corrupt cache is reported and rebuilt
+    (cache,) = (tmp_path / "cache" / "ndpi").iterdir()
+    cache.write_bytes(b"corrupt")
+    assert query_fields() == expected
+    assert "ignoring tshark field cache" in capsys.readouterr().err
+    assert calls.read_text().splitlines() == ["-G fields", "-G fields"]
@@ -0,0 +1,67 @@
+import polars as pl
+
+from ndpi.data.validation import audit_schema, compact_dtypes
+
+
+def test_audit_proposes_narrow_dtypes():
+    df = pl.LazyFrame(
+        {
+            "tcp.dstport": [80, 443, None, 80],
+            "delta": [-5, 100, 3, 0],
+            "bytes": [2**40, 0, 1, 2],
+            "proto": ["tcp", "tcp", "udp", "tcp"],
+            "host": ["a", "b", "c", "d"],
+            "empty": pl.Series([None] * 4, dtype=pl.Int64),
+            "ratio": [0.5, 1.25, None, float("nan")],
+            "rtt": [0.1, 0.5, 1.0, 2.0],
+            "syn": [True, False, None, True],
+            "label": pl.Series(["x", "y", "x", "x"], dtype=pl.Categorical),
+        }
+    )
+    report = audit_schema(df)
+    assert dict(report.select("column", "proposed").iter_rows()) == {
+        "tcp.dstport": "UInt16",
+        "delta": "Int8",
+        "bytes": "Int64",
+        "proto": "Categorical",
+        "host": "String",
+        "empty": "Int64",
+        "ratio": "Float32",
+        "rtt": "Float64",
+        "syn": "Boolean",
+        "label": "Categorical",
+    }
+    assert report.filter(column="ratio").select("bytes", "proposed_bytes").row(0) == (32, 16)
+    assert report.row(0, named=True) | {"unique": None} == {
+        "column": "tcp.dstport",
+        "dtype": "Int64",
+        "proposed": "UInt16",
+        "min": 80,
+        "max": 443,
+        "unique": None,
+        "bytes": 32,
+        "proposed_bytes": 8,
+    }
+
+    compact = compact_dtypes(df, report)
+    assert isinstance(compact, pl.LazyFrame)
+    assert compact.collect_schema()["proto"] == pl.Categorical
+    assert compact.collect_schema()["ratio"] == pl.Float32
+    integers = ["tcp.dstport", "delta", "bytes", "empty"]
+    numbers = compact.select(integers).collect()
+    assert numbers.cast(pl.Int64).equals(df.select(integers).collect())
+
+
+def test_audit_int128():
+    df = pl.DataFrame(
+        {
+            "small": pl.Series([1, 2], dtype=pl.Int128),
+            "large": pl.Series([2**100, -1], dtype=pl.Int128),
+        }
+    )
+    report = audit_schema(df)
+    assert report.select("proposed", "bytes", "proposed_bytes").rows() == [
+        ("UInt8", 32, 2),
+        ("Int128", 32, 32),
+    ]
+    assert compact_dtypes(df, report).schema["small"] == pl.UInt8
@@ -1,10 +1,12 @@
 import datetime
+import threading
+import time
 
 import polars as pl
 import pytest
 from loguru import logger
 
-from ndpi.value_store import ValueStore, fmt_date, fmt_eng, fmt_percent
+from ndpi.value_store import ValueStore, fmt_date, fmt_eng, fmt_percent, plan_batches
 
 
 @pytest.fixture
@@ -18,6 +20,20 @@ def warnings():
     logger.remove(handler_id)
 
 
+@pytest.fixture
+def batches(monkeypatch):
+    """Sizes of the batches passed to ``pl.collect_all`` during the test."""
+    sizes = []
+    collect_all = pl.collect_all
+
+    def recording(frames, **kwargs):
+        sizes.append(len(frames))
+        return collect_all(frames, **kwargs)
+
+    monkeypatch.setattr(pl, "collect_all", recording)
+    return sizes
+
+
 @pytest.fixture
 def base_lf():
     return pl.LazyFrame({"a": [1, 2, 3], "b": [10, 20, 30]})
@@ -370,3 +386,213 @@ def test_fmt_date():
     assert (
         fmt_date("%d.%m.%Y")(datetime.datetime(2025, 1, 2, 3, 4)) == "02.01.2025"
     )
+
+
+def test_cache_reuses_unchanged_queries(tmp_path, batches):
+    dataset = tmp_path / "ds" / "year=2024"
+    dataset.mkdir(parents=True)
+    pl.DataFrame({"a": [1, 2, 3]}).write_parquet(dataset / "part-0.pq")
+
+    def build():
+        query = pl.scan_parquet(tmp_path / "ds").select(pl.col("a").sum())
+        return ValueStore(cache_dir=tmp_path / "cache").register("total", query)
+
+    assert build().collect()["total"] == 6
+    assert build().collect()["total"] == 6
+    assert batches == [1]
+
+    # Changing a file of the scanned directory invalidates the entry
+    pl.DataFrame({"a": [1, 2, 3, 4]}).write_parquet(dataset / "part-0.pq")
+    assert build().collect()["total"] == 10
+    assert batches == [1, 1]
+
+
+def test_prune_cache_keeps_current_results(tmp_path, batches):
+    cache = tmp_path / "cache"
+
+    def build(offset):
+        query = pl.LazyFrame({"a": [1, 2, 3]}).select(pl.col("a").sum() + offset)
+        return ValueStore(cache_dir=cache).register("total", query)
+
+    build(0).collect()
+    (cache / "interrupted.pq.temp").touch()
+    # Entries that were not collected yet keep their results
+    assert [path.name for path in build(0).prune_cache()] == ["interrupted.pq.temp"]
+
+    store = build(1).collect()
+    assert len(list(cache.iterdir())) == 2
+    assert len(store.prune_cache()) == 1
+    assert build(1).collect()["total"] == 7
+    assert batches == [1, 1]
+
+
+def test_cache_skips_python_functions(tmp_path, batches):
+    def build():
+        query = pl.LazyFrame({"a": [1, 2, 3]}).select(
+            pl.col("a").map_batches(lambda s: s * 2, return_dtype=pl.Int64).sum()
+        )
+        return ValueStore(cache_dir=tmp_path / "cache").register("total", query)
+
+    # Imported functions are pickled by reference, their edits would go unnoticed
+    assert build().collect()["total"] == 12
+    assert build().collect()["total"] == 12
+    assert batches == [1, 1]
+
+
+def test_collect_all_bisects_failures(base_lf, warnings, batches):
+    store = ValueStore()
+    for index in range(8):
+        store.register(f"good-{index}", base_lf.select(pl.col("a").sum() + index))
+    store.register("poisoned", base_lf.select(pl.col("nonexistent").sum()))
+    store.collect()
+    assert [store[f"good-{index}"] for index in range(8)] == list(range(6, 14))
+    with pytest.raises(RuntimeError, match="poisoned"):
+        store["poisoned"]
+    # 9 -> 4 + 5 -> 2 + 3 -> 1 + 2, healthy halves stay batched and single
+    # entries are collected individually
+    assert batches == [9, 4, 5, 2, 3, 2]
+    assert sum("falling back" in message for message in warnings) == 1
+
+
+def test_plan_batches_groups_shared_sources(tmp_path):
+    (tmp_path / "large").mkdir()
+    pl.DataFrame({"a": range(10)}).write_parquet(tmp_path / "small.pq")
+    pl.DataFrame({"a": range(100_000)}).write_parquet(tmp_path / "large" / "part-0.pq")
+    small = pl.scan_parquet(tmp_path / "small.pq")
+    # Directory scans count with the size of their files
+    large = pl.scan_parquet(tmp_path / "large")
+    frames = {
+        "s1": small.select(pl.len()),
+        "l1": large.select(pl.len()),
+        "s2": small.select(pl.col("a").sum()),
+        "mem": pl.LazyFrame({"a": [1]}).select(pl.len()),
+        "l2": large.select(pl.col("a").max()),
+        "both": small.join(large, on="a").select(pl.len()),
+    }
+    assert plan_batches(frames) == [list(frames)]
+    # All queries scanning a file are linked, `both` joins the two groups
+    assert plan_batches(frames, max_batch_size=5) == [
+        ["s1", "s2", "l1", "l2", "both"],
+        ["mem"],
+    ]
+    size = (tmp_path / "small.pq").stat().st_size
+    assert plan_batches(frames, memory_budget=size) == [
+        ["s1", "s2"],
+        ["l1"],
+        ["l2"],
+        ["both"],
+        ["mem"],
+    ]
+    large_only = {"l1": frames["l1"], "l2": frames["l2"]}
+    assert plan_batches(large_only, memory_budget=10**4) == [["l1"], ["l2"]]
+
+    store = ValueStore()
+    for name, frame in frames.items():
+        store.register(name, frame)
+    store.collect(memory_budget=size, streaming=True)
+    assert store["s2"] == 45
+    assert store["both"] == 10
+
+
+def test_derived_values_resolve_in_one_collect(base_lf, batches):
+    store = ValueStore()
+    # Registration order does not matter
+    store.derive(
+        "share", pl.col("min-a") / pl.col("total"), fmt=fmt_percent(factor=100)
+    )
+    store.register("total", base_lf.select(pl.col("a").sum()))
+    store.register("min-a", base_lf.select(pl.col("a").min()), emit=False)
+    store.register("factor", 2)
+    store.derive("scaled", pl.col("total") * pl.col("factor"))
+    store.derive(
+        "label",
+        lambda share, scaled: f"{share:.2f}/{scaled}",
+        inputs=["share", "scaled"],
+    )
+    store.derive("upper", pl.col("label").str.to_uppercase())
+    store.collect()
+
+    # Expressions over queries are part of the single batch
+    assert batches == [4]
+    assert store["share"] == pytest.approx(1 / 6)
+    assert store["scaled"] == 12
+    assert store["label"] == "0.17/12"
+    assert store["upper"] == "0.17/12"
+
+
+def test_derived_errors(base_lf, warnings):
+    store = ValueStore()
+    store.register("bad-entry", pl.DataFrame({"a": [1, 2]}))
+    store.register("total", base_lf.select(pl.col("a").sum()))
+    store.derive("from-bad", lambda value: value, inputs=["bad-entry"])
+    store.derive("broken", lambda total: total / 0, inputs=["total"])
+    store.collect()
+    with pytest.raises(RuntimeError, match="input 'bad-entry' errored"):
+        store["from-bad"]
+    with pytest.raises(RuntimeError, match="deriving value 'broken' failed"):
+        store["broken"]
+
+    # Expressions pushed into the batch report their inputs the same way
+    store = ValueStore()
+    store.register("failing", base_lf.select(pl.col("nonexistent").sum()))
+    store.register("rows", base_lf.select("a"))
+    store.register("total", base_lf.select(pl.col("a").sum()))
+    store.derive("share", pl.col("failing") / pl.col("total"))
+    store.derive("padded", pl.col("rows") + pl.col("total"))
+    store.derive("fine", pl.col("total") * 2)
+    store.collect()
+    with pytest.raises(RuntimeError, match="input 'failing' errored"):
+        store["share"]
+    with pytest.raises(RuntimeError, match="input 'rows' errored"):
+        store["padded"]
+    assert store["fine"] == 12
+
+    with pytest.raises(ValueError, match="unknown value 'missing'"):
+        ValueStore().derive("x", pl.col("missing") + 1).collect()
+    cyclic = ValueStore().derive("x", pl.col("y") + 1).derive("y", pl.col("x") + 1)
+    with pytest.raises(ValueError, match="depends on itself"):
+        cyclic.collect()
+    with pytest.raises(ValueError, match="inputs are required"):
+        ValueStore().derive("x", lambda: 1)
+
+
+def test_collect_async_emits_ready_values(base_lf, tmp_path):
+    release = threading.Event()
+
+    def blocked(s):
+        release.wait(10)
+        return s
+
+    store = ValueStore()
+    store.register("fast", base_lf.select(pl.col("a").sum()))
+    slow = pl.col("b").map_batches(blocked, return_dtype=pl.Int64).sum()
+    store.register("slow", base_lf.select(slow))
+    with pytest.raises(RuntimeError, match="unresolved entries"):
+        store.to_markdown()
+    handle = store.collect_async(max_batch_size=1)
+    deadline = time.monotonic() + 10
+    while handle.pending != ["slow"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not handle.done()
+    assert store["fast"] == 6
+
+    store.write(tmp_path / "values.tex", pending=True)
+    tex = (tmp_path / "values.tex").read_text()
+    assert "\\setval{fast}{6\\xspace}" in tex
+    assert "\\setval{slow}{PENDING} % PENDING" in tex
+    assert "| slow | PENDING | PENDING |" in store.to_markdown(pending=True)
+
+    # Entries registered meanwhile are left to the next collect
+    store.register("late", base_lf.select(pl.len()))
+    release.set()
+    assert handle.wait(10) is store
+    assert handle.done() and handle.pending == ["late"]
+    assert store["slow"] == 60
+    assert store.collect()["late"] == 3
+
+
+def test_collect_async_raises_on_wait(base_lf):
+    store = ValueStore().register("bad", pl.DataFrame({"a": [1, 2]}))
+    handle = store.collect_async(strict=True)
+    with pytest.raises(ValueError, match="expected exactly 1 row"):
+        handle.wait(10)
@@ -0,0 +1,41 @@
+import json
+
+import polars as pl
+import pytest
+
+from ndpi.convenience import sink_parquet, write_parquet
+from ndpi.row_groups import file_stats, read_stats, sort_order
+from ndpi.writer import WRITER_PROFILES, WriterProfile, writer_profile
+
+DF = pl.DataFrame({"time": [5, 1, 4, 2, 3, 0], "addr": ["b", "a", "b", "a", "b", "a"]})
+
+
+def test_profile_sorts_and_records_order(tmp_path):
+    profile = WriterProfile(
+        sort_by=["addr", "time"], descending=[False, True], row_group_size=2, stats=True
+    )
+    sink_parquet(DF.lazy(), tmp_path / "sorted.pq.zst", profile=profile)
+    df = pl.read_parquet(tmp_path / "sorted.pq.zst")
+    assert df.get_column("time").to_list() == [2, 1, 0, 5, 4, 3]
+    assert sort_order(tmp_path / "sorted.pq.zst") == [("addr", False), ("time", True)]
+
+    # Clustered rows give disjoint row group ranges
+    stats = read_stats(tmp_path / "sorted.pq.zst")
+    assert stats.select("time-min", "time-max").rows() == [(1, 2), (0, 5), (3, 4)]
+    assert json.loads(stats.get_column("sort")[0]) == [["addr", False], ["time", True]]
+
+
+def test_profile_options(tmp_path):
+    path = tmp_path / "dictionary.pq.zst"
+    write_parquet(DF, path, profile=WriterProfile(dictionary=["addr"]), metadata={"source": "x"})
+    assert pl.read_parquet_schema(path)["addr"] == pl.Categorical
+    assert pl.read_parquet_metadata(path)["source"] == "x"
+    assert sort_order(path) == []
+    assert file_stats(path).get_column("sort").to_list() == ["[]"]
+
+    # Explicit kwargs take precedence over the profile
+    assert WRITER_PROFILES["archive"].options()["compression_level"] == 19
+    write_parquet(DF, path, profile="archive", row_group_size=3)
+    assert file_stats(path).height == 2
+    with pytest.raises(ValueError, match="Unknown writer profile"):
+        writer_profile("missing")